@@ -2,6 +2,8 @@
 ASGI config for ecommerce_system project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve the store through it (e.g. ``uvicorn ecommerce_system.asgi:application``):
+the /live/ event streams are async and would each hold a worker thread under WSGI.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
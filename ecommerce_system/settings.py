@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +44,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'store.middleware.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -62,6 +65,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'store.context_processors.header',
+                'store.context_processors.fragments',
             ],
         },
     },
@@ -73,13 +78,96 @@ WSGI_APPLICATION = 'ecommerce_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# DB_ENGINE picks the backend: 'sqlite' (default) for a single node, or 'postgres'.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    def postgres(host):
+        return {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'ecommerce'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': host,
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # psycopg's pool replaces persistent connections, so CONN_MAX_AGE stays 0.
+                'pool': {
+                    'min_size': int(os.environ.get('DB_POOL_MIN', 2)),
+                    'max_size': int(os.environ.get('DB_POOL_MAX', 10)),
+                    'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+                },
+            },
+        }
+
+    DATABASES = {'default': postgres(os.environ.get('DB_HOST', 'localhost'))}
+    replicas = [host for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host]
+    for i, host in enumerate(replicas):
+        DATABASES[f'replica_{i}'] = postgres(host)
+else:
+    def sqlite(name):
+        return {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': name,
+            # Under ASGI each request may run on a different thread, so persistent connections pile up
+            # instead of being reused; DB_CONN_MAX_AGE opts in for WSGI deployments.
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+            'OPTIONS': {
+                # Take the write lock when a transaction starts, so concurrent wallet writes
+                # wait on the busy timeout instead of failing on a lock upgrade.
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+                # WAL lets readers run alongside the single writer; NORMAL sync is safe under WAL.
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA temp_store=MEMORY;'
+                    'PRAGMA cache_size=-20000;'
+                    'PRAGMA mmap_size=134217728;'
+                ),
+            },
+        }
+
+    DATABASES = {'default': sqlite(os.environ.get('DB_SQLITE_PATH', BASE_DIR / 'db.sqlite3'))}
+    # A file rather than shared-cache memory, which fails concurrent writers immediately.
+    DATABASES['default']['TEST'] = {'NAME': BASE_DIR / 'test_db.sqlite3'}
+    # Local stand-ins for replicas: copies of the primary refreshed by `manage.py sync_replicas`.
+    replicas = [path for path in os.environ.get('DB_SQLITE_REPLICAS', '').split(',') if path]
+    for i, path in enumerate(replicas):
+        DATABASES[f'replica_{i}'] = sqlite(path)
+
+for alias in DATABASES:
+    if alias != 'default':
+        DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['store.routers.PrimaryReplicaRouter']
+
+# Aliases that read-only views may read from.
+STORE_READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pycrib-default',
     }
 }
 
+# Sessions are read from the cache and written through to the database, so a cache miss
+# or restart never logs anyone out.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+
+# Authentication
+# The per-request user lookup is served from a cached principal (user, profile, cart, library
+# and wishlist) instead of the auth_user table.
+
+AUTHENTICATION_BACKENDS = ['store.principal.CachedModelBackend']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -129,3 +217,16 @@ LOGIN_URL = 'store:login'
 MEDIA_URL = '/media/'
 
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Request profiling: the fraction of requests sampled, and how many samples each view keeps.
+STORE_PROFILING_SAMPLE_RATE = 0.05
+
+STORE_PROFILING_BUFFER_SIZE = 1000
+
+# Where each server process publishes its profiling summary for `manage.py perf_report`; every
+# process on the host must see the same directory.
+STORE_PROFILING_DIR = os.environ.get('STORE_PROFILING_DIR', os.path.join(tempfile.gettempdir(), 'pycrib-perf'))
+
+# Live updates go through the database so that changes made by any web process or job worker reach
+# tabs streaming from every other web process. InMemoryChannelLayer only suits a single web process.
+STORE_LIVE_CHANNEL_LAYER = 'store.live.DatabaseChannelLayer'
@@ -1,18 +1,258 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Product, Cart, CartItem, UserProfile, Transaction, UserLibrary, Wishlist, Review, StoreBanner
+from django.contrib.auth import get_permission_codename
+from django.core.paginator import Paginator
+from django.db import connections, router
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-admin.site.register(Product)
-admin.site.register(Cart)
-admin.site.register(CartItem)
-admin.site.register(UserProfile)
-admin.site.register(Transaction)
+from . import fragments, pricing, search, shelves
+from .models import (
+    Product, Cart, CartItem, UserProfile, Transaction, UserLibrary, Wishlist, Review, StoreBanner, WalletEntry,
+    SalesRollup, Shelf, Job, Discount, EffectivePrice,
+)
 
-class UserLibraryAdmin(admin.ModelAdmin):
+ADMIN_SEARCH_LIMIT = 500
+
+
+def estimated_rows(model):
+    """The planner's row estimate for a table, or None when the database has none."""
+    connection = connections[router.db_for_read(model)]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+        elif connection.vendor == 'sqlite':
+            # sqlite_stat1 only exists once ANALYZE has run.
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            # One row per index, each leading with its entry count; partial indexes count fewer rows.
+            cursor.execute("SELECT MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = %s", [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    estimate = int(row[0])
+    # Postgres reports -1 for a table that has never been analyzed.
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Counts an unfiltered change list from table statistics instead of scanning every row."""
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimated_rows(self.object_list.model)
+            if estimate is not None and estimate >= getattr(settings, 'STORE_ADMIN_EXACT_COUNT_BELOW', 100_000):
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered COUNT(*) the change list runs to show "N total".
+    show_full_result_count = False
+    list_per_page = 50
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ('name', 'category', 'price', 'is_featured', 'updated')
+    list_filter = ('is_featured', 'category')
+    search_fields = ('name',)
+    ordering = ('-id',)
+    actions = ('feature_products', 'unfeature_products')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Served by the search token index (also for autocomplete widgets) instead of LIKE '%term%'.
+        if not search_term.strip():
+            return queryset, False
+        product_ids = [product_id for product_id, score in search.search(search_term, limit=ADMIN_SEARCH_LIMIT)]
+        if search_term.strip().isdigit():
+            product_ids.append(int(search_term))
+        return queryset.filter(id__in=product_ids), False
+
+    def set_featured(self, request, queryset, featured):
+        # update() sends no signals, so refresh what the storefront derives from the flag.
+        count = queryset.update(is_featured=featured, updated=timezone.now())
+        shelves.rebuild([shelves.FEATURED])
+        fragments.bump(fragments.CATALOG)
+        self.message_user(request, f"{count} games updated.")
+
+    @admin.action(description="Feature selected games")
+    def feature_products(self, request, queryset):
+        self.set_featured(request, queryset, True)
+
+    @admin.action(description="Stop featuring selected games")
+    def unfeature_products(self, request, queryset):
+        self.set_featured(request, queryset, False)
+
+
+@admin.register(Cart)
+class CartAdmin(LargeTableAdmin):
+    list_display = ('user', 'created_at')
+    list_select_related = ('user',)
+    search_fields = ('user__username__exact',)
+    autocomplete_fields = ('user',)
+
+
+@admin.register(CartItem)
+class CartItemAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'cart', 'quantity')
+    list_select_related = ('cart__user', 'product')
+    search_fields = ('cart__user__username__exact',)
+    autocomplete_fields = ('cart', 'product')
+
+
+@admin.register(UserProfile)
+class UserProfileAdmin(LargeTableAdmin):
+    list_display = ('user', 'balance')
+    list_select_related = ('user',)
+    search_fields = ('user__username__exact',)
+    autocomplete_fields = ('user',)
+
+
+@admin.register(Transaction)
+class TransactionAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'product', 'price', 'discount', 'date')
+    list_select_related = ('user', 'product', 'discount')
+    search_fields = ('user__username__exact',)
+    autocomplete_fields = ('user', 'product')
+    ordering = ('-id',)
+
+
+@admin.register(UserLibrary)
+class UserLibraryAdmin(LargeTableAdmin):
+    list_display = ('user',)
+    list_select_related = ('user',)
+    search_fields = ('user__username__exact',)
+    # A search box per lookup instead of a <select> holding every product in the catalog.
+    autocomplete_fields = ('user', 'products')
+
+
+@admin.register(Wishlist)
+class WishlistAdmin(LargeTableAdmin):
     list_display = ('user',)
-    filter_horizontal = ('products',)
+    list_select_related = ('user',)
+    search_fields = ('user__username__exact',)
+    autocomplete_fields = ('user', 'products')
+
+
+@admin.register(Review)
+class ReviewAdmin(LargeTableAdmin):
+    list_display = ('__str__', 'rating', 'created_at')
+    list_select_related = ('user', 'product')
+    list_filter = ('rating',)
+    search_fields = ('user__username__exact',)
+    autocomplete_fields = ('user', 'product')
+    ordering = ('-id',)
+
+
+@admin.register(StoreBanner)
+class StoreBannerAdmin(admin.ModelAdmin):
+    list_display = ('title', 'is_active', 'updated')
+    list_filter = ('is_active',)
+    actions = ('activate_banners', 'deactivate_banners')
+
+    def set_active(self, request, queryset, active):
+        count = queryset.update(is_active=active, updated=timezone.now())
+        fragments.bump(fragments.CATALOG)
+        self.message_user(request, f"{count} banners updated.")
+
+    @admin.action(description="Activate selected banners")
+    def activate_banners(self, request, queryset):
+        self.set_active(request, queryset, True)
+
+    @admin.action(description="Deactivate selected banners")
+    def deactivate_banners(self, request, queryset):
+        self.set_active(request, queryset, False)
+
+
+@admin.register(Discount)
+class DiscountAdmin(admin.ModelAdmin):
+    list_display = ('name', 'scope', 'product', 'category', 'percent_off', 'starts_at', 'ends_at', 'is_active')
+    list_select_related = ('product',)
+    list_filter = ('is_active', 'scope', 'category')
+    search_fields = ('name',)
+    autocomplete_fields = ('product',)
+    ordering = ('-starts_at',)
+
+
+class ReadOnlyAdmin(LargeTableAdmin):
+    """Ledgers and derived tables: written by the store itself, only browsed here."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_run_permission(self, request):
+        # Actions that recompute a table need the model's change permission, though its rows are never edited here.
+        return request.user.has_perm(f"{self.opts.app_label}.{get_permission_codename('change', self.opts)}")
+
+
+@admin.register(WalletEntry)
+class WalletEntryAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'user', 'kind', 'amount', 'balance_after', 'product', 'created_at')
+    list_select_related = ('user', 'product')
+    list_filter = ('kind',)
+    search_fields = ('user__username__exact',)
+    ordering = ('-id',)
+
+
+@admin.register(SalesRollup)
+class SalesRollupAdmin(ReadOnlyAdmin):
+    list_display = ('bucket', 'period', 'product', 'category', 'revenue', 'units', 'refunds', 'refunded')
+    list_select_related = ('product',)
+    list_filter = ('period', 'category')
+    ordering = ('-bucket', 'product_id')
+
+
+@admin.register(Shelf)
+class ShelfAdmin(ReadOnlyAdmin):
+    list_display = ('name', 'built_at', '__str__')
+    actions = ('rebuild_shelves',)
+
+    @admin.action(description="Rebuild selected shelves", permissions=['run'])
+    def rebuild_shelves(self, request, queryset):
+        built = shelves.rebuild([shelf.name for shelf in queryset])
+        self.message_user(request, f"Rebuilt {len(built)} shelves.")
+
+
+@admin.register(Job)
+class JobAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'task', 'status', 'attempts', 'run_at', 'locked_by', 'finished_at')
+    list_filter = ('status', 'task')
+    search_fields = ('key__exact',)
+    ordering = ('-id',)
+    actions = ('retry_jobs',)
+
+    @admin.action(description="Retry selected failed jobs now", permissions=['run'])
+    def retry_jobs(self, request, queryset):
+        # Only failed jobs: running a finished one again would count its sales twice or resend its email.
+        count = queryset.filter(status=Job.FAILED).update(
+            status=Job.PENDING, attempts=0, run_at=timezone.now(), finished_at=None,
+        )
+        self.message_user(request, f"{count} jobs queued again.")
+
 
-admin.site.register(UserLibrary, UserLibraryAdmin)
+@admin.register(EffectivePrice)
+class EffectivePriceAdmin(ReadOnlyAdmin):
+    list_display = ('product', 'price', 'percent_off', 'discount', 'valid_until')
+    list_select_related = ('product', 'discount')
+    search_fields = ('product__name',)
+    ordering = ('product_id',)
+    actions = ('materialize_prices',)
 
-admin.site.register(Wishlist)
-admin.site.register(Review)
-admin.site.register(StoreBanner)
\ No newline at end of file
+    @admin.action(description="Recompute all sale prices now", permissions=['run'])
+    def materialize_prices(self, request, queryset):
+        count = pricing.materialize()
+        self.message_user(request, f"{count} products on sale.")
@@ -0,0 +1,199 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, Min, Sum, When
+from django.utils import timezone
+
+from .models import SalesRollup, Transaction, WalletEntry, CATEGORY_CHOICES
+
+HOUR = SalesRollup.HOUR
+DAY = SalesRollup.DAY
+STEPS = {HOUR: timedelta(hours=1), DAY: timedelta(days=1)}
+TOP_PRODUCTS = 10
+CHUNK_SIZE = 5000
+
+
+def buckets(when):
+    hour = when.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return ((HOUR, hour), (DAY, hour.replace(hour=0)))
+
+
+def _add(changes, product_id, when, **deltas):
+    for key in buckets(when):
+        row = changes[key].setdefault(product_id, {})
+        for field, value in deltas.items():
+            row[field] = row.get(field, 0) + value
+
+
+def _apply(changes, categories):
+    # One insert for any missing rows, then one UPDATE per bucket whatever the number of products,
+    # so a checkout's cost does not grow with the size of the cart.
+    SalesRollup.objects.bulk_create([
+        SalesRollup(period=period, bucket=bucket, product_id=product_id, category=categories[product_id])
+        for (period, bucket), rows in changes.items() for product_id in rows
+    ], ignore_conflicts=True)
+    for (period, bucket), rows in changes.items():
+        fields = {field for deltas in rows.values() for field in deltas}
+        SalesRollup.objects.filter(period=period, bucket=bucket, product_id__in=rows).update(**{
+            field: Case(
+                *[When(product_id=product_id, then=F(field) + deltas[field])
+                  for product_id, deltas in rows.items() if field in deltas],
+                default=F(field),
+            )
+            for field in fields
+        })
+
+
+def record_sales(sales):
+    """Add (product, amount, when) purchases to the hourly and daily rollups."""
+    changes, categories = defaultdict(dict), {}
+    for product, amount, when in sales:
+        categories[product.id] = product.category
+        _add(changes, product.id, when, revenue=amount, units=1)
+    if changes:
+        _apply(changes, categories)
+
+
+def record_refund(product, price, purchased_at, when=None):
+    # Refunds delete the Transaction, so the sale leaves the bucket it was made in; the refund
+    # itself is counted when it happens. A backfill from Transaction and WalletEntry agrees.
+    changes = defaultdict(dict)
+    _add(changes, product.id, purchased_at, revenue=-price, units=-1)
+    _add(changes, product.id, when or timezone.now(), refunds=1, refunded=price)
+    _apply(changes, {product.id: product.category})
+
+
+def _stream(queryset, fields, chunk_size):
+    # Keyset chunks keep memory flat and never hold a long-running cursor open.
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', *fields)[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        last_id = chunk[-1][0]
+
+
+def _day_rollups(sales, refunds, chunk_size):
+    totals = defaultdict(lambda: [Decimal('0.00'), 0, 0, Decimal('0.00')])
+    categories = {}
+    streamed = 0
+    for row_id, product_id, category, price, when in _stream(sales, ('product_id', 'product__category', 'price', 'date'), chunk_size):
+        categories[product_id] = category
+        for period, bucket in buckets(when):
+            row = totals[period, bucket, product_id]
+            row[0] += price
+            row[1] += 1
+        streamed += 1
+    for row_id, product_id, category, amount, when in _stream(refunds, ('product_id', 'product__category', 'amount', 'created_at'), chunk_size):
+        categories[product_id] = category
+        for period, bucket in buckets(when):
+            row = totals[period, bucket, product_id]
+            row[2] += 1
+            row[3] += amount
+        streamed += 1
+    rollups = [
+        SalesRollup(period=period, bucket=bucket, product_id=product_id, category=categories[product_id],
+                    revenue=revenue, units=units, refunds=refund_count, refunded=refunded)
+        for (period, bucket, product_id), (revenue, units, refund_count, refunded) in totals.items()
+    ]
+    return rollups, streamed
+
+
+def _first(queryset, field, after):
+    if after is not None:
+        queryset = queryset.filter(**{f'{field}__gte': after})
+    return queryset.aggregate(first=Min(field))['first']
+
+
+def backfill(since=None, chunk_size=CHUNK_SIZE):
+    """Rebuild every rollup from `since` (a date; everything when None) out of Transaction and WalletEntry.
+
+    History is totalled and written one UTC day at a time, so memory holds a single day's
+    rollups; days with no sales or refunds are skipped, and their stale rollups deleted."""
+    start = datetime.combine(since, time.min, tzinfo=dt_timezone.utc) if since else None
+    sales = Transaction.objects.all()
+    refunds = WalletEntry.objects.filter(kind=WalletEntry.REFUND, product__isnull=False)
+
+    def next_day(after):
+        moments = [moment for moment in (_first(sales, 'date', after), _first(refunds, 'created_at', after)) if moment]
+        return buckets(min(moments))[1][1] if moments else None
+
+    streamed = written = 0
+    cleared_from, day = start, next_day(start)
+    while True:
+        rollups, following = [], None
+        if day is not None:
+            end = day + STEPS[DAY]
+            rollups, count = _day_rollups(
+                sales.filter(date__gte=day, date__lt=end), refunds.filter(created_at__gte=day, created_at__lt=end), chunk_size,
+            )
+            following = next_day(end)
+            streamed += count
+        with transaction.atomic():
+            # Everything up to the next day with history, so rollups left over in the gap go too.
+            stale = SalesRollup.objects.all()
+            if cleared_from is not None:
+                stale = stale.filter(bucket__gte=cleared_from)
+            if following is not None:
+                stale = stale.filter(bucket__lt=following)
+            stale.delete()
+            SalesRollup.objects.bulk_create(rollups, batch_size=1000)
+        written += len(rollups)
+        if following is None:
+            return {'rows': streamed, 'rollups': written}
+        cleared_from = day = following
+
+
+def series(period, since, until):
+    """Revenue, units and refunds per bucket from since to until, with empty buckets filled in."""
+    rows = (
+        SalesRollup.objects.filter(period=period, bucket__gte=since, bucket__lte=until)
+        .values('bucket')
+        .annotate(revenue=Sum('revenue'), units=Sum('units'), refunded=Sum('refunded'))
+        .order_by('bucket')
+    )
+    found = {row['bucket']: row for row in rows}
+    points = []
+    bucket = since
+    while bucket <= until:
+        points.append(found.get(bucket) or {'bucket': bucket, 'revenue': Decimal('0.00'), 'units': 0,
+                                            'refunded': Decimal('0.00')})
+        bucket += STEPS[period]
+    return points
+
+
+def dashboard(days=30, hours=48):
+    now = timezone.now()
+    (_, this_hour), (_, today) = buckets(now)
+    since = today - timedelta(days=days - 1)
+    window = SalesRollup.objects.filter(period=DAY, bucket__gte=since)
+    totals = ('revenue', 'units', 'refunds', 'refunded')
+
+    daily = series(DAY, since, today)
+    hourly = series(HOUR, this_hour - timedelta(hours=hours - 1), this_hour)
+    categories = list(
+        window.values('category').annotate(**{field: Sum(field) for field in totals}).order_by('-revenue')
+    )
+    names = dict(CATEGORY_CHOICES)
+    for row in categories:
+        row['name'] = names.get(row['category'], row['category'])
+    products = list(
+        window.values('product_id', 'product__name').annotate(**{field: Sum(field) for field in totals})
+        .order_by('-revenue', 'product_id')[:TOP_PRODUCTS]
+    )
+    return {
+        'days': days,
+        'since': since,
+        'daily': daily,
+        'daily_max': max((point['revenue'] for point in daily), default=0),
+        'hourly': hourly,
+        'hourly_max': max((point['revenue'] for point in hourly), default=0),
+        'categories': categories,
+        'category_max': max((row['revenue'] for row in categories), default=0),
+        'products': products,
+        'revenue': sum((point['revenue'] for point in daily), Decimal('0.00')),
+        'refunded': sum((point['refunded'] for point in daily), Decimal('0.00')),
+    }
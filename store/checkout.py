@@ -0,0 +1,123 @@
+from dataclasses import dataclass, field, asdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import header, jobs, live, ownership, pricing, wallet
+from .models import Cart, CartItem, UserLibrary, Transaction, WalletEntry
+from .wallet import InsufficientFunds  # noqa: F401
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCart(CheckoutError):
+    pass
+
+
+class AlreadyOwned(CheckoutError):
+    pass
+
+
+@dataclass
+class ReceiptLine:
+    product_id: int
+    name: str
+    quantity: int
+    unit_price: Decimal
+    total: Decimal
+    transaction_id: int = None
+    list_price: Decimal = None
+    discount_id: int = None
+
+
+@dataclass
+class Receipt:
+    user_id: int
+    total: Decimal
+    balance_after: Decimal
+    lines: list = field(default_factory=list)
+    created_at: object = field(default_factory=timezone.now)
+
+    def as_dict(self):
+        data = asdict(self)
+        data['total'] = str(self.total)
+        data['balance_after'] = str(self.balance_after)
+        data['created_at'] = self.created_at.isoformat()
+        for line in data['lines']:
+            line['unit_price'] = str(line['unit_price'])
+            line['total'] = str(line['total'])
+            line['list_price'] = str(line['list_price'])
+        return data
+
+
+def checkout(user):
+    with transaction.atomic():
+        # Lock the cart so a concurrent checkout for the same user waits and then finds it empty.
+        cart = Cart.objects.select_for_update().filter(user=user).first()
+        items = list(cart.cartitem_set.select_related('product').order_by('id')) if cart else []
+        if not items:
+            raise EmptyCart("Your cart is empty.")
+
+        # Checked under the cart lock against the table: the cached ownership add_to_cart used may be stale.
+        Through = UserLibrary.products.through
+        owned = set(Through.objects.filter(
+            userlibrary__user=user, product_id__in=[item.product_id for item in items],
+        ).values_list('product_id', flat=True))
+        if owned:
+            names = ', '.join(item.product.name for item in items if item.product_id in owned)
+            raise AlreadyOwned(f"You already own {names}. Remove it from your cart and try again.")
+
+        # Read from the table rather than the cache: the price charged is the one in force as this transaction sees it.
+        on_sale = pricing.sales([item.product_id for item in items], cached=False)
+        lines = []
+        for item in items:
+            sale = on_sale.get(item.product_id)
+            unit_price = sale.price if sale else item.product.price
+            lines.append(ReceiptLine(
+                product_id=item.product_id,
+                name=item.product.name,
+                quantity=item.quantity,
+                unit_price=unit_price,
+                total=unit_price * item.quantity,
+                list_price=item.product.price,
+                discount_id=sale.discount_id if sale else None,
+            ))
+        total = sum((line.total for line in lines), Decimal('0.00'))
+
+        entry = wallet.debit(user, total, WalletEntry.PURCHASE)
+
+        purchases = Transaction.objects.bulk_create([
+            Transaction(user=user, product_id=line.product_id, price=line.total, discount_id=line.discount_id)
+            for line in lines
+        ])
+        for line, purchase in zip(lines, purchases):
+            line.transaction_id = purchase.id
+
+        library, created = UserLibrary.objects.get_or_create(user=user)
+        Through.objects.bulk_create(
+            [Through(userlibrary_id=library.id, product_id=line.product_id) for line in lines],
+            ignore_conflicts=True,
+        )
+
+        deleted, per_model = CartItem.objects.filter(id__in=[item.id for item in items]).delete()
+        if per_model.get(CartItem._meta.label, 0) != len(items):
+            raise CheckoutError("Your cart changed during checkout. Please try again.")
+
+        receipt = Receipt(user_id=user.id, total=total, balance_after=entry.balance_after, lines=lines)
+        # Enqueued in the purchase's transaction, so the side effects run if and only if it commits.
+        # bulk_create sends no signals, so the sales rollups are fed from here.
+        order = purchases[0].id
+        jobs.enqueue('record_sales', key=f'sales:{order}', sales=[
+            [purchase.product_id, str(purchase.price), purchase.date.isoformat()] for purchase in purchases
+        ])
+        jobs.enqueue('send_receipt', key=f'receipt:{order}', user_id=user.id, receipt=receipt.as_dict())
+        # The library rows were bulk-inserted, so no m2m_changed tells open tabs about them.
+        live.publish(user.id, 'library', added=[line.product_id for line in lines])
+
+    header.invalidate(user.id)
+    # The library links were bulk-inserted, which bypasses m2m_changed.
+    ownership.invalidate(user.id)
+    return receipt
@@ -0,0 +1,15 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import fragments as fragment_cache, header as header_cache
+
+
+def header(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'header': SimpleLazyObject(lambda: header_cache.get_snapshot(user))}
+
+
+def fragments(request):
+    # Part of every fragment key, so new image variants replace cards rendered before they existed.
+    return {'fragment_version': SimpleLazyObject(lambda: fragment_cache.version(fragment_cache.IMAGES))}
@@ -0,0 +1,145 @@
+import csv
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import Transaction, UserLibrary
+
+PAGE_SIZE = 2000
+FORMATS = {'csv': 'text/csv; charset=utf-8', 'json': 'application/json'}
+
+TRANSACTIONS = 'transactions'
+LIBRARY = 'library'
+
+# (column, lookup) per export; the first lookup must be the table's increasing primary key.
+COLUMNS = {
+    TRANSACTIONS: (
+        ('transaction_id', 'id'),
+        ('date', 'date'),
+        ('product_id', 'product_id'),
+        ('product', 'product__name'),
+        ('category', 'product__category'),
+        ('price', 'price'),
+    ),
+    LIBRARY: (
+        ('entry_id', 'id'),
+        ('product_id', 'product_id'),
+        ('product', 'product__name'),
+        ('category', 'product__category'),
+        ('current_price', 'product__price'),
+    ),
+}
+USER_COLUMNS = {
+    TRANSACTIONS: (('user_id', 'user_id'), ('username', 'user__username')),
+    LIBRARY: (('user_id', 'userlibrary__user_id'), ('username', 'userlibrary__user__username')),
+}
+
+
+def columns(kind, all_users=False):
+    own = COLUMNS[kind]
+    return own[:1] + USER_COLUMNS[kind] + own[1:] if all_users else own
+
+
+def queryset(kind, user=None, using='default'):
+    if kind == TRANSACTIONS:
+        rows = Transaction.objects.using(using)
+        return rows.filter(user=user) if user else rows
+    rows = UserLibrary.products.through.objects.using(using)
+    return rows.filter(userlibrary__user=user) if user else rows
+
+
+def _page(rows, lookups, last_id, page_size):
+    return list(
+        rows.filter(id__gt=last_id).order_by('id').values_list(*lookups)[:page_size]
+        .iterator(chunk_size=page_size)
+    )
+
+
+def pages(rows, lookups, page_size):
+    """Yield lists of value tuples, keyset-paginated on the primary key.
+
+    Each page is a short query streamed with iterator(), so memory stays flat and no cursor
+    is held open between pages, whatever the number of rows."""
+    last_id = 0
+    while True:
+        page = _page(rows, lookups, last_id, page_size)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last_id = page[-1][0]
+
+
+async def apages(rows, lookups, page_size):
+    """pages() for ASGI: each page is fetched in a thread, and nothing is buffered beyond it."""
+    last_id = 0
+    while True:
+        page = await sync_to_async(_page)(rows, lookups, last_id, page_size)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        last_id = page[-1][0]
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _csv(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def encoder(fmt, header):
+    """(opening, encode(batch, first), closing) for an export written a page at a time."""
+    if fmt == 'json':
+        # A JSON array written a page at a time.
+        def encode(batch, first):
+            return ('' if first else ',') + ','.join(json.dumps(dict(zip(header, map(_plain, row)))) for row in batch)
+        return '[', encode, ']'
+
+    def encode(batch, first):
+        return _csv([_plain(value) for value in row] for row in batch)
+    return _csv([header]), encode, ''
+
+
+def _prepare(kind, fmt, user, using):
+    chosen = columns(kind, all_users=user is None)
+    header = [name for name, lookup in chosen]
+    lookups = [lookup for name, lookup in chosen]
+    page_size = getattr(settings, 'STORE_EXPORT_PAGE_SIZE', PAGE_SIZE)
+    return encoder(fmt, header), queryset(kind, user, using), lookups, page_size
+
+
+def stream(kind, fmt, user=None, using='default'):
+    """Chunks of a CSV or JSON export of one user's (or, without a user, everyone's) rows."""
+    (opening, encode, closing), rows, lookups, page_size = _prepare(kind, fmt, user, using)
+    yield opening
+    for number, batch in enumerate(pages(rows, lookups, page_size)):
+        yield encode(batch, number == 0)
+    if closing:
+        yield closing
+
+
+async def astream(kind, fmt, user=None, using='default'):
+    """stream() as an async iterator, so an ASGI server sends each page as it is read.
+
+    Given a sync iterator, Django's ASGI handler collects the whole response before the first byte."""
+    (opening, encode, closing), rows, lookups, page_size = _prepare(kind, fmt, user, using)
+    yield opening
+    number = 0
+    async for batch in apages(rows, lookups, page_size):
+        yield encode(batch, number == 0)
+        number += 1
+    if closing:
+        yield closing
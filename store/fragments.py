@@ -0,0 +1,84 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .models import CacheVersion
+from .routers import primary
+
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+# Ratings change without touching Product, so whole pages expire quickly instead.
+PAGE_TIMEOUT = 60
+# How long a process trusts its cached copy of a version before checking the table again.
+VERSION_CHECK_SECONDS = 5
+
+CATALOG = 'catalog'
+IMAGES = 'images'
+
+
+def _check_seconds():
+    return getattr(settings, 'STORE_VERSION_CHECK_SECONDS', VERSION_CHECK_SECONDS)
+
+
+def _version_key(name):
+    return f"store:fragments:version:{name}"
+
+
+def version(name):
+    """The current version of `name`, re-read from the database at most every VERSION_CHECK_SECONDS.
+
+    The table is what carries a bump made by a worker or a management command to every web process,
+    whatever the cache backend; the cached copy only saves the lookup."""
+    key = _version_key(name)
+    current = cache.get(key)
+    if current is None:
+        with primary():
+            # A timestamp never repeats an evicted version, so stale entries cannot come back.
+            current = CacheVersion.objects.get_or_create(name=name, defaults={'stamp': time.time_ns()})[0].stamp
+        cache.set(key, current, _check_seconds())
+    return current
+
+
+def bump(*names):
+    now = time.time_ns()
+    for name in names:
+        CacheVersion.objects.update_or_create(name=name, defaults={'stamp': now})
+    cache.set_many({_version_key(name): now for name in names}, _check_seconds())
+
+
+def page_key(path):
+    digest = hashlib.md5(path.encode()).hexdigest()
+    return f"store:page:{version(CATALOG)}:{version(IMAGES)}:{digest}"
+
+
+def _lookup(request):
+    # A pending flash message makes the page personal; render it fresh and do not store it.
+    if len(messages.get_messages(request)):
+        return None, None
+    key = page_key(request.get_full_path())
+    return key, cache.get(key)
+
+
+def cache_anonymous_page(view):
+    """Serve anonymous GETs of an async view from a whole-page cache keyed on the catalog version."""
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET' or (await request.auser()).is_authenticated:
+            return await view(request, *args, **kwargs)
+
+        key, content = await sync_to_async(_lookup)(request)
+        if content is not None:
+            return HttpResponse(content)
+
+        response = await view(request, *args, **kwargs)
+        if key is not None and response.status_code == 200:
+            await sync_to_async(cache.set)(key, response.content, PAGE_TIMEOUT)
+        return response
+
+    return wrapper
@@ -0,0 +1,48 @@
+from django.core.cache import cache
+from django.db.models import Sum
+
+from . import thumbnails
+from .models import Cart, CartItem, UserProfile
+from .routers import primary
+
+HEADER_CACHE_TIMEOUT = 60 * 15
+
+
+def header_cache_key(user_id):
+    return f"store:header:{user_id}"
+
+
+def cart_owner_id(cart_id):
+    # Carts are one-to-one with users and never change hands, so the owner can be cached indefinitely.
+    key = f"store:cart-owner:{cart_id}"
+    user_id = cache.get(key)
+    if user_id is None:
+        with primary():
+            user_id = Cart.objects.filter(id=cart_id).values_list('user_id', flat=True).first()
+        if user_id is not None:
+            cache.set(key, user_id, None)
+    return user_id
+
+
+@primary()
+def build_snapshot(user):
+    cart_count = CartItem.objects.filter(cart__user=user).aggregate(total=Sum('quantity'))['total'] or 0
+    profile = UserProfile.objects.filter(user=user).only('balance', 'avatar').first()
+    return {
+        'cart_count': cart_count,
+        'balance': profile.balance if profile else None,
+        'avatar_url': thumbnails.variant_url(profile.avatar, 'avatar', 64) if profile else '',
+    }
+
+
+def get_snapshot(user):
+    key = header_cache_key(user.id)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_snapshot(user)
+        cache.set(key, snapshot, HEADER_CACHE_TIMEOUT)
+    return snapshot
+
+
+def invalidate(user_id):
+    cache.delete(header_cache_key(user_id))
@@ -0,0 +1,88 @@
+import hashlib
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+HEADER = 'Idempotency-Key'
+FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 200
+# How long a response is replayed for, and how long a crashed request can hold its key.
+TIMEOUT = 60 * 60 * 24
+LOCK_TIMEOUT = 60
+
+IN_PROGRESS = 'in-progress'
+DONE = 'done'
+SKIPPED_FIELDS = {FIELD, 'csrfmiddlewaretoken'}
+
+
+def request_key(request):
+    return request.headers.get(HEADER) or request.POST.get(FIELD) or request.GET.get(FIELD)
+
+
+def fingerprint(request):
+    # The same key sent with a different request is a client bug, not a retry.
+    parts = [request.method, request.path]
+    for data in (request.GET, request.POST):
+        parts.extend(f'{name}={value}' for name, values in sorted(data.lists()) if name not in SKIPPED_FIELDS for value in values)
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+
+def error(request, message, status):
+    if request.headers.get('Accept') == 'application/json':
+        return JsonResponse({'error': message}, status=status)
+    return HttpResponse(message, status=status, content_type='text/plain; charset=utf-8')
+
+
+def replay(saved):
+    response = HttpResponse(saved['content'], status=saved['status'])
+    for header, value in saved['headers']:
+        response[header] = value
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """Run a write once per Idempotency-Key header (or idempotency_key field) and replay its response to retries."""
+    scope = f'{view.__module__}.{view.__name__}'
+
+    @wraps(view)
+    def once(request, *args, **kwargs):
+        key = request_key(request)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return error(request, "Idempotency key is too long.", 400)
+
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        cache_key = f"store:idempotency:{scope}:{request.user.pk}:{digest}"
+        request_fingerprint = fingerprint(request)
+        # add() is atomic, so of two concurrent duplicates only one runs the view.
+        if not cache.add(cache_key, {'state': IN_PROGRESS, 'fingerprint': request_fingerprint}, LOCK_TIMEOUT):
+            saved = cache.get(cache_key)
+            if saved is not None and saved['fingerprint'] != request_fingerprint:
+                return error(request, "This idempotency key was already used for a different request.", 422)
+            if saved is None or saved['state'] == IN_PROGRESS:
+                response = error(request, "This request is already being processed.", 409)
+                response['Retry-After'] = '1'
+                return response
+            return replay(saved)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        if response.status_code >= 500 or response.streaming:
+            # Server errors may be transient; let a retry run the view again.
+            cache.delete(cache_key)
+        else:
+            cache.set(cache_key, {
+                'state': DONE,
+                'fingerprint': request_fingerprint,
+                'status': response.status_code,
+                'headers': list(response.items()),
+                'content': response.content,
+            }, TIMEOUT)
+        return response
+    return once
@@ -0,0 +1,105 @@
+import logging
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+BATCH_SIZE = 10
+RETRY_DELAY = timedelta(seconds=30)
+STALE_AFTER = timedelta(minutes=10)
+KEEP_FINISHED = timedelta(days=7)
+
+
+def task(name=None, max_attempts=5):
+    """Register a function as a job task. Its arguments must be JSON-serializable keywords."""
+    def register(function):
+        TASKS[name or function.__name__] = (function, max_attempts)
+        return function
+    return register
+
+
+def enqueue(task_name, key=None, delay=None, **payload):
+    # Called inside a transaction, the job only becomes visible to workers if that transaction commits.
+    function, max_attempts = TASKS[task_name]
+    job = Job(task=task_name, payload=payload, key=key, max_attempts=max_attempts, run_at=timezone.now() + (delay or timedelta()))
+    # A repeated key is a no-op rather than an IntegrityError that would break the caller's transaction.
+    Job.objects.bulk_create([job], ignore_conflicts=True)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim(worker, limit=BATCH_SIZE):
+    """Mark up to `limit` due jobs as running for this worker and return them."""
+    now = timezone.now()
+    with transaction.atomic():
+        # On Postgres, SKIP LOCKED lets workers claim disjoint batches without queueing behind each other;
+        # everywhere, the status check in the UPDATE decides which worker wins a job.
+        due = Job.objects.select_for_update(skip_locked=True).filter(status=Job.PENDING, run_at__lte=now)
+        ids = list(due.order_by('run_at', 'id').values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+        Job.objects.filter(id__in=ids, status=Job.PENDING).update(
+            status=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+        )
+    return list(Job.objects.filter(id__in=ids, status=Job.RUNNING, locked_by=worker, locked_at=now).order_by('run_at', 'id'))
+
+
+def run(job):
+    """Run a claimed job; on failure it is retried with exponential backoff until max_attempts."""
+    claimed = Job.objects.filter(id=job.id, status=Job.RUNNING, locked_by=job.locked_by, locked_at=job.locked_at)
+    try:
+        with transaction.atomic():
+            if job.task not in TASKS:
+                raise LookupError(f"No task named {job.task!r} is registered.")
+            TASKS[job.task][0](**job.payload)
+            # Finishing the job in the task's own transaction means its database writes happen once.
+            claimed.update(status=Job.DONE, finished_at=timezone.now(), last_error='')
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error("Job %s (%s) failed for good after %d attempts", job.id, job.task, job.attempts)
+            claimed.update(status=Job.FAILED, finished_at=timezone.now(), last_error=error)
+        else:
+            delay = getattr(settings, 'STORE_JOB_RETRY_DELAY', RETRY_DELAY) * 2 ** (job.attempts - 1)
+            claimed.update(status=Job.PENDING, run_at=timezone.now() + delay, locked_by='', locked_at=None, last_error=error)
+        return False
+    return True
+
+
+def work(worker=None, limit=None, batch_size=BATCH_SIZE):
+    """Run due jobs until none are left, or until `limit` have run. Returns how many ran."""
+    worker = worker or worker_name()
+    ran = 0
+    while limit is None or ran < limit:
+        jobs = claim(worker, batch_size if limit is None else min(batch_size, limit - ran))
+        if not jobs:
+            break
+        for job in jobs:
+            run(job)
+            ran += 1
+    return ran
+
+
+def requeue_stale(older_than=STALE_AFTER):
+    """Put back jobs left running by a worker that died."""
+    return Job.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - older_than).update(
+        status=Job.PENDING, locked_by='', locked_at=None,
+    )
+
+
+def prune(older_than=KEEP_FINISHED):
+    """Delete finished jobs; failed ones are kept for inspection."""
+    deleted, _ = Job.objects.filter(status=Job.DONE, finished_at__lt=timezone.now() - older_than).delete()
+    return deleted
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from functools import cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import LiveEvent
+from .routers import primary
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 100
+# Open streams are closed after this long and the browser reconnects, which also re-syncs its counters.
+STREAM_SECONDS = 60 * 5
+KEEPALIVE_SECONDS = 15
+RECONNECT_MS = 3000
+# How often each web process looks for events published by the others, and how long they are kept.
+POLL_SECONDS = 1
+POLL_BATCH_SIZE = 500
+KEEP_EVENTS = timedelta(minutes=10)
+
+RESYNC = 'resync'
+
+
+class Subscription:
+    """One open stream's queue, fed from any thread and drained on the stream's event loop."""
+
+    def __init__(self, layer, group, size=QUEUE_SIZE):
+        self.layer = layer
+        self.group = group
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(size)
+
+    def deliver(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The loop is gone, so nobody will read this stream again.
+            self.close()
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A tab too slow to keep up gets one resync in place of the deltas it missed.
+            self.queue = asyncio.Queue(self.queue.maxsize)
+            self.queue.put_nowait({'event': RESYNC, 'data': {}})
+
+    async def get(self, timeout):
+        """The next message, or None if none arrives within `timeout` seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.layer.unsubscribe(self)
+
+
+class InMemoryChannelLayer:
+    """Groups of open streams kept in process memory.
+
+    Only streams in the publishing process hear an event, so this suits a single web process
+    that makes every change itself; DatabaseChannelLayer carries events between processes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups = defaultdict(set)
+
+    def subscribe(self, group):
+        subscription = Subscription(self, group)
+        with self.lock:
+            self.groups[group].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            members = self.groups.get(subscription.group)
+            if members is not None:
+                members.discard(subscription)
+                if not members:
+                    del self.groups[subscription.group]
+
+    def publish(self, group, message):
+        with self.lock:
+            members = list(self.groups.get(group, ()))
+        for subscription in members:
+            subscription.deliver(message)
+        return len(members)
+
+
+class DatabaseChannelLayer(InMemoryChannelLayer):
+    """Groups of open streams that also hear events published by other processes, through LiveEvent.
+
+    Streams in the publishing process get an event at once. Every other web process picks it up within
+    POLL_SECONDS: each event loop holding open streams runs one poller, which stops with its last stream."""
+
+    def __init__(self):
+        super().__init__()
+        self.origin = uuid.uuid4().hex
+        self.pollers = {}
+
+    def subscribe(self, group):
+        subscription = super().subscribe(group)
+        # Rows from before the stream opened are covered by its snapshot.
+        subscription.since = timezone.now()
+        loop = subscription.loop
+        with self.lock:
+            if loop not in self.pollers:
+                self.pollers[loop] = loop.create_task(self.poll(loop, subscription.since))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        super().unsubscribe(subscription)
+        loop = subscription.loop
+        with self.lock:
+            if any(member.loop is loop for members in self.groups.values() for member in members):
+                return
+            poller = self.pollers.pop(loop, None)
+        if poller is not None:
+            try:
+                loop.call_soon_threadsafe(poller.cancel)
+            except RuntimeError:
+                pass
+
+    def publish(self, group, message):
+        LiveEvent.objects.create(group=group, origin=self.origin, message=message)
+        return super().publish(group, message)
+
+    def local_members(self, loop):
+        with self.lock:
+            members = {group: [member for member in members if member.loop is loop] for group, members in self.groups.items()}
+        return {group: members for group, members in members.items() if members}
+
+    async def poll(self, loop, start):
+        after = None
+        while True:
+            await asyncio.sleep(getattr(settings, 'STORE_LIVE_POLL_SECONDS', POLL_SECONDS))
+            members = self.local_members(loop)
+            if not members:
+                continue
+            try:
+                events = await sync_to_async(self.fetch)(list(members), start, after)
+            except DatabaseError:
+                logger.exception("Could not read live events")
+                continue
+            for event in events:
+                after = event.id
+                for subscription in members.get(event.group, ()):
+                    if event.created_at >= subscription.since:
+                        subscription.deliver(event.message)
+
+    def fetch(self, groups, start, after):
+        """Other processes' events for `groups`: those after event `after`, or since `start` on the first poll."""
+        events = LiveEvent.objects.filter(group__in=groups).exclude(origin=self.origin)
+        events = events.filter(created_at__gte=start) if after is None else events.filter(id__gt=after)
+        with primary():
+            return list(events.order_by('id')[:POLL_BATCH_SIZE])
+
+
+@cache
+def layer():
+    return import_string(getattr(settings, 'STORE_LIVE_CHANNEL_LAYER', 'store.live.DatabaseChannelLayer'))()
+
+
+def prune(older_than=KEEP_EVENTS):
+    """Delete events every web process has long since polled."""
+    deleted, _ = LiveEvent.objects.filter(created_at__lt=timezone.now() - older_than).delete()
+    return deleted
+
+
+def user_group(user_id):
+    return f"user.{user_id}"
+
+
+def publish(user_id, event, **data):
+    """Push an event to the user's open tabs once the current transaction commits."""
+    message = {'event': event, 'data': data}
+    transaction.on_commit(lambda: layer().publish(user_group(user_id), message), robust=True)
+
+
+def encode(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def stream(group, snapshot, seconds=None):
+    """Server-sent events: what `await snapshot()` returns, then whatever is published to the group, for `seconds`.
+
+    The subscription is taken before the snapshot is read, so no change falls between the two."""
+    seconds = getattr(settings, 'STORE_LIVE_STREAM_SECONDS', STREAM_SECONDS) if seconds is None else seconds
+    subscription = layer().subscribe(group)
+    try:
+        yield f"retry: {RECONNECT_MS}\n\n"
+        for event, data in await snapshot():
+            yield encode(event, data)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+        while (remaining := deadline - loop.time()) > 0:
+            message = await subscription.get(min(remaining, KEEPALIVE_SECONDS))
+            if message is not None:
+                yield encode(message['event'], message['data'])
+            elif deadline > loop.time():
+                # A comment line keeps proxies from closing an idle connection.
+                yield ": keepalive\n\n"
+    finally:
+        subscription.close()
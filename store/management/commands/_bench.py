@@ -0,0 +1,99 @@
+import random
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import connection, connections
+
+from store.models import Product, CATEGORY_CHOICES
+
+WORDS = (
+    'dark', 'souls', 'star', 'field', 'galaxy', 'legends', 'battle', 'royale', 'farm', 'simulator',
+    'night', 'city', 'racer', 'dungeon', 'quest', 'empire', 'ghost', 'hunter', 'pixel', 'knight',
+    'zombie', 'island', 'survival', 'space', 'station', 'tactics', 'arena', 'dragon', 'forge', 'shadow',
+)
+SYLLABLES = ('ka', 'ri', 'mo', 'ten', 'vel', 'dra', 'sun', 'lo', 'mir', 'zan', 'qu', 'or', 'bex', 'tal', 'ny', 'gor')
+# A catalog-sized vocabulary; a handful of words would make every term match half the products.
+VOCABULARY = WORDS + tuple(a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES)
+
+
+@contextmanager
+def scratch_database(verbosity=0):
+    # Benchmarks never touch the real database; they run against a throwaway test database.
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity)
+
+
+def fake_products(count, seed=0, start=0):
+    rng = random.Random(seed)
+    categories = [code for code, name in CATEGORY_CHOICES]
+    for i in range(start, start + count):
+        name = ' '.join([rng.choice(WORDS)] + rng.sample(VOCABULARY, 2)).title()
+        yield Product(
+            name=f"{name} {i}",
+            description=' '.join(rng.choices(VOCABULARY, k=20)),
+            price=Decimal(rng.randint(99, 3999)) / 100,
+            category=rng.choice(categories),
+        )
+
+
+def seed_products(count, batch_size=5000, seed=0):
+    batch = []
+    for product in fake_products(count, seed=seed):
+        batch.append(product)
+        if len(batch) >= batch_size:
+            Product.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Product.objects.bulk_create(batch)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    return {
+        'p50': statistics.median(ordered),
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'p99': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+        'mean': statistics.fmean(ordered),
+    }
+
+
+def close_thread_connections(executor, workers):
+    # A barrier makes every pool thread take one task, so each closes its own connection.
+    barrier = threading.Barrier(workers)
+
+    def close(_):
+        barrier.wait()
+        connections.close_all()
+
+    list(executor.map(close, range(workers)))
@@ -0,0 +1,38 @@
+import csv
+import json
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+FIELDS = ('id', 'name', 'description', 'price', 'category', 'is_featured', 'image')
+
+
+def detect_format(path, requested):
+    if requested:
+        return requested
+    return 'jsonl' if str(path).endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+@contextmanager
+def open_stream(path, mode):
+    if str(path) == '-':
+        yield sys.stdin if 'r' in mode else sys.stdout
+        return
+    with open(Path(path), mode, newline='', encoding='utf-8') as handle:
+        yield handle
+
+
+def read_rows(handle, fmt):
+    """Yield each row; a JSONL line that does not parse is yielded as its ValueError, so it does not end the stream."""
+    if fmt == 'jsonl':
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                row = ValueError(f"invalid JSON: {error}")
+            yield row
+    else:
+        yield from csv.DictReader(handle)
@@ -0,0 +1,83 @@
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from store import analytics, ratings, search, shelves
+from store.models import (
+    Product, Cart, CartItem, UserProfile, UserLibrary, Transaction, Wishlist, Review, ProductRating, WalletEntry,
+)
+
+from ._bench import seed_products, VOCABULARY
+
+USERNAME_PREFIX = 'load-user-'
+PASSWORD = 'load-test-pass'
+OPENING_BALANCE = Decimal('100000.00')
+
+
+def seed_store(users=100, products=1000, library_size=10, wishlist_size=3, cart_size=2, review_rate=0.3,
+               batch_size=500, seed=0):
+    """Bulk-load a synthetic store. Signals are bypassed, so derived tables are rebuilt at the end."""
+    rng = random.Random(seed)
+    seed_products(products, seed=seed)
+    catalog = list(Product.objects.values_list('id', 'price'))
+    password = make_password(PASSWORD)
+
+    start = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+    for offset in range(start, start + users, batch_size):
+        count = min(batch_size, start + users - offset)
+        with transaction.atomic():
+            _seed_users(rng, catalog, password, offset, count, library_size, wishlist_size, cart_size, review_rate)
+
+    _rebuild_ratings()
+    search.rebuild_index(batch_size=5000)
+    shelves.rebuild()
+    analytics.backfill()
+
+
+def _seed_users(rng, catalog, password, offset, count, library_size, wishlist_size, cart_size, review_rate):
+    users = User.objects.bulk_create([
+        User(username=f'{USERNAME_PREFIX}{offset + i}', password=password) for i in range(count)
+    ])
+    UserProfile.objects.bulk_create([UserProfile(user=user, balance=OPENING_BALANCE) for user in users])
+    WalletEntry.objects.bulk_create([
+        WalletEntry(user=user, kind=WalletEntry.OPENING, amount=OPENING_BALANCE, balance_after=OPENING_BALANCE)
+        for user in users
+    ])
+    libraries = UserLibrary.objects.bulk_create([UserLibrary(user=user) for user in users])
+    wishlists = Wishlist.objects.bulk_create([Wishlist(user=user) for user in users])
+    carts = Cart.objects.bulk_create([Cart(user=user) for user in users])
+
+    owned_links, wished_links, purchases, cart_items, reviews = [], [], [], [], []
+    LibraryLink = UserLibrary.products.through
+    WishlistLink = Wishlist.products.through
+    for user, library, wishlist, cart in zip(users, libraries, wishlists, carts):
+        picks = rng.sample(catalog, min(len(catalog), library_size + wishlist_size + cart_size))
+        owned = picks[:library_size]
+        for product_id, price in owned:
+            owned_links.append(LibraryLink(userlibrary_id=library.id, product_id=product_id))
+            purchases.append(Transaction(user=user, product_id=product_id, price=price))
+            if rng.random() < review_rate:
+                reviews.append(Review(
+                    user=user, product_id=product_id, rating=rng.randint(1, 5),
+                    comment=' '.join(rng.choices(VOCABULARY, k=12)),
+                ))
+        for product_id, price in picks[library_size:library_size + wishlist_size]:
+            wished_links.append(WishlistLink(wishlist_id=wishlist.id, product_id=product_id))
+        for product_id, price in picks[library_size + wishlist_size:]:
+            cart_items.append(CartItem(cart=cart, product_id=product_id))
+
+    LibraryLink.objects.bulk_create(owned_links)
+    WishlistLink.objects.bulk_create(wished_links)
+    Transaction.objects.bulk_create(purchases)
+    CartItem.objects.bulk_create(cart_items)
+    Review.objects.bulk_create(reviews)
+
+
+def _rebuild_ratings():
+    rebuilt = ratings.tally(Review.objects.all())
+    with transaction.atomic():
+        ProductRating.objects.all().delete()
+        ProductRating.objects.bulk_create(rebuilt.values(), batch_size=1000)
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+
+from store.models import Product
+
+from ._bench import scratch_database, close_thread_connections, summarize
+from ._seed import seed_store, USERNAME_PREFIX
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests/sec for the async storefront views through Django's ASGI handler "
+        "(asyncio tasks) and its WSGI handler (one thread per client), both in-process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--library-size', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=200, help="Requests per path and handler.")
+        parser.add_argument('--concurrency', type=int, default=8)
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        with scratch_database(), override_settings(ALLOWED_HOSTS=['testserver'], STORE_PROFILING_SAMPLE_RATE=0):
+            seed_store(users=concurrency, products=options['products'], library_size=options['library_size'],
+                       wishlist_size=options['library_size'] // 2)
+            users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id'))
+            product_id = Product.objects.order_by('id').values_list('id', flat=True).first()
+            paths = ['/home/', f'/product/{product_id}/', '/repository/', '/wishlist/']
+
+            self.stdout.write(f"{'path':<18}{'wsgi req/s':>12}{'p95 ms':>9}{'asgi req/s':>12}{'p95 ms':>9}")
+            for path in paths:
+                wsgi_rate, wsgi_timings = self.run_wsgi(path, users, options['requests'])
+                asgi_rate, asgi_timings = asyncio.run(self.run_asgi(path, users, options['requests']))
+                self.stdout.write(
+                    f"{path:<18}{wsgi_rate:>12.1f}{summarize(wsgi_timings)['p95']:>9.1f}"
+                    f"{asgi_rate:>12.1f}{summarize(asgi_timings)['p95']:>9.1f}"
+                )
+
+    def run_wsgi(self, path, users, requests):
+        local = threading.local()
+        slots = iter(users)
+        lock = threading.Lock()
+
+        def request(_):
+            if not hasattr(local, 'client'):
+                with lock:
+                    local.client = Client()
+                    local.client.force_login(next(slots))
+            started = time.perf_counter()
+            local.client.get(path)
+            return (time.perf_counter() - started) * 1000
+
+        with ThreadPoolExecutor(max_workers=len(users)) as executor:
+            started = time.perf_counter()
+            timings = list(executor.map(request, range(requests)))
+            elapsed = time.perf_counter() - started
+            close_thread_connections(executor, len(users))
+        return requests / elapsed, timings
+
+    async def run_asgi(self, path, users, requests):
+        clients = []
+        for user in users:
+            client = AsyncClient()
+            await client.aforce_login(user)
+            clients.append(client)
+
+        timings = []
+
+        async def worker(client, count):
+            for _ in range(count):
+                started = time.perf_counter()
+                await client.get(path)
+                timings.append((time.perf_counter() - started) * 1000)
+
+        share, extra = divmod(requests, len(clients))
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            worker(client, share + (1 if i < extra else 0)) for i, client in enumerate(clients)
+        ))
+        elapsed = time.perf_counter() - started
+        await sync_to_async(connections.close_all)()
+        return requests / elapsed, timings
@@ -0,0 +1,62 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from store import checkout
+from store.models import Product, Cart, CartItem, UserProfile, UserLibrary, Transaction
+
+from ._bench import scratch_database, seed_products, count_queries, measure, summarize
+
+
+def legacy_checkout(user):
+    # The per-item loop checkout used before the batched pipeline.
+    cart = Cart.objects.get(user=user)
+    cart_items = cart.cartitem_set.all()
+    total_price = sum(item.get_total_price() for item in cart_items)
+    profile = UserProfile.objects.get(user=user)
+    profile.balance -= total_price
+    profile.save()
+    library, created = UserLibrary.objects.get_or_create(user=user)
+    for item in cart_items:
+        library.products.add(item.product)
+        Transaction.objects.create(user=user, product=item.product, price=item.product.price)
+    cart_items.delete()
+
+
+class Command(BaseCommand):
+    help = "Measure checkout latency and query counts for carts of 1 to 500 items."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50, 100, 250, 500])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            seed_products(max(options['sizes']))
+            product_ids = list(Product.objects.values_list('id', flat=True))
+            user = User.objects.create_user('bench-buyer')
+            profile = UserProfile.objects.create(user=user)
+            cart = Cart.objects.create(user=user)
+            library = UserLibrary.objects.create(user=user)
+
+            def reset(size):
+                library.products.clear()
+                Transaction.objects.filter(user=user).delete()
+                UserProfile.objects.filter(id=profile.id).update(balance=Decimal('99999999.00'))
+                CartItem.objects.bulk_create(CartItem(cart=cart, product_id=pid) for pid in product_ids[:size])
+
+            self.stdout.write(f"{'items':>6}{'legacy ms':>12}{'legacy q':>10}{'batched ms':>12}{'batched q':>11}")
+            for size in options['sizes']:
+                results = {}
+                for label, func in (('legacy', legacy_checkout), ('batched', checkout.checkout)):
+                    timings = []
+                    for _ in range(options['repeat']):
+                        reset(size)
+                        with count_queries() as queries:
+                            timings.extend(measure(lambda: func(user), 1))
+                    results[label] = (summarize(timings)['p50'], queries.count)
+                self.stdout.write(
+                    f"{size:>6}{results['legacy'][0]:>12.2f}{results['legacy'][1]:>10}"
+                    f"{results['batched'][0]:>12.2f}{results['batched'][1]:>11}"
+                )
@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+
+from ._bench import scratch_database, fake_products
+
+
+def write_catalog(path, count):
+    with open(path, 'w', encoding='utf-8') as handle:
+        for product in fake_products(count):
+            handle.write(json.dumps({
+                'name': product.name,
+                'description': product.description,
+                'price': str(product.price),
+                'category': product.category,
+            }) + '\n')
+
+
+class Command(BaseCommand):
+    help = "Time import_catalog against row-by-row Product.save() and report peak Python memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--naive-rows', type=int, default=5000,
+                            help="Rows for the save()-per-row baseline, which is too slow to run at full size.")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.jsonl')
+            write_catalog(path, options['rows'])
+
+            with scratch_database():
+                started = time.perf_counter()
+                for product in fake_products(options['naive_rows'], seed=1):
+                    product.save()
+                naive_rate = options['naive_rows'] / (time.perf_counter() - started)
+                Product.objects.all().delete()
+
+                with open(os.devnull, 'w') as devnull:
+                    started = time.perf_counter()
+                    call_command('import_catalog', path, batch_size=options['batch_size'], stdout=devnull)
+                    elapsed = time.perf_counter() - started
+                    Product.objects.all().delete()
+
+                    # A second, untimed pass: tracemalloc slows allocation-heavy code down too much to time it.
+                    tracemalloc.start()
+                    call_command('import_catalog', path, batch_size=options['batch_size'], stdout=devnull)
+                    current, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+
+        bulk_rate = options['rows'] / elapsed
+        self.stdout.write(f"{'save() per row':<20}{naive_rate:>12,.0f} rows/s")
+        self.stdout.write(f"{'import_catalog':<20}{bulk_rate:>12,.0f} rows/s  ({bulk_rate / naive_rate:.1f}x)")
+        self.stdout.write(f"peak Python memory {peak / 1024 / 1024:.1f} MiB for {options['rows']:,} rows")
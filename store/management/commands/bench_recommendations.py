@@ -0,0 +1,63 @@
+import resource
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import recommendations
+
+
+def synthetic_matrix(users, products, library_size, wishlist_size, skew, seed):
+    """Users x products interactions where product popularity follows a Zipf-like curve."""
+    np, sparse = recommendations._libraries()
+    rng = np.random.default_rng(seed)
+    popularity = 1.0 / np.arange(1, products + 1) ** skew
+    popularity /= popularity.sum()
+    per_user = library_size + wishlist_size
+    cols = rng.choice(products, size=(users, per_user), p=popularity).ravel()
+    rows = np.repeat(np.arange(users), per_user)
+    weights = np.tile(np.r_[np.ones(library_size), np.full(wishlist_size, recommendations.WISHLIST_WEIGHT)], users)
+    matrix = sparse.csr_matrix((weights, (rows, cols)), shape=(users, products))
+    # A product drawn twice for one user counts once.
+    matrix.data = np.minimum(matrix.data, 1.0)
+    return matrix
+
+
+class Command(BaseCommand):
+    help = "Time the vectorized recommendation build on a synthetic store, without touching the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--products', type=int, default=50_000)
+        parser.add_argument('--library-size', type=int, default=20)
+        parser.add_argument('--wishlist-size', type=int, default=3)
+        parser.add_argument('--skew', type=float, default=0.8, help="Zipf exponent of product popularity.")
+        parser.add_argument('--neighbors', type=int, default=recommendations.NEIGHBORS)
+        parser.add_argument('--picks', type=int, default=recommendations.PICKS)
+        parser.add_argument('--block-size', type=int, default=recommendations.BLOCK_SIZE)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            recommendations._libraries()
+        except ImportError as error:
+            raise CommandError(f"The benchmark needs numpy and scipy: {error}")
+
+        started = time.perf_counter()
+        matrix = synthetic_matrix(options['users'], options['products'], options['library_size'],
+                                  options['wishlist_size'], options['skew'], options['seed'])
+        self.report('generate', started, f"{matrix.nnz:,} links")
+
+        started = time.perf_counter()
+        similarity = recommendations.similar_items(matrix, options['neighbors'], options['block_size'])
+        self.report('neighbours', started, f"{len(similarity[0]):,} pairs")
+
+        started = time.perf_counter()
+        picks = recommendations.personal_picks(matrix, similarity, options['picks'])
+        self.report('personal picks', started, f"{len(picks[0]):,} picks")
+
+        # ru_maxrss is in kilobytes on Linux.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(f"Peak RSS {peak:,.0f} MB")
+
+    def report(self, step, started, detail):
+        self.stdout.write(f"{step:<16}{time.perf_counter() - started:>8.2f}s  {detail}")
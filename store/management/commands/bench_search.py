@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from store import search
+from store.models import Product, CATEGORY_CHOICES
+
+from ._bench import scratch_database, seed_products, measure, summarize
+
+QUERIES = ('dark', 'souls dragon', 'shooter', 'simulation', 'zombi', 'knigth', 'pixel arena 42')
+
+
+def orm_search(query):
+    # The filter product_list used before the search index existed.
+    search_category_code = None
+    for code, name in CATEGORY_CHOICES:
+        if query.lower() in name.lower():
+            search_category_code = code
+            break
+
+    return list(Product.objects.filter(
+        Q(name__icontains=query) |
+        Q(category__icontains=query) |
+        Q(category=search_category_code)
+    ).values_list('id', flat=True))
+
+
+class Command(BaseCommand):
+    help = "Compare indexed catalog search latency against the old icontains ORM filter."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            seeded = 0
+            for size in sorted(options['sizes']):
+                seed_products(size - seeded, seed=seeded)
+                seeded = size
+                search.rebuild_index(batch_size=5000)
+
+                self.stdout.write(f"\n{size:,} products")
+                self.stdout.write(f"{'query':<18}{'orm p50 ms':>12}{'index p50 ms':>14}{'speedup':>10}")
+                for query in QUERIES:
+                    orm = summarize(measure(lambda: orm_search(query), options['repeat']))
+                    indexed = summarize(measure(lambda: search.search(query, limit=500), options['repeat']))
+                    speedup = orm['p50'] / indexed['p50'] if indexed['p50'] else float('inf')
+                    self.stdout.write(f"{query:<18}{orm['p50']:>12.2f}{indexed['p50']:>14.2f}{speedup:>9.1f}x")
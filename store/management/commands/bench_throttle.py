@@ -0,0 +1,81 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from store import throttle
+from store.idempotency import idempotent
+
+from ._bench import measure, summarize
+
+
+def plain_view(request):
+    return HttpResponse('ok')
+
+
+class Command(BaseCommand):
+    help = "Measure the per-request cost of the rate limiter and of idempotency-key replay."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=10_000, help="Requests per timed batch.")
+        parser.add_argument('--repeat', type=int, default=7)
+        parser.add_argument('--users', type=int, default=10_000, help="Distinct users spread across the buckets.")
+        parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8])
+
+    def handle(self, *args, **options):
+        calls, users = options['calls'], options['users']
+        factory = RequestFactory()
+        requests = []
+        for i in range(calls):
+            request = factory.post('/bench/')
+            request.user = SimpleNamespace(pk=i % users, is_authenticated=True)
+            requests.append(request)
+
+        # Generous limits, so every request is admitted and pays the full bookkeeping cost.
+        limited = throttle.rate_limit(f'{calls * options["repeat"]}/s')(plain_view)
+        once = idempotent(plain_view)
+
+        def per_request_us(view, batch):
+            timings = measure(lambda: [view(request) for request in batch], options['repeat'])
+            return summarize(timings)['p50'] * 1000 / len(batch)
+
+        throttle.buckets.clear()
+        baseline = per_request_us(plain_view, requests)
+        rows = [('plain view', baseline), ('rate limited', per_request_us(limited, requests))]
+
+        keyed = []
+        for request in requests[:1000]:
+            keyed_request = factory.post('/bench/', HTTP_IDEMPOTENCY_KEY=uuid.uuid4().hex)
+            keyed_request.user = request.user
+            keyed.append(keyed_request)
+        cache.clear()
+        first = summarize(measure(lambda: [once(request) for request in keyed], 1))['p50'] * 1000 / len(keyed)
+        rows.append(('idempotent, first call', first))
+        rows.append(('idempotent, replay', per_request_us(once, keyed)))
+        cache.clear()
+
+        self.stdout.write(f"{'variant':<26}{'us/request':>12}{'overhead us':>13}")
+        for label, cost in rows:
+            self.stdout.write(f"{label:<26}{cost:>12.2f}{cost - baseline:>13.2f}")
+
+        self.stdout.write(f"\n{'threads':>7}{'takes/s':>14}{'us/take':>10}")
+        for threads in options['threads']:
+            throttle.buckets.clear()
+            per_thread = calls // threads
+
+            def hammer(offset):
+                for i in range(per_thread):
+                    throttle.buckets.take(('bench', (offset * per_thread + i) % users), 10, 1.0)
+
+            def run():
+                with ThreadPoolExecutor(max_workers=threads) as pool:
+                    list(pool.map(hammer, range(threads)))
+
+            elapsed_ms = summarize(measure(run, options['repeat']))['p50']
+            takes = per_thread * threads
+            self.stdout.write(f"{threads:>7}{takes / elapsed_ms * 1000:>14,.0f}{elapsed_ms * 1000 / takes:>10.2f}")
+        throttle.buckets.clear()
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import recommendations
+
+
+class Command(BaseCommand):
+    help = "Rebuild product neighbours and personal picks from every library and wishlist. Needs numpy and scipy."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--neighbors', type=int, default=recommendations.NEIGHBORS)
+        parser.add_argument('--picks', type=int, default=recommendations.PICKS)
+        parser.add_argument('--block-size', type=int, default=recommendations.BLOCK_SIZE,
+                            help="Products per block of the similarity product; lower it to save memory.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            stats = recommendations.build(options['neighbors'], options['picks'], options['block_size'])
+        except ImportError as error:
+            raise CommandError(f"Building recommendations needs numpy and scipy: {error}")
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Built recommendations from {stats['links']:,} links ({stats['users']:,} users, {stats['products']:,} products) "
+            f"in {elapsed:.1f}s: {stats['neighbors']:,} neighbours, {stats['picks']:,} picks."
+        ))
@@ -0,0 +1,58 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from store import thumbnails
+
+
+class Command(BaseCommand):
+    help = "Generate resized WebP/JPEG variants for existing covers, banners and avatars."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--force', action='store_true', help="Rebuild variants that already exist.")
+
+    def handle(self, *args, **options):
+        jobs = []
+        for (label, field_name), specs in thumbnails.FIELD_SPECS.items():
+            model = apps.get_model(label)
+            names = (
+                model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                .values_list(field_name, flat=True).distinct().iterator()
+            )
+            jobs.extend((name, specs) for name in names)
+
+        started = time.perf_counter()
+        created = failed = 0
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                futures = [pool.submit(self.build, name, specs, options['force']) for name, specs in jobs]
+                results = [future.result() for future in futures]
+        else:
+            results = [self.build(name, specs, options['force']) for name, specs in jobs]
+
+        for result in results:
+            if result is None:
+                failed += 1
+            else:
+                created += result
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {len(jobs)} images in {elapsed:.1f}s: {created} variants written, {failed} failed."
+        ))
+
+    def build(self, name, specs, force):
+        try:
+            return thumbnails.generate(name, specs, force=force)
+        except Exception as error:
+            self.stderr.write(f"{name}: {error}")
+            return None
+        finally:
+            # Pool threads own their connections; the main thread's is left to the caller.
+            if threading.current_thread() is not threading.main_thread():
+                close_old_connections()
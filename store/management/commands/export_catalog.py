@@ -0,0 +1,43 @@
+import csv
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+
+from ._catalog import FIELDS, detect_format, open_stream
+
+
+class Command(BaseCommand):
+    help = "Stream the whole catalog to CSV or JSONL in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Output file, or - for stdout.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        fmt = detect_format(options['path'], options['format'])
+        rows = Product.objects.order_by('id').values_list(*FIELDS).iterator(chunk_size=options['chunk_size'])
+
+        started = time.perf_counter()
+        exported = 0
+        with open_stream(options['path'], 'w') as handle:
+            if fmt == 'jsonl':
+                for row in rows:
+                    record = dict(zip(FIELDS, row))
+                    record['price'] = str(record['price'])
+                    handle.write(json.dumps(record) + '\n')
+                    exported += 1
+            else:
+                writer = csv.writer(handle)
+                writer.writerow(FIELDS)
+                for row in rows:
+                    writer.writerow(row)
+                    exported += 1
+
+        if options['path'] != '-':
+            elapsed = time.perf_counter() - started
+            rate = exported / elapsed if elapsed else 0
+            self.stdout.write(self.style.SUCCESS(f"Exported {exported} products in {elapsed:.1f}s - {rate:,.0f} rows/s."))
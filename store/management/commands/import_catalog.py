@@ -0,0 +1,177 @@
+import time
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from store import fragments, pricing, search, shelves, thumbnails
+from store.models import Product, CATEGORY_CHOICES
+
+from ._catalog import detect_format, open_stream, read_rows
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+# Required columns, always written on update; the optional ones only when the input has them.
+REQUIRED_FIELDS = ['name', 'price', 'category', 'updated']
+OPTIONAL_FIELDS = ['description', 'is_featured', 'image']
+
+
+class RowError(ValueError):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Stream products from CSV or JSONL into the catalog in bulk batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV/JSONL file, or - for stdin.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--images-dir', help="Directory that image filenames are resolved against.")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--defer-index', action='store_true',
+                            help="Skip per-batch search indexing and rebuild the whole index at the end.")
+        parser.add_argument('--strict', action='store_true', help="Abort on the first invalid row.")
+
+    def handle(self, *args, **options):
+        self.images_dir = Path(options['images_dir']) if options['images_dir'] else None
+        self.categories = {}
+        for code, name in CATEGORY_CHOICES:
+            self.categories[code.lower()] = code
+            self.categories[name.lower()] = code
+
+        fmt = detect_format(options['path'], options['format'])
+        batch_size = options['batch_size']
+        self.stats = {'created': 0, 'updated': 0, 'skipped': 0}
+        started = time.perf_counter()
+
+        with open_stream(options['path'], 'r') as handle:
+            batch = []
+            for line_number, row in enumerate(read_rows(handle, fmt), start=1):
+                try:
+                    batch.append(self.build_product(row))
+                except RowError as error:
+                    if options['strict']:
+                        raise CommandError(f"Row {line_number}: {error}")
+                    self.stderr.write(f"Row {line_number} skipped: {error}")
+                    self.stats['skipped'] += 1
+                    continue
+                if len(batch) >= batch_size:
+                    self.write_batch(batch, options['defer_index'])
+                    batch = []
+            if batch:
+                self.write_batch(batch, options['defer_index'])
+
+        # Rows inserted with explicit ids leave the Postgres id sequence behind, and later
+        # creates would collide with them. SQLite needs nothing.
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Product]):
+                cursor.execute(sql)
+
+        if options['defer_index']:
+            search.rebuild_index(batch_size=batch_size)
+        # Bulk writes send no signals.
+        shelves.rebuild([shelves.FEATURED, shelves.NEW])
+        pricing.materialize()
+        fragments.bump(fragments.CATALOG)
+
+        elapsed = time.perf_counter() - started
+        total = self.stats['created'] + self.stats['updated']
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {total} products ({self.stats['created']} created, {self.stats['updated']} updated, "
+            f"{self.stats['skipped']} skipped) in {elapsed:.1f}s - {rate:,.0f} rows/s."
+        ))
+
+    def build_product(self, row):
+        if isinstance(row, ValueError):
+            raise RowError(str(row))
+        if not isinstance(row, dict):
+            raise RowError(f"expected an object, not {type(row).__name__}")
+
+        name = str(row.get('name') or '').strip()
+        if not name:
+            raise RowError("name is required")
+
+        category_value = str(row.get('category') or '').strip().lower()
+        category = self.categories.get(category_value)
+        if category is None:
+            raise RowError(f"unknown category {row.get('category')!r}")
+
+        try:
+            price = Decimal(str(row.get('price'))).quantize(Decimal('0.01'))
+        except (InvalidOperation, ValueError):
+            raise RowError(f"invalid price {row.get('price')!r}")
+        if price < 0:
+            raise RowError("price cannot be negative")
+
+        product_id = row.get('id')
+        try:
+            product_id = int(product_id) if product_id not in (None, '') else None
+        except (TypeError, ValueError):
+            raise RowError(f"invalid id {row.get('id')!r}")
+
+        featured = row.get('is_featured')
+        product = Product(
+            id=product_id,
+            name=name[:200],
+            description=str(row.get('description') or ''),
+            price=price,
+            category=category,
+            is_featured=featured is True or str(featured).strip().lower() in TRUE_VALUES,
+            # bulk_update() skips auto_now, and cached cards are keyed on this timestamp.
+            updated=timezone.now(),
+        )
+        product.image = self.store_image(row.get('image'))
+        product.import_fields = tuple(REQUIRED_FIELDS + [name for name in OPTIONAL_FIELDS if name in row])
+        return product
+
+    def store_image(self, filename):
+        if not filename:
+            return None
+        if not isinstance(filename, str):
+            raise RowError(f"invalid image {filename!r}")
+        try:
+            if default_storage.exists(filename):
+                return filename
+        except SuspiciousFileOperation:
+            raise RowError(f"image {filename!r} is outside the media directory")
+        if self.images_dir is None:
+            raise RowError(f"image {filename!r} given but no --images-dir")
+        source = self.images_dir / filename
+        if self.images_dir.resolve() not in source.resolve().parents:
+            raise RowError(f"image {filename!r} is outside --images-dir")
+        if not source.is_file():
+            raise RowError(f"image {source} not found")
+        with source.open('rb') as handle:
+            return default_storage.save(f'game_covers/{source.name}', File(handle))
+
+    def write_batch(self, batch, defer_index):
+        ids = [product.id for product in batch if product.id is not None]
+        with transaction.atomic():
+            existing = set(Product.objects.filter(id__in=ids).values_list('id', flat=True)) if ids else set()
+            to_update = [product for product in batch if product.id in existing]
+            to_create = [product for product in batch if product.id not in existing]
+
+            # One UPDATE per set of columns present, so a column left out of the input keeps its value.
+            by_fields = {}
+            for product in to_update:
+                by_fields.setdefault(product.import_fields, []).append(product)
+            for fields, products in by_fields.items():
+                Product.objects.bulk_update(products, fields)
+            if to_create:
+                Product.objects.bulk_create(to_create)
+            if not defer_index:
+                # Updated rows are indexed as stored, including columns this input left alone.
+                updated = list(Product.objects.filter(id__in=[product.id for product in to_update])) if to_update else []
+                search.index_products(to_create + updated)
+            thumbnails.schedule_batch(
+                [product.image.name for product in batch if product.image], thumbnails.FIELD_SPECS[('store.Product', 'image')]
+            )
+
+        self.stats['updated'] += len(to_update)
+        self.stats['created'] += len(to_create)
@@ -0,0 +1,353 @@
+import json
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.test import Client, override_settings
+
+from store import pagination, urls as store_urls
+from store.models import Product, Cart, CartItem, Transaction, Wishlist
+
+from ._bench import scratch_database, close_thread_connections, count_queries, summarize, VOCABULARY
+from ._seed import seed_store, USERNAME_PREFIX
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'benchmarks' / 'loadtest.json'
+# Latency below this many milliseconds is noise, whatever the relative change.
+LATENCY_FLOOR_MS = 5
+
+
+class Worker:
+    """One simulated shopper: a logged-in client, an anonymous client and a private RNG."""
+
+    def __init__(self, user, staff, product_range, seed):
+        self.user = user
+        self.first_product, self.last_product = product_range
+        self.rng = random.Random(seed)
+        self.client = Client()
+        self.client.force_login(user)
+        self.anonymous = Client()
+        self.staff = Client()
+        self.staff.force_login(staff)
+
+    def product_id(self):
+        return self.rng.randint(self.first_product, self.last_product)
+
+    def unowned_product_id(self):
+        while True:
+            product_id = self.product_id()
+            if not self.user.userlibrary.products.filter(id=product_id).exists():
+                return product_id
+
+
+# Each scenario prepares state outside the timed section and returns (client, method, path, data).
+def login(worker):
+    return worker.anonymous, 'get', '/', None
+
+
+def register(worker):
+    return worker.anonymous, 'get', '/register/', None
+
+
+def product_list(worker):
+    return worker.client, 'get', '/home/', None
+
+
+def product_search(worker):
+    return worker.client, 'get', f'/home/?q={worker.rng.choice(VOCABULARY)}', None
+
+
+def product_list_page(worker):
+    cursor = pagination.encode_cursor([worker.product_id()])
+    return worker.client, 'get', f'/home/page/?cursor={cursor}', None
+
+
+def product_detail(worker):
+    return worker.client, 'get', f'/product/{worker.product_id()}/', None
+
+
+def product_reviews_page(worker):
+    return worker.client, 'get', f'/product/{worker.product_id()}/reviews/', None
+
+
+def post_review(worker):
+    product_id = worker.user.userlibrary.products.values_list('id', flat=True).first() or worker.product_id()
+    return worker.client, 'post', f'/product/{product_id}/', {'rating': worker.rng.randint(1, 5), 'comment': 'load test'}
+
+
+def add_to_cart(worker):
+    return worker.client, 'get', f'/add-to-cart/{worker.unowned_product_id()}/', None
+
+
+def cart_detail(worker):
+    return worker.client, 'get', '/cart/', None
+
+
+def remove_from_cart(worker):
+    cart, created = Cart.objects.get_or_create(user=worker.user)
+    item, created = CartItem.objects.get_or_create(cart=cart, product_id=worker.unowned_product_id())
+    return worker.client, 'get', f'/cart/remove/{item.id}/', None
+
+
+def checkout(worker):
+    cart, created = Cart.objects.get_or_create(user=worker.user)
+    CartItem.objects.get_or_create(cart=cart, product_id=worker.unowned_product_id())
+    return worker.client, 'post', '/checkout/', None
+
+
+def refund(worker):
+    purchase = Transaction.objects.filter(user=worker.user).order_by('-id').first()
+    if purchase is None:
+        checkout(worker)
+        worker.client.post('/checkout/')
+        purchase = Transaction.objects.filter(user=worker.user).order_by('-id').first()
+    return worker.client, 'get', f'/refund/{purchase.id}', None
+
+
+def view_profile(worker):
+    return worker.client, 'get', '/profile/', None
+
+
+def export_history(worker):
+    return worker.client, 'get', '/profile/export/transactions/', None
+
+
+def staff_export(worker):
+    return worker.staff, 'get', '/dashboard/exports/library/?format=json', None
+
+
+def top_up_form(worker):
+    return worker.client, 'get', '/wallet/topup/', None
+
+
+def top_up(worker):
+    return worker.client, 'post', '/wallet/topup/', {'amount': 200}
+
+
+def repository(worker):
+    return worker.client, 'get', '/repository/', None
+
+
+def wishlist_view(worker):
+    return worker.client, 'get', '/wishlist/', None
+
+
+def add_to_wishlist(worker):
+    return worker.client, 'get', f'/wishlist/add/{worker.product_id()}/', None
+
+
+def remove_from_wishlist(worker):
+    product_id = worker.product_id()
+    Wishlist.objects.get(user=worker.user).products.add(product_id)
+    return worker.client, 'get', f'/wishlist/remove/{product_id}/', None
+
+
+def logout(worker):
+    client = Client()
+    client.force_login(worker.user)
+    return client, 'get', '/logout/', None
+
+
+def live_events(worker):
+    # The stream is cut to its opening snapshot below, so each request measures connection setup.
+    return worker.client, 'get', '/live/', None
+
+
+def performance_report(worker):
+    return worker.staff, 'get', '/perf/', None
+
+
+def sales_dashboard(worker):
+    return worker.staff, 'get', '/dashboard/sales/', None
+
+
+def read_body(response):
+    if response.is_async:
+        # Async streams (server-sent events) are drained on an event loop, as an ASGI server would.
+        async def drain():
+            return [chunk async for chunk in response.streaming_content]
+        return b''.join(async_to_sync(drain)())
+    return b''.join(response.streaming_content)
+
+
+# (label, url name, scenario). Every named route in store/urls.py must appear at least once.
+SCENARIOS = (
+    ('login', 'login', login),
+    ('register', 'register', register),
+    ('product-list', 'product-list', product_list),
+    ('product-list search', 'product-list', product_search),
+    ('product-list-page', 'product-list-page', product_list_page),
+    ('product_detail', 'product_detail', product_detail),
+    ('product_detail review', 'product_detail', post_review),
+    ('product_reviews_page', 'product_reviews_page', product_reviews_page),
+    ('add_to_cart', 'add_to_cart', add_to_cart),
+    ('cart_detail', 'cart_detail', cart_detail),
+    ('remove_from_cart', 'remove_from_cart', remove_from_cart),
+    ('checkout', 'checkout', checkout),
+    ('refund_game', 'refund_game', refund),
+    ('view_profile', 'view_profile', view_profile),
+    ('export_history', 'export_history', export_history),
+    ('top_up_wallet form', 'top_up_wallet', top_up_form),
+    ('top_up_wallet', 'top_up_wallet', top_up),
+    ('repository', 'repository', repository),
+    ('wishlist_view', 'wishlist_view', wishlist_view),
+    ('add_to_wishlist', 'add_to_wishlist', add_to_wishlist),
+    ('remove_from_wishlist', 'remove_from_wishlist', remove_from_wishlist),
+    ('logout', 'logout', logout),
+    ('live_events', 'live_events', live_events),
+    ('performance_report', 'performance_report', performance_report),
+    ('sales_dashboard', 'sales_dashboard', sales_dashboard),
+    ('staff_export', 'staff_export', staff_export),
+)
+
+
+def uncovered_routes():
+    names = {pattern.name for pattern in store_urls.urlpatterns if pattern.name}
+    return names - {name for label, name, scenario in SCENARIOS}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for label, current in results.items():
+        previous = baseline.get(label)
+        if previous is None:
+            continue
+        # The median, not the max: cold per-user caches make the first request of each worker noisier.
+        if current['queries_p50'] > previous['queries_p50']:
+            regressions.append(f"{label}: median queries {previous['queries_p50']} -> {current['queries_p50']}")
+        # Write tails are dominated by SQLite lock waits, so latency is gated on the median too.
+        limit = max(previous['p50'] * (1 + tolerance), previous['p50'] + LATENCY_FLOOR_MS)
+        if current['p50'] > limit:
+            regressions.append(f"{label}: p50 {previous['p50']:.1f}ms -> {current['p50']:.1f}ms")
+    return regressions
+
+
+class Command(BaseCommand):
+    help = "Seed a synthetic store, drive every route with concurrent in-process clients and check a JSON baseline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--library-size', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=40, help="Requests per scenario.")
+        parser.add_argument('--warmup', type=int, default=5, help="Untimed requests per scenario before measuring.")
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--only', nargs='+', help="Scenario labels to run.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+        parser.add_argument('--update-baseline', action='store_true')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help="Allowed relative p50 growth before a scenario counts as a regression.")
+
+    def handle(self, *args, **options):
+        missing = uncovered_routes()
+        if missing:
+            raise CommandError(f"No load-test scenario for: {', '.join(sorted(missing))}")
+
+        scenarios = [s for s in SCENARIOS if not options['only'] or s[0] in options['only']]
+        with scratch_database(), override_settings(
+                ALLOWED_HOSTS=['testserver'], STORE_PROFILING_SAMPLE_RATE=0,
+                # Each simulated shopper writes far faster than the per-user limits allow.
+                STORE_RATE_LIMIT_ENABLED=False, STORE_LIVE_STREAM_SECONDS=0):
+            started = time.perf_counter()
+            seed_store(users=options['users'], products=options['products'],
+                       library_size=options['library_size'], seed=options['seed'])
+            self.stdout.write(f"Seeded in {time.perf_counter() - started:.1f}s")
+            results = self.run_scenarios(scenarios, options)
+
+        self.print_results(results)
+        self.check_baseline(results, options)
+
+    def run_scenarios(self, scenarios, options):
+        concurrency = options['concurrency']
+        users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id')[:concurrency])
+        staff = User.objects.create_user('load-staff', is_staff=True)
+        bounds = Product.objects.aggregate(first=Min('id'), last=Max('id'))
+        product_range = (bounds['first'], bounds['last'])
+
+        local = threading.local()
+        slots = iter(range(concurrency))
+        slot_lock = threading.Lock()
+
+        def worker():
+            if not hasattr(local, 'worker'):
+                with slot_lock:
+                    slot = next(slots)
+                local.worker = Worker(users[slot], staff, product_range, options['seed'] + slot)
+            return local.worker
+
+        def run_one(scenario):
+            current = worker()
+            client, method, path, data = scenario(current)
+            with count_queries() as queries:
+                started = time.perf_counter()
+                try:
+                    response = getattr(client, method)(path, data)
+                    if response.streaming:
+                        # Streamed exports do their work as the body is read.
+                        read_body(response)
+                    failed = response.status_code >= 500
+                except Exception:
+                    failed = True
+                elapsed = (time.perf_counter() - started) * 1000
+            return elapsed, queries.count, failed
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for label, name, scenario in scenarios:
+                # Warm up template loading, per-thread connections and caches before timing.
+                list(executor.map(run_one, [scenario] * options['warmup']))
+                started = time.perf_counter()
+                samples = list(executor.map(run_one, [scenario] * options['requests']))
+                elapsed = time.perf_counter() - started
+
+                timings = [sample[0] for sample in samples]
+                query_counts = [sample[1] for sample in samples]
+                summary = summarize(timings)
+                results[label] = {
+                    'requests': len(samples),
+                    'rps': len(samples) / elapsed,
+                    'p50': summary['p50'],
+                    'p95': summary['p95'],
+                    'p99': summary['p99'],
+                    'queries_p50': statistics.median(query_counts),
+                    'queries_max': max(query_counts),
+                    'errors': sum(1 for sample in samples if sample[2]),
+                }
+            close_thread_connections(executor, concurrency)
+        return results
+
+    def print_results(self, results):
+        self.stdout.write(
+            f"{'scenario':<24}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'p50 q':>7}{'max q':>7}{'errors':>8}"
+        )
+        for label, row in results.items():
+            self.stdout.write(
+                f"{label:<24}{row['rps']:>9.1f}{row['p50']:>9.1f}{row['p95']:>9.1f}{row['p99']:>9.1f}"
+                f"{row['queries_p50']:>7g}{row['queries_max']:>7}{row['errors']:>8}"
+            )
+
+    def check_baseline(self, results, options):
+        failures = [f"{label}: {row['errors']} failed requests" for label, row in results.items() if row['errors']]
+        if failures:
+            raise CommandError("Requests failed:\n  " + '\n  '.join(failures))
+
+        path = Path(options['baseline'])
+        if options['update_baseline'] or not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {path}"))
+            return
+
+        baseline = json.loads(path.read_text())
+        regressions = compare(results, baseline, options['tolerance'])
+        if regressions:
+            raise CommandError("Regressions against baseline:\n  " + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {path}"))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store import pricing
+
+
+class Command(BaseCommand):
+    help = "Recompute the effective (sale) price table from the discounts running now. The job queue does this on every discount change and at every start and end."
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = pricing.materialize()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"{count} products on sale, recomputed in {elapsed:.2f}s."))
+        boundary = pricing.next_change(timezone.now())
+        if boundary:
+            self.stdout.write(f"Next price change at {boundary.isoformat()}.")
@@ -0,0 +1,64 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from store.middleware import collected_summaries, recorder, summary_dir
+
+
+class Command(BaseCommand):
+    help = "Print per-view request telemetry, either published by running servers or measured here on given paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help="Paths to request in-process instead of reading published summaries.")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--user', help="Username to log in as for the in-process requests.")
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['paths']:
+            reports = {'local': self.exercise(options)}
+        else:
+            reports = collected_summaries()
+            if not reports:
+                self.stdout.write(f"No published summaries in {summary_dir()}; pass paths to measure them here.")
+                return
+
+        if options['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
+            return
+        for process, report in reports.items():
+            self.stdout.write(f"\nprocess {process}")
+            self.print_report(report)
+
+    def exercise(self, options):
+        client = Client(HTTP_HOST=options['host'])
+        if options['user']:
+            try:
+                client.force_login(User.objects.get(username=options['user']))
+            except User.DoesNotExist:
+                raise CommandError(f"No user named {options['user']!r}.")
+
+        recorder.reset()
+        with override_settings(STORE_PROFILING_SAMPLE_RATE=1):
+            for _ in range(options['repeat']):
+                for path in options['paths']:
+                    client.get(path)
+        return recorder.summary()
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{'view':<32}{'n':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"{'queries':>9}{'dups':>6}{'tpl p95':>9}{'bytes':>9}"
+        )
+        rows = sorted(report.items(), key=lambda item: item[1]['wall_ms']['p95'], reverse=True)
+        for view, stats in rows:
+            self.stdout.write(
+                f"{view[:31]:<32}{stats['samples']:>6}{stats['wall_ms']['p50']:>9.1f}{stats['wall_ms']['p95']:>9.1f}"
+                f"{stats['wall_ms']['p99']:>9.1f}{stats['queries']['p50']:>9}{stats['duplicate_queries']['max']:>6}"
+                f"{stats['template_ms']['p95']:>9.1f}{stats['response_bytes']['p50']:>9}"
+            )
+            for duplicate in stats['top_duplicates']:
+                self.stdout.write(f"    {duplicate['count']}x {duplicate['sql'][:100]}")
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import shelves
+
+
+class Command(BaseCommand):
+    help = "Recompute the storefront shelves (featured, top sellers, top rated, new). Run it periodically, e.g. from cron."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', nargs='+', choices=sorted(shelves.BUILDERS), help="Shelves to rebuild.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        built = shelves.rebuild(options['only'])
+        elapsed = time.perf_counter() - started
+        for name, product_ids in built.items():
+            self.stdout.write(f"{shelves.TITLES[name]}: {len(product_ids)} products")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(built)} shelves in {elapsed:.2f}s."))
@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.models import UserProfile, WalletEntry
+
+
+class Command(BaseCommand):
+    help = "Stream the wallet ledger in chunks and check each user's total against UserProfile.balance."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        entries = (
+            WalletEntry.objects.order_by('user_id', 'id')
+            .values_list('user_id', 'amount')
+            .iterator(chunk_size=chunk_size)
+        )
+        profiles = (
+            UserProfile.objects.order_by('user_id')
+            .values_list('user_id', 'balance')
+            .iterator(chunk_size=chunk_size)
+        )
+
+        # Both streams are ordered by user_id, so a merge join keeps memory constant.
+        ledger_totals = self.totals_by_user(entries)
+        current = next(ledger_totals, None)
+        checked = 0
+        mismatches = []
+        for user_id, balance in profiles:
+            ledger_total = Decimal('0.00')
+            while current is not None and current[0] < user_id:
+                mismatches.append((current[0], current[1], None))
+                current = next(ledger_totals, None)
+            if current is not None and current[0] == user_id:
+                ledger_total = current[1]
+                current = next(ledger_totals, None)
+            if ledger_total != balance:
+                mismatches.append((user_id, ledger_total, balance))
+            checked += 1
+        while current is not None:
+            mismatches.append((current[0], current[1], None))
+            current = next(ledger_totals, None)
+
+        for user_id, ledger_total, balance in mismatches:
+            self.stderr.write(f"user {user_id}: ledger says ₱{ledger_total}, wallet says ₱{balance}")
+
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} of {checked} wallets do not match the ledger.")
+        self.stdout.write(self.style.SUCCESS(f"All {checked} wallets match the ledger."))
+
+    def totals_by_user(self, entries):
+        user_id = None
+        total = Decimal('0.00')
+        for entry_user_id, amount in entries:
+            if entry_user_id != user_id:
+                if user_id is not None:
+                    yield user_id, total
+                user_id = entry_user_id
+                total = Decimal('0.00')
+            total += amount
+        if user_id is not None:
+            yield user_id, total
@@ -0,0 +1,72 @@
+import multiprocessing
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from store import jobs, live
+
+# How often each worker puts back jobs orphaned by a dead worker and prunes finished jobs and old live events.
+SWEEP_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = "Run background job workers that poll the Job table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help="Worker processes to fork.")
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds to wait when no job is due.")
+        parser.add_argument('--batch-size', type=int, default=jobs.BATCH_SIZE, help="Jobs claimed per query.")
+        parser.add_argument('--once', action='store_true', help="Run every due job, then exit.")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            ran = jobs.work(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Ran {ran} job{'' if ran == 1 else 's'}."))
+            return
+
+        if options['processes'] == 1:
+            self.serve(options['poll'], options['batch_size'])
+            return
+
+        # Children must not inherit the parent's database connections.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        children = [
+            context.Process(target=self.serve, args=(options['poll'], options['batch_size']))
+            for _ in range(options['processes'])
+        ]
+        for child in children:
+            child.start()
+        self.stdout.write(f"Started {len(children)} workers.")
+
+        def stop(signum, frame):
+            for child in children:
+                child.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for child in children:
+            child.join()
+
+    def serve(self, poll, batch_size):
+        stopping = []
+        # Finish the job in hand, then exit.
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+        worker = jobs.worker_name()
+        self.stdout.write(f"Worker {worker} polling for jobs.")
+        last_sweep = 0
+        while not stopping:
+            if time.monotonic() - last_sweep > SWEEP_INTERVAL:
+                jobs.requeue_stale()
+                jobs.prune()
+                live.prune()
+                last_sweep = time.monotonic()
+            ran = jobs.work(worker, limit=batch_size, batch_size=batch_size)
+            close_old_connections()
+            if not ran:
+                time.sleep(poll)
+        self.stdout.write(f"Worker {worker} stopped.")
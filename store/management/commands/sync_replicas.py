@@ -0,0 +1,27 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+def copy_sqlite(source_alias, target_alias):
+    source = connections[source_alias]
+    target = connections[target_alias]
+    target.close()
+    source.ensure_connection()
+    with sqlite3.connect(target.settings_dict['NAME']) as destination:
+        # The online backup API copies a consistent snapshot while the primary keeps serving writes.
+        source.connection.backup(destination)
+    destination.close()
+
+
+class Command(BaseCommand):
+    help = "Refresh the local SQLite replica files from the primary database."
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError("Replicas are only synced locally for SQLite; use the database's own replication.")
+        for alias in settings.STORE_READ_REPLICAS:
+            copy_sqlite('default', alias)
+            self.stdout.write(f"Synced {alias} from default")
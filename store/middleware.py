@@ -0,0 +1,224 @@
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import Template as DjangoTemplate
+
+# Summaries not refreshed for this long belong to processes that have gone.
+SUMMARY_TIMEOUT = 60 * 60
+TOP_DUPLICATES = 5
+
+_active = ContextVar('store_profile_sample', default=None)
+_template_hook_installed = False
+
+
+class Sample:
+    __slots__ = ('view', 'wall_ms', 'queries', 'duplicates', 'template_ms', 'bytes', 'statements')
+
+    def __init__(self):
+        self.template_ms = 0.0
+        self.statements = []
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Recorder:
+    """Per-view ring buffers of recent samples, shared by every thread in the process."""
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.duplicates = {}
+        self.last_flush = 0.0
+
+    def add(self, sample, repeated):
+        with self.lock:
+            buffer = self.samples.get(sample.view)
+            if buffer is None:
+                buffer = self.samples[sample.view] = deque(maxlen=self.size)
+                self.duplicates[sample.view] = Counter()
+            buffer.append((sample.wall_ms, sample.queries, sample.duplicates, sample.template_ms, sample.bytes))
+            if repeated:
+                patterns = self.duplicates[sample.view]
+                patterns.update(repeated)
+                if len(patterns) > TOP_DUPLICATES * 20:
+                    # Keep the counter bounded; rare patterns fall off.
+                    self.duplicates[sample.view] = Counter(dict(patterns.most_common(TOP_DUPLICATES * 10)))
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.duplicates.clear()
+
+    def summary(self):
+        with self.lock:
+            snapshot = {view: list(buffer) for view, buffer in self.samples.items()}
+            duplicates = {view: patterns.most_common(TOP_DUPLICATES) for view, patterns in self.duplicates.items()}
+
+        report = {}
+        for view, rows in snapshot.items():
+            wall, queries, repeated, template, size = (sorted(column) for column in zip(*rows))
+            report[view] = {
+                'samples': len(rows),
+                'wall_ms': {'p50': percentile(wall, 0.5), 'p95': percentile(wall, 0.95),
+                            'p99': percentile(wall, 0.99), 'max': wall[-1]},
+                'queries': {'p50': percentile(queries, 0.5), 'p95': percentile(queries, 0.95), 'max': queries[-1]},
+                'duplicate_queries': {'p95': percentile(repeated, 0.95), 'max': repeated[-1]},
+                'template_ms': {'p50': percentile(template, 0.5), 'p95': percentile(template, 0.95)},
+                'response_bytes': {'p50': percentile(size, 0.5), 'max': size[-1]},
+                'top_duplicates': [{'sql': sql, 'count': count} for sql, count in duplicates[view]],
+            }
+        return report
+
+    def flush(self, force=False):
+        # Publish this process's summary as a file, where perf_report (another process) can read it.
+        now = time.monotonic()
+        flush_interval = getattr(settings, 'STORE_PROFILING_FLUSH_INTERVAL', 30)
+        if not force and now - self.last_flush < flush_interval:
+            return
+        self.last_flush = now
+        directory = summary_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'{socket.gethostname()}-{os.getpid()}.json'
+        partial = path.with_suffix('.tmp')
+        partial.write_text(json.dumps(self.summary()))
+        # A rename is atomic, so a reader never sees half a summary.
+        os.replace(partial, path)
+
+
+recorder = Recorder(getattr(settings, 'STORE_PROFILING_BUFFER_SIZE', 1000))
+
+
+def summary_dir():
+    return Path(getattr(settings, 'STORE_PROFILING_DIR', Path(tempfile.gettempdir()) / 'pycrib-perf'))
+
+
+def collected_summaries():
+    """{process: summary} for every process that published within SUMMARY_TIMEOUT."""
+    summaries = {}
+    cutoff = time.time() - SUMMARY_TIMEOUT
+    for path in sorted(summary_dir().glob('*.json')):
+        try:
+            if path.stat().st_mtime >= cutoff:
+                summaries[path.stem] = json.loads(path.read_text())
+        except (OSError, ValueError):
+            # Removed or replaced while being read.
+            continue
+    return summaries
+
+
+def _install_template_hook():
+    # Backend-level render covers render() and render_to_string() once per top-level template,
+    # so {% include %} and {% extends %} are not counted twice.
+    global _template_hook_installed
+    if _template_hook_installed:
+        return
+    original = DjangoTemplate.render
+
+    def render(self, context=None, request=None):
+        sample = _active.get()
+        if sample is None:
+            return original(self, context, request)
+        started = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            sample.template_ms += (time.perf_counter() - started) * 1000
+
+    DjangoTemplate.render = render
+    _template_hook_installed = True
+
+
+class QueryRecorder:
+    def __init__(self, sample):
+        self.sample = sample
+
+    def __call__(self, execute, sql, params, many, context):
+        self.sample.statements.append(sql)
+        return execute(sql, params, many, context)
+
+
+class ProfilingMiddleware:
+    """Sample a fraction of requests and record their cost per URL name."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        _install_template_hook()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        sample = self.start()
+        if sample is None:
+            return self.get_response(request)
+        with self.attach(sample), self.timing(sample):
+            response = self.get_response(request)
+        return self.finish(sample, request, response)
+
+    async def __acall__(self, request):
+        sample = self.start()
+        if sample is None:
+            return await self.get_response(request)
+        # Connections are per thread: the wrappers go on the thread the request's ORM calls run in.
+        wrappers = await sync_to_async(self.attach)(sample)
+        try:
+            with self.timing(sample):
+                response = await self.get_response(request)
+        finally:
+            await sync_to_async(wrappers.close)()
+        return self.finish(sample, request, response)
+
+    def start(self):
+        rate = getattr(settings, 'STORE_PROFILING_SAMPLE_RATE', 0)
+        if rate <= 0 or random.random() >= rate:
+            return None
+        return Sample()
+
+    def attach(self, sample):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(QueryRecorder(sample)))
+        return stack
+
+    @contextmanager
+    def timing(self, sample):
+        token = _active.set(sample)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            _active.reset(token)
+            sample.wall_ms = (time.perf_counter() - started) * 1000
+
+    def finish(self, sample, request, response):
+        match = request.resolver_match
+        sample.view = match.view_name if match else '<unresolved>'
+        sample.bytes = 0 if response.streaming else len(response.content)
+        sample.queries = len(sample.statements)
+        repeated = {sql: count for sql, count in Counter(sample.statements).items() if count > 1}
+        sample.duplicates = sum(repeated.values()) - len(repeated)
+
+        recorder.add(sample, repeated)
+        recorder.flush()
+        return response
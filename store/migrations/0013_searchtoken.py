@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def build_search_index(apps, schema_editor):
+    # Without this an existing catalog searches empty until rebuild_search_index is run by hand.
+    # The terms must be the ones the running code matches against, so the app's tokenizer is used.
+    from store.search import token_rows
+
+    Product = apps.get_model('store', 'Product')
+    SearchToken = apps.get_model('store', 'SearchToken')
+    alias = schema_editor.connection.alias
+    products = Product.objects.using(alias).only('id', 'name', 'description', 'category').order_by('id')
+    batch = []
+    for product in products.iterator(chunk_size=BATCH_SIZE):
+        batch.extend(
+            SearchToken(kind=kind, term=term, product_id=product_id, weight=weight)
+            for kind, term, product_id, weight in token_rows(product)
+        )
+        if len(batch) >= BATCH_SIZE:
+            SearchToken.objects.using(alias).bulk_create(batch)
+            batch = []
+    SearchToken.objects.using(alias).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_storebanner_product_is_featured'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('T', 'Term'), ('G', 'Trigram')], default='T', max_length=1)),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField(default=1)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'term'], name='store_searchtoken_lookup')],
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_opening_balances(apps, schema_editor):
+    UserProfile = apps.get_model('store', 'UserProfile')
+    WalletEntry = apps.get_model('store', 'WalletEntry')
+    WalletEntry.objects.bulk_create(
+        WalletEntry(user_id=profile.user_id, kind='OPENING', amount=profile.balance, balance_after=profile.balance)
+        for profile in UserProfile.objects.exclude(balance=0).iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_searchtoken'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('OPENING', 'Opening balance'), ('TOPUP', 'Top-up'), ('PURCHASE', 'Purchase'), ('REFUND', 'Refund')], max_length=10)),
+                ('amount', models.DecimalField(decimal_places=2, help_text='Signed change to the balance: positive for credits, negative for debits', max_digits=10)),
+                ('balance_after', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='store.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='wallet_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Wallet entries',
+                'indexes': [models.Index(fields=['user', 'id'], name='store_walletentry_user_seq')],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_ratings(apps, schema_editor):
+    Review = apps.get_model('store', 'Review')
+    ProductRating = apps.get_model('store', 'ProductRating')
+
+    ratings = {}
+    rows = Review.objects.values('product_id', 'rating').annotate(n=models.Count('id')).order_by()
+    for row in rows:
+        stars = min(max(row['rating'], 1), 5)
+        rating = ratings.setdefault(row['product_id'], ProductRating(product_id=row['product_id']))
+        rating.count += row['n']
+        rating.total += stars * row['n']
+        setattr(rating, f'stars_{stars}', getattr(rating, f'stars_{stars}') + row['n'])
+    ProductRating.objects.bulk_create(ratings.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_walletentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating', serialize=False, to='store.product')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('stars_1', models.PositiveIntegerField(default=0)),
+                ('stars_2', models.PositiveIntegerField(default=0)),
+                ('stars_3', models.PositiveIntegerField(default=0)),
+                ('stars_4', models.PositiveIntegerField(default=0)),
+                ('stars_5', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_productrating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(db_index=True, max_length=255)),
+                ('spec', models.CharField(max_length=20)),
+                ('format', models.CharField(max_length=10)),
+                ('width', models.PositiveIntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('source', 'spec', 'format', 'width'), name='store_imagevariant_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def dedupe_cart_items(apps, schema_editor):
+    # Keep the oldest row for each (cart, product) so the unique constraint can be added.
+    CartItem = apps.get_model('store', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('cart_id', 'product_id')
+        .annotate(keep=models.Min('id'), n=models.Count('id'))
+        .filter(n__gt=1)
+        .order_by()
+    )
+    for row in duplicates.iterator():
+        CartItem.objects.filter(cart_id=row['cart_id'], product_id=row['product_id']).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_imagevariant'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_featured', True)), fields=['id'], name='store_product_featured'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', '-created_at', '-id'], name='store_review_product_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='storebanner',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['id'], name='store_storebanner_active'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', '-date'], name='store_transaction_user_date'),
+        ),
+        migrations.RunPython(dedupe_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='store_cartitem_unique_product'),
+        ),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='cart',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='store.cart'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_storefront_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='storebanner',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_product_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Shelf',
+            fields=[
+                ('name', models.CharField(choices=[('featured', 'Featured'), ('bestsellers', 'Top Sellers'), ('top-rated', 'Top Rated'), ('new', 'New Releases')], max_length=20, primary_key=True, serialize=False)),
+                ('product_ids', models.JSONField(default=list, help_text='Ranked product ids, best first')),
+                ('built_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('store', '0019_shelf'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductNeighbors',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='neighbors', serialize=False, to='store.product')),
+                ('product_ids', models.JSONField(default=list, help_text='Most similar product ids, best first')),
+            ],
+            options={
+                'verbose_name_plural': 'Product neighbors',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserPicks',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='picks', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('product_ids', models.JSONField(default=list, help_text='Recommended product ids, best first')),
+            ],
+            options={
+                'verbose_name_plural': 'User picks',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('H', 'Hour'), ('D', 'Day')], max_length=1)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour or day (UTC)')),
+                ('category', models.CharField(choices=[('FPS', 'First-Person Shooter'), ('RPG', 'Role-Playing Game'), ('MOBA', 'Multiplayer Online Battle Arena'), ('SIM', 'Simulation'), ('HORROR', 'Horror'), ('Indie', 'Indie')], max_length=20)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, help_text='Sales in this bucket that have not been refunded', max_digits=12)),
+                ('units', models.IntegerField(default=0)),
+                ('refunds', models.IntegerField(default=0)),
+                ('refunded', models.DecimalField(decimal_places=2, default=0, help_text='Money returned by refunds made in this bucket', max_digits=12)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('period', 'bucket', 'product'), name='store_salesrollup_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:37
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_salesrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=100)),
+                ('payload', models.JSONField(default=dict)),
+                ('key', models.CharField(blank=True, help_text='Idempotency key: a second job with the same key is never enqueued', max_length=200, null=True, unique=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='PENDING', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=5)),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'PENDING')), fields=['run_at', 'id'], name='store_job_due'), models.Index(condition=models.Q(('status', 'RUNNING')), fields=['locked_at'], name='store_job_running')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:49
+
+import django.core.validators
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='price',
+            field=models.DecimalField(decimal_places=2, help_text='What was charged, after any discount', max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='Discount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('scope', models.CharField(choices=[('PRODUCT', 'One product'), ('CATEGORY', 'One category'), ('STORE', 'Storewide')], default='PRODUCT', max_length=10)),
+                ('category', models.CharField(blank=True, choices=[('FPS', 'First-Person Shooter'), ('RPG', 'Role-Playing Game'), ('MOBA', 'Multiplayer Online Battle Arena'), ('SIM', 'Simulation'), ('HORROR', 'Horror'), ('Indie', 'Indie')], max_length=20)),
+                ('percent_off', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)])),
+                ('starts_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ends_at', models.DateTimeField(blank=True, help_text='Leave empty to run until deactivated', null=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='discounts', to='store.product')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='discount',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='store.discount'),
+        ),
+        migrations.CreateModel(
+            name='EffectivePrice',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='effective_price', serialize=False, to='store.product')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('percent_off', models.PositiveSmallIntegerField()),
+                ('valid_until', models.DateTimeField(blank=True, help_text='When the winning discount ends', null=True)),
+                ('discount', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.discount')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='discount',
+            constraint=models.CheckConstraint(condition=models.Q(('scope', 'STORE'), models.Q(('category__gt', ''), ('scope', 'CATEGORY')), models.Q(('product__isnull', False), ('scope', 'PRODUCT')), _connector='OR'), name='store_discount_has_target'),
+        ),
+        migrations.AddConstraint(
+            model_name='discount',
+            constraint=models.CheckConstraint(condition=models.Q(('percent_off__gte', 1), ('percent_off__lte', 100)), name='store_discount_percent'),
+        ),
+    ]
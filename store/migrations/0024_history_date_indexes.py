@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_pricing'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['date'], name='store_transaction_date'),
+        ),
+        migrations.AddIndex(
+            model_name='walletentry',
+            index=models.Index(fields=['kind', 'created_at'], name='store_walletentry_kind_time'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0024_history_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('name', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('stamp', models.BigIntegerField(help_text='Nanosecond timestamp of the last bump')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:30
+
+import django.core.serializers.json
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0025_cacheversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LiveEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.CharField(max_length=100)),
+                ('origin', models.CharField(help_text='The publishing process, whose own streams got the event directly', max_length=32)),
+                ('message', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -1,5 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.utils import timezone
 
 CATEGORY_CHOICES = (
     ('FPS', 'First-Person Shooter'),
@@ -18,10 +22,17 @@ class Product(models.Model):
     image = models.ImageField(upload_to='game_covers/', blank=True, null=True)
     is_featured = models.BooleanField(default=False,
     help_text="Check this to show this game in the big Featured section")
+    updated = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            # Only a handful of rows are featured, so the partial index stays tiny.
+            models.Index(fields=['id'], condition=models.Q(is_featured=True), name='store_product_featured'),
+        ]
+
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -30,7 +41,8 @@ class Cart(models.Model):
         return f"Cart for {self.user.username}"
 
 class CartItem(models.Model):
-    cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
+    # The (cart, product) unique constraint's index already serves lookups by cart alone.
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, db_index=False)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
@@ -40,6 +52,11 @@ class CartItem(models.Model):
     def get_total_price(self):
         return self.quantity * self.product.price
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='store_cartitem_unique_product'),
+        ]
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
@@ -62,12 +79,50 @@ class UserLibrary(models.Model):
 class Transaction(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    price = models.DecimalField(max_digits=10, decimal_places=2)
+    price = models.DecimalField(max_digits=10, decimal_places=2, help_text="What was charged, after any discount")
+    discount = models.ForeignKey('Discount', on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
     date = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.user.username} bought {self.product.name} - {self.date}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-date'], name='store_transaction_user_date'),
+            # The sales rollup backfill reads history one day at a time.
+            models.Index(fields=['date'], name='store_transaction_date'),
+        ]
+
+class WalletEntry(models.Model):
+    OPENING = 'OPENING'
+    TOP_UP = 'TOPUP'
+    PURCHASE = 'PURCHASE'
+    REFUND = 'REFUND'
+    KIND_CHOICES = (
+        (OPENING, 'Opening balance'),
+        (TOP_UP, 'Top-up'),
+        (PURCHASE, 'Purchase'),
+        (REFUND, 'Refund'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wallet_entries')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=10, decimal_places=2,
+    help_text="Signed change to the balance: positive for credits, negative for debits")
+    balance_after = models.DecimalField(max_digits=10, decimal_places=2)
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user.username} {self.get_kind_display()} {self.amount:+}"
+
+    class Meta:
+        verbose_name_plural = "Wallet entries"
+        indexes = [
+            models.Index(fields=['user', 'id'], name='store_walletentry_user_seq'),
+            models.Index(fields=['kind', 'created_at'], name='store_walletentry_kind_time'),
+        ]
+
 class Wishlist(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     products = models.ManyToManyField(Product)
@@ -85,11 +140,248 @@ class Review(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.product.name} ({self.rating} stars)"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-created_at', '-id'], name='store_review_product_recent'),
+        ]
+
+class ProductRating(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='rating')
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.product.name}: {self.average} ({self.count} reviews)"
+
+    @property
+    def average(self):
+        if not self.count:
+            return None
+        return round(self.total / self.count, 1)
+
+    @property
+    def histogram(self):
+        return [(stars, getattr(self, f'stars_{stars}')) for stars in range(5, 0, -1)]
+
 class StoreBanner(models.Model):
     title = models.CharField(max_length=200)
     image = models.ImageField(upload_to='banners/')
     is_active = models.BooleanField(default=True)
+    updated = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title
-        
\ No newline at end of file
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(is_active=True), name='store_storebanner_active'),
+        ]
+
+class Shelf(models.Model):
+    FEATURED = 'featured'
+    BESTSELLERS = 'bestsellers'
+    TOP_RATED = 'top-rated'
+    NEW = 'new'
+    NAME_CHOICES = (
+        (FEATURED, 'Featured'),
+        (BESTSELLERS, 'Top Sellers'),
+        (TOP_RATED, 'Top Rated'),
+        (NEW, 'New Releases'),
+    )
+
+    name = models.CharField(max_length=20, choices=NAME_CHOICES, primary_key=True)
+    product_ids = models.JSONField(default=list, help_text="Ranked product ids, best first")
+    built_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.get_name_display()} ({len(self.product_ids)} products)"
+
+class ProductNeighbors(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='neighbors')
+    product_ids = models.JSONField(default=list, help_text="Most similar product ids, best first")
+
+    class Meta:
+        verbose_name_plural = "Product neighbors"
+
+class UserPicks(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='picks')
+    product_ids = models.JSONField(default=list, help_text="Recommended product ids, best first")
+
+    class Meta:
+        verbose_name_plural = "User picks"
+
+class SalesRollup(models.Model):
+    HOUR = 'H'
+    DAY = 'D'
+    PERIOD_CHOICES = (
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    )
+
+    period = models.CharField(max_length=1, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField(help_text="Start of the hour or day (UTC)")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    category = models.CharField(max_length=20, choices=CATEGORY_CHOICES)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0,
+    help_text="Sales in this bucket that have not been refunded")
+    units = models.IntegerField(default=0)
+    refunds = models.IntegerField(default=0)
+    refunded = models.DecimalField(max_digits=12, decimal_places=2, default=0,
+    help_text="Money returned by refunds made in this bucket")
+
+    def __str__(self):
+        return f"{self.product.name} {self.get_period_display()} {self.bucket:%Y-%m-%d %H:00}"
+
+    class Meta:
+        constraints = [
+            # Also the index the dashboard's (period, bucket range) scans use.
+            models.UniqueConstraint(fields=['period', 'bucket', 'product'], name='store_salesrollup_unique'),
+        ]
+
+class ImageVariant(models.Model):
+    source = models.CharField(max_length=255, db_index=True)
+    spec = models.CharField(max_length=20)
+    format = models.CharField(max_length=10)
+    width = models.PositiveIntegerField()
+    name = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'spec', 'format', 'width'], name='store_imagevariant_unique'),
+        ]
+
+class SearchToken(models.Model):
+    TERM = 'T'
+    TRIGRAM = 'G'
+    KIND_CHOICES = (
+        (TERM, 'Term'),
+        (TRIGRAM, 'Trigram'),
+    )
+
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES, default=TERM)
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_tokens')
+    weight = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.term} -> {self.product_id} ({self.weight})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'term'], name='store_searchtoken_lookup'),
+        ]
+
+class Job(models.Model):
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    key = models.CharField(max_length=200, unique=True, blank=True, null=True,
+    help_text="Idempotency key: a second job with the same key is never enqueued")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.task} #{self.id} ({self.get_status_display()})"
+
+    class Meta:
+        indexes = [
+            # Workers poll for due pending jobs; finished ones stay out of the index.
+            models.Index(fields=['run_at', 'id'], condition=models.Q(status='PENDING'), name='store_job_due'),
+            models.Index(fields=['locked_at'], condition=models.Q(status='RUNNING'), name='store_job_running'),
+        ]
+
+class Discount(models.Model):
+    PRODUCT = 'PRODUCT'
+    CATEGORY = 'CATEGORY'
+    STORE = 'STORE'
+    SCOPE_CHOICES = (
+        (PRODUCT, 'One product'),
+        (CATEGORY, 'One category'),
+        (STORE, 'Storewide'),
+    )
+
+    name = models.CharField(max_length=100)
+    scope = models.CharField(max_length=10, choices=SCOPE_CHOICES, default=PRODUCT)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, blank=True, null=True, related_name='discounts')
+    category = models.CharField(max_length=20, choices=CATEGORY_CHOICES, blank=True)
+    percent_off = models.PositiveSmallIntegerField(validators=[MinValueValidator(1), MaxValueValidator(100)])
+    starts_at = models.DateTimeField(default=timezone.now)
+    ends_at = models.DateTimeField(blank=True, null=True, help_text="Leave empty to run until deactivated")
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.name} (-{self.percent_off}%)"
+
+    def clean(self):
+        if self.scope == self.PRODUCT and not self.product_id:
+            raise ValidationError({'product': "Choose the product this discount applies to."})
+        if self.scope == self.CATEGORY and not self.category:
+            raise ValidationError({'category': "Choose the category this discount applies to."})
+        if self.ends_at and self.ends_at <= self.starts_at:
+            raise ValidationError({'ends_at': "The discount must end after it starts."})
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(scope='STORE')
+                | models.Q(scope='CATEGORY', category__gt='')
+                | models.Q(scope='PRODUCT', product__isnull=False),
+                name='store_discount_has_target',
+            ),
+            models.CheckConstraint(condition=models.Q(percent_off__gte=1, percent_off__lte=100), name='store_discount_percent'),
+        ]
+
+class EffectivePrice(models.Model):
+    """Materialized sale prices: one row per product with a discount running, none for the rest."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='effective_price')
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    percent_off = models.PositiveSmallIntegerField()
+    discount = models.ForeignKey(Discount, on_delete=models.CASCADE, related_name='+')
+    valid_until = models.DateTimeField(blank=True, null=True, help_text="When the winning discount ends")
+
+    def __str__(self):
+        return f"{self.product.name}: {self.price} (-{self.percent_off}%)"
+
+class CacheVersion(models.Model):
+    """The current version of a family of cached entries, shared by every process through the database."""
+    name = models.CharField(max_length=30, primary_key=True)
+    stamp = models.BigIntegerField(help_text="Nanosecond timestamp of the last bump")
+
+    def __str__(self):
+        return f"{self.name} @ {self.stamp}"
+
+class LiveEvent(models.Model):
+    """An event for open live streams, read by every web process so it reaches tabs served by any of them."""
+    group = models.CharField(max_length=100)
+    origin = models.CharField(max_length=32, help_text="The publishing process, whose own streams got the event directly")
+    message = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.group}: {self.message.get('event')}"
@@ -0,0 +1,80 @@
+import zlib
+
+from django.core.cache import cache
+
+from .models import UserLibrary, Wishlist
+from .routers import primary
+
+CACHE_TIMEOUT = 60 * 60
+
+
+def _cache_key(user_id):
+    return f"store:ownership:{user_id}"
+
+
+def to_bitset(product_ids):
+    product_ids = list(product_ids)
+    bits = bytearray((max(product_ids) >> 3) + 1 if product_ids else 0)
+    for product_id in product_ids:
+        bits[product_id >> 3] |= 1 << (product_id & 7)
+    return bytes(bits)
+
+
+def has_bit(bits, product_id):
+    index = product_id >> 3
+    return index < len(bits) and bool(bits[index] >> (product_id & 7) & 1)
+
+
+def pack(bits):
+    return zlib.compress(bits)
+
+
+def unpack(blob):
+    return zlib.decompress(blob)
+
+
+class Membership:
+    """Owned and wishlisted product ids for one user, as byte bitmaps indexed by product id."""
+
+    def __init__(self, owned=b'', wished=b''):
+        self.owned = owned
+        self.wished = wished
+
+    def owns(self, product_id):
+        return has_bit(self.owned, product_id)
+
+    def wishes(self, product_id):
+        return has_bit(self.wished, product_id)
+
+    def annotate(self, products):
+        for product in products:
+            product.is_owned = self.owns(product.id)
+            product.is_wishlisted = self.wishes(product.id)
+        return products
+
+
+EMPTY = Membership()
+
+
+@primary()
+def build(user_id):
+    owned = UserLibrary.products.through.objects.filter(userlibrary__user_id=user_id).values_list('product_id', flat=True)
+    wished = Wishlist.products.through.objects.filter(wishlist__user_id=user_id).values_list('product_id', flat=True)
+    return Membership(to_bitset(owned), to_bitset(wished))
+
+
+def for_user(user):
+    if not user.is_authenticated:
+        return EMPTY
+    key = _cache_key(user.id)
+    packed = cache.get(key)
+    if packed is not None:
+        return Membership(unpack(packed[0]), unpack(packed[1]))
+
+    membership = build(user.id)
+    cache.set(key, (pack(membership.owned), pack(membership.wished)), CACHE_TIMEOUT)
+    return membership
+
+
+def invalidate(*user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
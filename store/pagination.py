@@ -0,0 +1,92 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+PAGE_SIZE = 24
+
+
+def _cursor_value(value):
+    # Full-precision isoformat: DjangoJSONEncoder drops microseconds, which would repeat rows across pages.
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':'), default=_cursor_value).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _after(fields, values):
+    # (a, b) > (x, y) expands to a > x OR (a = x AND b > y), honouring each column's direction.
+    condition = Q()
+    for i, (name, descending) in enumerate(fields):
+        step = Q(**{f"{name}__{'lt' if descending else 'gt'}": values[i]})
+        for previous, value in zip(fields[:i], values[:i]):
+            step &= Q(**{previous[0]: value})
+        condition |= step
+    return condition
+
+
+def _parse(field, value):
+    value = field.to_python(value)
+    # The validators hold each column's range, so an out-of-range id never reaches the database.
+    if value is not None:
+        field.run_validators(value)
+    return value
+
+
+def keyset_page(queryset, cursor=None, size=PAGE_SIZE, order_by=('id',)):
+    """Return (items, next_cursor) for a queryset ordered by unique order_by columns."""
+    fields = [(name.lstrip('-'), name.startswith('-')) for name in order_by]
+    after = decode_cursor(cursor)
+    if after and len(after) == len(fields):
+        try:
+            values = [
+                _parse(queryset.model._meta.get_field(name), value)
+                for (name, descending), value in zip(fields, after)
+            ]
+        except (ValidationError, TypeError, ValueError, OverflowError):
+            # A tampered cursor is treated like a missing one: the first page.
+            values = None
+        if values and None not in values:
+            queryset = queryset.filter(_after(fields, values))
+
+    items = list(queryset.order_by(*order_by)[:size + 1])
+    next_cursor = None
+    if len(items) > size:
+        items = items[:size]
+        next_cursor = encode_cursor([getattr(items[-1], name) for name, descending in fields])
+    return items, next_cursor
+
+
+def ranked_page(ranked, cursor=None, size=PAGE_SIZE):
+    """Keyset-paginate (id, score) pairs already sorted by (-score, id)."""
+    after = decode_cursor(cursor)
+    if after and len(after) == 2 and all(isinstance(value, (int, float)) for value in after):
+        last_score, last_id = after
+        ranked = [
+            (product_id, score) for product_id, score in ranked
+            if (-score, product_id) > (-last_score, last_id)
+        ]
+
+    page = ranked[:size]
+    next_cursor = None
+    if len(ranked) > size:
+        product_id, score = page[-1]
+        next_cursor = encode_cursor([score, product_id])
+    return page, next_cursor
@@ -0,0 +1,164 @@
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from . import fragments, jobs
+from .models import Discount, EffectivePrice, Product
+from .routers import primary
+
+VERSION = 'prices'
+CACHE_TIMEOUT = 60 * 60
+BATCH_SIZE = 2000
+CENT = Decimal('0.01')
+# Cached for products with no sale running, so they are not looked up again; get_many() cannot tell None from a miss.
+NO_SALE = False
+
+Sale = namedtuple('Sale', 'price percent_off ends_at discount_id')
+
+
+def discounted(price, percent_off):
+    return (price * (100 - percent_off) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def active_discounts(now):
+    return Discount.objects.filter(Q(ends_at__isnull=True) | Q(ends_at__gt=now), is_active=True, starts_at__lte=now)
+
+
+def _targets(discounts):
+    """Split discounts into the best one per product, per category and storewide."""
+    by_product, by_category, storewide = {}, {}, None
+    # Best first: the biggest cut wins, and the older discount breaks ties.
+    for discount in discounts.order_by('-percent_off', 'id'):
+        if discount.scope == Discount.STORE:
+            storewide = storewide or discount
+        elif discount.scope == Discount.CATEGORY:
+            by_category.setdefault(discount.category, discount)
+        else:
+            by_product.setdefault(discount.product_id, discount)
+    return by_product, by_category, storewide
+
+
+def _prices(targets, rows):
+    by_product, by_category, storewide = targets
+    for product_id, category, price in rows:
+        candidates = [discount for discount in (by_product.get(product_id), by_category.get(category), storewide) if discount]
+        if candidates:
+            best = min(candidates, key=lambda discount: (-discount.percent_off, discount.id))
+            yield EffectivePrice(
+                product_id=product_id,
+                price=discounted(price, best.percent_off),
+                percent_off=best.percent_off,
+                discount=best,
+                valid_until=best.ends_at,
+            )
+
+
+def effective_prices(now):
+    targets = by_product, by_category, storewide = _targets(active_discounts(now))
+    if storewide:
+        products = Product.objects.all()
+    elif by_category:
+        products = Product.objects.filter(Q(id__in=by_product) | Q(category__in=by_category))
+    elif by_product:
+        products = Product.objects.filter(id__in=by_product)
+    else:
+        return
+    yield from _prices(targets, products.values_list('id', 'category', 'price').iterator(chunk_size=BATCH_SIZE))
+
+
+def materialize(now=None):
+    """Rewrite the effective price table from the discounts running now and schedule the next rewrite."""
+    now = now or timezone.now()
+    rows = list(effective_prices(now))
+    with transaction.atomic():
+        EffectivePrice.objects.all().delete()
+        EffectivePrice.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        schedule_next(now)
+    # Cached prices and rendered cards are keyed on these versions.
+    fragments.bump(VERSION, fragments.CATALOG)
+    return len(rows)
+
+
+def next_change(now):
+    """When the next discount starts or ends, or None if nothing is scheduled."""
+    bounds = Discount.objects.filter(is_active=True).aggregate(
+        start=Min('starts_at', filter=Q(starts_at__gt=now)),
+        end=Min('ends_at', filter=Q(ends_at__gt=now)),
+    )
+    boundaries = [moment for moment in bounds.values() if moment is not None]
+    return min(boundaries) if boundaries else None
+
+
+def schedule_next(now):
+    boundary = next_change(now)
+    if boundary is not None:
+        # Keyed on the moment, so rewrites that find the same boundary queue a single job.
+        jobs.enqueue('materialize_prices', key=f'prices:{boundary.isoformat()}', delay=boundary - now)
+    return boundary
+
+
+def reprice(product, now=None):
+    """Recompute one product's effective price after its list price or category changed."""
+    now = now or timezone.now()
+    discounts = active_discounts(now).filter(
+        Q(scope=Discount.STORE) | Q(scope=Discount.CATEGORY, category=product.category) | Q(scope=Discount.PRODUCT, product_id=product.id)
+    )
+    row = next(_prices(_targets(discounts), [(product.id, product.category, product.price)]), None)
+    if row is None:
+        EffectivePrice.objects.filter(product_id=product.id).delete()
+    else:
+        EffectivePrice.objects.update_or_create(product_id=product.id, defaults={
+            'price': row.price, 'percent_off': row.percent_off, 'discount': row.discount, 'valid_until': row.valid_until,
+        })
+    cache.delete(cache_key(product.id))
+
+
+def cache_key(product_id, version=None):
+    return f"store:price:{version or fragments.version(VERSION)}:{product_id}"
+
+
+def sales(product_ids, cached=True, now=None):
+    """Return {product id: Sale} for the given products that are on sale now.
+
+    One cache round trip, plus one query for the products the cache did not have. Checkout
+    passes cached=False to read the table inside its transaction."""
+    now = now or timezone.now()
+    wanted = set(product_ids)
+    found = {}
+    if cached and wanted:
+        version = fragments.version(VERSION)
+        keys = {cache_key(product_id, version): product_id for product_id in wanted}
+        found = {keys[key]: sale for key, sale in cache.get_many(keys).items()}
+    missing = wanted - found.keys()
+    if missing:
+        with primary():
+            rows = {
+                row.product_id: Sale(row.price, row.percent_off, row.valid_until, row.discount_id)
+                for row in EffectivePrice.objects.filter(product_id__in=missing)
+            }
+        loaded = {product_id: rows.get(product_id, NO_SALE) for product_id in missing}
+        if cached:
+            cache.set_many({cache_key(product_id, version): sale for product_id, sale in loaded.items()}, CACHE_TIMEOUT)
+        found.update(loaded)
+    # A discount past its end is ignored even before the rewrite scheduled for that moment has run.
+    return {
+        product_id: sale for product_id, sale in found.items()
+        if sale and (sale.ends_at is None or sale.ends_at > now)
+    }
+
+
+def apply(*product_lists, now=None):
+    """Set product.sale (a Sale, or None) on every product in the lists with a single lookup."""
+    products = [product for products in product_lists for product in products]
+    found = sales({product.id for product in products}, now=now)
+    for product in products:
+        product.sale = found.get(product.id)
+
+
+def unit_price(product):
+    sale = getattr(product, 'sale', None)
+    return sale.price if sale else product.price
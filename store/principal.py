@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+
+from .routers import primary
+
+# Short enough that another process's cached copy of a changed password does not outlive it for long:
+# invalidation only reaches the local cache when each process keeps its own.
+CACHE_TIMEOUT = 60 * 5
+
+
+@dataclass
+class Principal:
+    """Everything per-user that most requests need, loaded with one query and cached as one object."""
+    user: User
+    profile: object = None
+    cart_id: int = None
+    library_id: int = None
+    wishlist_id: int = None
+
+
+def cache_key(user_id):
+    return f"store:principal:{user_id}"
+
+
+def _related(user, name):
+    # select_related caches a missing reverse one-to-one too, so this never queries.
+    try:
+        return getattr(user, name)
+    except ObjectDoesNotExist:
+        return None
+
+
+@primary()
+def build(user_id):
+    user = (
+        User.objects.select_related('userprofile', 'cart', 'userlibrary', 'wishlist')
+        .filter(id=user_id).first()
+    )
+    if user is None:
+        return None
+    cart, library, wishlist = (_related(user, name) for name in ('cart', 'userlibrary', 'wishlist'))
+    principal = Principal(
+        user=user,
+        profile=_related(user, 'userprofile'),
+        cart_id=cart.id if cart else None,
+        library_id=library.id if library else None,
+        wishlist_id=wishlist.id if wishlist else None,
+    )
+    user.principal = principal
+    return principal
+
+
+def load(user_id):
+    key = cache_key(user_id)
+    principal = cache.get(key)
+    if principal is None:
+        principal = build(user_id)
+        if principal is not None:
+            cache.set(key, principal, CACHE_TIMEOUT)
+    return principal
+
+
+def of(user):
+    """The principal of an authenticated request.user."""
+    return getattr(user, 'principal', None) or load(user.id)
+
+
+async def aof(user):
+    return getattr(user, 'principal', None) or await sync_to_async(load)(user.id)
+
+
+def invalidate(user_id):
+    cache.delete(cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose per-request user lookup is served from the cached principal.
+
+    The session auth hash is still checked against the cached user's password, and password changes
+    drop the cached principal, so a changed password logs out other sessions as before."""
+
+    def get_user(self, user_id):
+        principal = load(user_id)
+        if principal is None or not self.user_can_authenticate(principal.user):
+            return None
+        return principal.user
+
+    async def aget_user(self, user_id):
+        return await sync_to_async(self.get_user)(user_id)
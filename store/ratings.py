@@ -0,0 +1,49 @@
+from django.db.models import Count, F
+
+from .models import ProductRating, Review
+
+
+def clamp_stars(rating):
+    try:
+        stars = int(rating)
+    except (TypeError, ValueError):
+        stars = 5
+    return min(max(stars, 1), 5)
+
+
+def _apply(product_id, stars, sign):
+    return ProductRating.objects.filter(product_id=product_id).update(**{
+        'count': F('count') + sign,
+        'total': F('total') + sign * stars,
+        f'stars_{stars}': F(f'stars_{stars}') + sign,
+    })
+
+
+def record(review):
+    if not _apply(review.product_id, clamp_stars(review.rating), 1):
+        ProductRating.objects.get_or_create(product_id=review.product_id)
+        _apply(review.product_id, clamp_stars(review.rating), 1)
+
+
+def retract(review):
+    # Never creates a row: when a product is deleted its rating may already be gone.
+    _apply(review.product_id, clamp_stars(review.rating), -1)
+
+
+def tally(reviews):
+    """{product id: unsaved ProductRating} for the given reviews, from one aggregate query."""
+    tallied = {}
+    rows = reviews.values_list('product_id', 'rating').annotate(n=Count('id')).order_by()
+    for product_id, rating_value, n in rows.iterator():
+        rating = tallied.setdefault(product_id, ProductRating(product_id=product_id))
+        stars = clamp_stars(rating_value)
+        rating.count += n
+        rating.total += stars * n
+        setattr(rating, f'stars_{stars}', getattr(rating, f'stars_{stars}') + n)
+    return tallied
+
+
+def recompute(product_id):
+    rating = tally(Review.objects.filter(product_id=product_id)).get(product_id) or ProductRating(product_id=product_id)
+    rating.save()
+    return rating
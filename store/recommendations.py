@@ -0,0 +1,178 @@
+from itertools import chain
+
+from django.core.cache import cache
+from django.db import transaction
+
+from . import fragments
+from .models import Product, ProductNeighbors, UserPicks, UserLibrary, Wishlist
+from .routers import primary
+
+NEIGHBORS = 20
+PICKS = 24
+BLOCK_SIZE = 2000
+WISHLIST_WEIGHT = 0.5
+CACHE_TIMEOUT = 60 * 60
+
+# Bumped after every build so cached lookups from the previous build stop being served; the build
+# runs from cron, and the bump reaches web processes through the CacheVersion table.
+VERSION = 'recommendations'
+
+PERSONAL_SHELF = 'picks'
+PERSONAL_TITLE = 'Recommended for You'
+
+
+def _libraries():
+    # NumPy and SciPy are only needed by the offline build, not to serve pages.
+    import numpy
+    from scipy import sparse
+    return numpy, sparse
+
+
+def top_k(rows, cols, data, k):
+    """Keep the k highest non-negative scores of each row, returned grouped by row, best first."""
+    np = _libraries()[0]
+    if not len(rows):
+        return rows, cols, data
+    # One float sort instead of a lexsort: the row is the integer part and the inverted score the fraction.
+    scale = data.max() * 2 or 1.0
+    order = np.argsort((rows - rows.min()) + (0.5 - data / scale), kind='stable')
+    rows, cols, data = rows[order], cols[order], data[order]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    run_start = np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+    keep = np.arange(len(rows)) - run_start < k
+    return rows[keep], cols[keep], data[keep]
+
+
+def similar_items(matrix, k=NEIGHBORS, block_size=BLOCK_SIZE):
+    """Top-k cosine neighbours of every column of a users x items matrix, as (rows, cols, scores)."""
+    np, sparse = _libraries()
+    items = matrix.T.tocsr()
+    norms = np.sqrt(np.asarray(items.multiply(items).sum(axis=1)).ravel())
+    inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    normalized = sparse.diags(inverse) @ items
+    transposed = normalized.T.tocsc()
+
+    parts = []
+    # Item x item co-occurrence is far denser than the input, so it is built one block of rows at a time.
+    for start in range(0, items.shape[0], block_size):
+        block = (normalized[start:start + block_size] @ transposed).tocoo()
+        rows = block.row.astype(np.int64) + start
+        not_self = block.col != rows
+        parts.append(top_k(rows[not_self], block.col[not_self].astype(np.int64), block.data[not_self], k))
+    return tuple(np.concatenate(column) for column in zip(*parts)) if parts else _empty()
+
+
+def personal_picks(matrix, similarity, k=PICKS, block_size=BLOCK_SIZE * 5):
+    """Score every item for every user by summing the neighbours of what they have, skipping those items."""
+    np, sparse = _libraries()
+    rows, cols, data = similarity
+    neighbours = sparse.csr_matrix((data, (rows, cols)), shape=(matrix.shape[1], matrix.shape[1]))
+    interacted = matrix.astype(bool)
+
+    parts = []
+    for start in range(0, matrix.shape[0], block_size):
+        scores = matrix[start:start + block_size] @ neighbours
+        scores = (scores - scores.multiply(interacted[start:start + block_size])).tocoo()
+        scores.eliminate_zeros()
+        parts.append(top_k(scores.row.astype(np.int64) + start, scores.col.astype(np.int64), scores.data, k))
+    return tuple(np.concatenate(column) for column in zip(*parts)) if parts else _empty()
+
+
+def _empty():
+    np = _libraries()[0]
+    return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+
+
+def grouped(rows, cols):
+    """Yield (row, [col, ...]) for (rows, cols) already grouped by row."""
+    np = _libraries()[0]
+    boundaries = np.flatnonzero(np.diff(rows)) + 1
+    for row_group, col_group in zip(np.split(rows, boundaries), np.split(cols, boundaries)):
+        if len(row_group):
+            yield int(row_group[0]), col_group
+
+
+def interaction_matrix():
+    """Users x products matrix of library (1.0) and wishlist links, with the ids each axis maps to."""
+    np, sparse = _libraries()
+    links = (
+        (UserLibrary.products.through, 'userlibrary__user_id', 1.0),
+        (Wishlist.products.through, 'wishlist__user_id', WISHLIST_WEIGHT),
+    )
+    pairs, weights = [], []
+    for model, user_field, weight in links:
+        rows = model.objects.values_list(user_field, 'product_id').iterator(chunk_size=10000)
+        flat = np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(-1, 2)
+        pairs.append(flat)
+        weights.append(np.full(len(flat), weight))
+    pairs = np.concatenate(pairs)
+    weights = np.concatenate(weights)
+
+    product_ids = np.fromiter(Product.objects.order_by('id').values_list('id', flat=True).iterator(), dtype=np.int64)
+    product_index = np.searchsorted(product_ids, pairs[:, 1])
+    # Links to products deleted while the ids were being read are dropped.
+    if len(product_ids):
+        known = product_ids[np.minimum(product_index, len(product_ids) - 1)] == pairs[:, 1]
+    else:
+        known = np.zeros(len(pairs), dtype=bool)
+    pairs, weights, product_index = pairs[known], weights[known], product_index[known]
+    user_ids, user_index = np.unique(pairs[:, 0], return_inverse=True)
+    matrix = sparse.csr_matrix((weights, (user_index, product_index)), shape=(len(user_ids), len(product_ids)))
+    return matrix, user_ids, product_ids
+
+
+def build(neighbors=NEIGHBORS, picks=PICKS, block_size=BLOCK_SIZE):
+    """Rebuild ProductNeighbors and UserPicks from every library and wishlist."""
+    matrix, user_ids, product_ids = interaction_matrix()
+    similarity = similar_items(matrix, neighbors, block_size)
+    personal = personal_picks(matrix, similarity, picks)
+
+    with transaction.atomic():
+        ProductNeighbors.objects.all().delete()
+        ProductNeighbors.objects.bulk_create([
+            ProductNeighbors(product_id=int(product_ids[row]), product_ids=product_ids[cols].tolist())
+            for row, cols in grouped(similarity[0], similarity[1])
+        ], batch_size=1000)
+        UserPicks.objects.all().delete()
+        UserPicks.objects.bulk_create([
+            UserPicks(user_id=int(user_ids[row]), product_ids=product_ids[cols].tolist())
+            for row, cols in grouped(personal[0], personal[1])
+        ], batch_size=1000)
+    fragments.bump(VERSION)
+    return {
+        'users': len(user_ids),
+        'products': len(product_ids),
+        'links': matrix.nnz,
+        'neighbors': len(similarity[0]),
+        'picks': len(personal[0]),
+    }
+
+
+def _cached_ids(kind, key_id, load):
+    key = f"store:recs:{fragments.version(VERSION)}:{kind}:{key_id}"
+    product_ids = cache.get(key)
+    if product_ids is None:
+        with primary():
+            product_ids = load() or []
+        cache.set(key, product_ids, CACHE_TIMEOUT)
+    return product_ids
+
+
+def neighbor_ids(product_id):
+    return _cached_ids('product', product_id, lambda: (
+        ProductNeighbors.objects.filter(product_id=product_id).values_list('product_ids', flat=True).first()
+    ))
+
+
+def pick_ids(user):
+    if not user.is_authenticated:
+        return []
+    return _cached_ids('user', user.id, lambda: (
+        UserPicks.objects.filter(user_id=user.id).values_list('product_ids', flat=True).first()
+    ))
+
+
+def also_bought(product_id, limit=6):
+    product_ids = neighbor_ids(product_id)[:limit]
+    by_id = Product.objects.in_bulk(product_ids) if product_ids else {}
+    return [by_id[other_id] for other_id in product_ids if other_id in by_id]
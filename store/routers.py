@@ -0,0 +1,80 @@
+import random
+from contextvars import ContextVar
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+_replica = ContextVar('store_read_replica', default=None)
+_wrote = ContextVar('store_wrote_primary', default=False)
+
+
+def choose_replica():
+    replicas = getattr(settings, 'STORE_READ_REPLICAS', [])
+    return random.choice(replicas) if replicas else None
+
+
+class PrimaryReplicaRouter:
+    """Everything uses the primary unless a read_replica view is running and has not written yet."""
+
+    def db_for_read(self, model, **hints):
+        alias = _replica.get()
+        if alias is None or _wrote.get() or connections['default'].in_atomic_block:
+            return 'default'
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # Once a request writes, its later reads go to the primary so it sees its own writes.
+        if _replica.get() is not None:
+            _wrote.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside the block, even in a read_replica view.
+
+    Loaders that fill a long-lived cache read here, so a lagging replica's rows never outlive
+    the invalidation that follows the write."""
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def read_replica(view):
+    """Let a view's safe requests read from a replica; unsafe methods stay on the primary."""
+
+    @contextmanager
+    def reading_from(request):
+        alias = choose_replica() if request.method in SAFE_METHODS else None
+        if alias is None:
+            yield
+            return
+        replica_token = _replica.set(alias)
+        wrote_token = _wrote.set(False)
+        try:
+            yield
+        finally:
+            _wrote.reset(wrote_token)
+            _replica.reset(replica_token)
+
+    if iscoroutinefunction(view):
+        async def wrapper(request, *args, **kwargs):
+            with reading_from(request):
+                return await view(request, *args, **kwargs)
+    else:
+        def wrapper(request, *args, **kwargs):
+            with reading_from(request):
+                return view(request, *args, **kwargs)
+
+    return wraps(view)(wrapper)
@@ -0,0 +1,166 @@
+import re
+from collections import defaultdict
+from itertools import islice
+
+from django.db import connection, transaction
+
+from .models import Product, SearchToken, CATEGORY_CHOICES
+
+WORD_RE = re.compile(r'\w+')
+
+NAME_WEIGHT = 10
+CATEGORY_WEIGHT = 5
+DESCRIPTION_WEIGHT = 1
+MAX_DESCRIPTION_WEIGHT = 5
+
+MIN_PREFIX_LENGTH = 2
+MIN_TRIGRAM_SIMILARITY = 0.5
+MAX_TERM_LENGTH = SearchToken._meta.get_field('term').max_length
+
+CATEGORY_NAMES = dict(CATEGORY_CHOICES)
+
+
+def tokenize(text):
+    return [word[:MAX_TERM_LENGTH] for word in WORD_RE.findall((text or '').lower())]
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def product_terms(product):
+    terms = defaultdict(int)
+    for word in tokenize(product.name):
+        terms[word] += NAME_WEIGHT
+
+    category_text = f"{product.category} {CATEGORY_NAMES.get(product.category, '')}"
+    for word in tokenize(category_text):
+        terms[word] += CATEGORY_WEIGHT
+
+    description_hits = defaultdict(int)
+    for word in tokenize(product.description):
+        description_hits[word] += DESCRIPTION_WEIGHT
+    for word, weight in description_hits.items():
+        terms[word] += min(weight, MAX_DESCRIPTION_WEIGHT)
+
+    return terms
+
+
+def product_trigrams(product):
+    grams = defaultdict(int)
+    words = tokenize(product.name) + tokenize(CATEGORY_NAMES.get(product.category, ''))
+    for word in words:
+        for gram in trigrams(word):
+            grams[gram] += 1
+    return grams
+
+
+def token_rows(product):
+    for term, weight in product_terms(product).items():
+        yield SearchToken.TERM, term, product.id, weight
+    for gram, weight in product_trigrams(product).items():
+        yield SearchToken.TRIGRAM, gram, product.id, weight
+
+
+def _insert_tokens(rows, batch_size=1000):
+    # A product yields dozens of tokens; plain executemany skips building a model instance for each one.
+    meta = SearchToken._meta
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(meta.get_field(name).column) for name in ('kind', 'term', 'product', 'weight'))
+    sql = f"INSERT INTO {quote(meta.db_table)} ({columns}) VALUES (%s, %s, %s, %s)"
+    rows = iter(rows)
+    with connection.cursor() as cursor:
+        while batch := list(islice(rows, batch_size)):
+            cursor.executemany(sql, batch)
+
+
+def index_product(product):
+    index_products([product])
+
+
+def index_products(products, batch_size=1000):
+    products = list(products)
+    with transaction.atomic():
+        SearchToken.objects.filter(product_id__in=[product.id for product in products]).delete()
+        _insert_tokens((row for product in products for row in token_rows(product)), batch_size)
+
+
+def unindex_product(product_id):
+    SearchToken.objects.filter(product_id=product_id).delete()
+
+
+def rebuild_index(products=None, batch_size=1000):
+    if products is None:
+        products = Product.objects.all()
+    products = products.only('id', 'name', 'description', 'category').order_by('id')
+
+    indexed = 0
+
+    def rows():
+        nonlocal indexed
+        for product in products.iterator(chunk_size=batch_size):
+            indexed += 1
+            yield from token_rows(product)
+
+    with transaction.atomic():
+        SearchToken.objects.all().delete()
+        _insert_tokens(rows(), batch_size)
+    return indexed
+
+
+def _match_term(word):
+    tokens = SearchToken.objects.filter(kind=SearchToken.TERM)
+    if len(word) >= MIN_PREFIX_LENGTH:
+        # A half-open range instead of LIKE 'word%' so the (kind, term) index is used.
+        tokens = tokens.filter(term__gte=word, term__lt=word + '\uffff')
+    else:
+        tokens = tokens.filter(term=word)
+
+    scores = defaultdict(int)
+    for product_id, term, weight in tokens.values_list('product_id', 'term', 'weight'):
+        scores[product_id] += weight * 2 if term == word else weight
+    return scores
+
+
+def _match_trigrams(word):
+    grams = trigrams(word)
+    hits = defaultdict(int)
+    rows = SearchToken.objects.filter(kind=SearchToken.TRIGRAM, term__in=grams)
+    for product_id, in rows.values_list('product_id'):
+        hits[product_id] += 1
+
+    scores = {}
+    for product_id, matched in hits.items():
+        similarity = matched / len(grams)
+        if similarity >= MIN_TRIGRAM_SIMILARITY:
+            scores[product_id] = similarity * NAME_WEIGHT
+    return scores
+
+
+def search(query, limit=None):
+    words = tokenize(query)
+    if not words:
+        return []
+
+    combined = None
+    for word in dict.fromkeys(words):
+        scores = _match_term(word)
+        if not scores and len(word) >= 3:
+            scores = _match_trigrams(word)
+        if combined is None:
+            combined = dict(scores)
+        else:
+            combined = {pid: combined[pid] + score for pid, score in scores.items() if pid in combined}
+        if not combined:
+            return []
+
+    ranked = sorted(combined.items(), key=lambda item: (-item[1], item[0]))
+    if limit is not None:
+        ranked = ranked[:limit]
+    return ranked
+
+
+def ranked_products(ranked):
+    products = Product.objects.select_related('rating').in_bulk([product_id for product_id, score in ranked])
+    return [products[product_id] for product_id, score in ranked if product_id in products]
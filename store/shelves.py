@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, FloatField, Sum, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from . import fragments
+from .models import Product, ProductRating, Shelf, Transaction
+from .routers import primary
+
+VERSION = 'shelves'
+CACHE_TIMEOUT = 60 * 60
+SIZE = 12
+
+FEATURED = Shelf.FEATURED
+BESTSELLERS = Shelf.BESTSELLERS
+TOP_RATED = Shelf.TOP_RATED
+NEW = Shelf.NEW
+TITLES = dict(Shelf.NAME_CHOICES)
+
+
+def featured():
+    return Product.objects.filter(is_featured=True).order_by('-updated', '-id').values_list('id', flat=True)[:SIZE]
+
+
+def bestsellers():
+    days = getattr(settings, 'STORE_BESTSELLER_WINDOW_DAYS', 30)
+    since = timezone.now() - timedelta(days=days)
+    rows = (
+        Transaction.objects.filter(date__gte=since)
+        .values('product_id').annotate(sales=Count('id'))
+        .order_by('-sales', 'product_id')
+        .values_list('product_id', flat=True)
+    )
+    return rows[:SIZE]
+
+
+def top_rated():
+    # Bayesian average: every product starts with `prior` votes at the store-wide mean,
+    # so one five-star review does not outrank fifty four-star ones.
+    prior = getattr(settings, 'STORE_RATING_PRIOR_VOTES', 10)
+    totals = ProductRating.objects.aggregate(count=Sum('count'), total=Sum('total'))
+    if not totals['count']:
+        return []
+    mean = totals['total'] / totals['count']
+    score = (Value(prior * mean) + Cast('total', FloatField())) / (Value(float(prior)) + F('count'))
+    return (
+        ProductRating.objects.filter(count__gt=0)
+        .annotate(score=score)
+        .order_by('-score', '-count', 'product_id')
+        .values_list('product_id', flat=True)[:SIZE]
+    )
+
+
+def new():
+    return Product.objects.order_by('-id').values_list('id', flat=True)[:SIZE]
+
+
+BUILDERS = {
+    FEATURED: featured,
+    BESTSELLERS: bestsellers,
+    TOP_RATED: top_rated,
+    NEW: new,
+}
+
+
+def cache_key():
+    return f"store:shelves:{fragments.version(VERSION)}"
+
+
+def load():
+    """Return {shelf name: [product id, ...]} with one cache lookup."""
+    key = cache_key()
+    shelves = cache.get(key)
+    if shelves is None:
+        with primary():
+            shelves = dict(Shelf.objects.values_list('name', 'product_ids'))
+        cache.set(key, shelves, CACHE_TIMEOUT)
+    return shelves
+
+
+def rebuild(names=None):
+    built = {}
+    for name in names or BUILDERS:
+        ids = list(BUILDERS[name]())
+        Shelf.objects.update_or_create(name=name, defaults={'product_ids': ids})
+        built[name] = ids
+    # Rebuilds usually run from cron, so the new shelves reach web processes through the version.
+    fragments.bump(VERSION)
+    load()
+    return built
+
+
+def product_changed(product, created=False, deleted=False):
+    # Sales and ratings move slowly and are left to the periodic rebuild; membership of
+    # the cheap shelves is kept exact here.
+    shelves = load()
+    if deleted:
+        stale = {name for name, ids in shelves.items() if product.id in ids}
+    else:
+        stale = {NEW} if created else set()
+        if product.is_featured != (product.id in shelves.get(FEATURED, ())):
+            stale.add(FEATURED)
+    if stale:
+        rebuild(stale)
+
+
+def products(names, limit=SIZE, extra=None):
+    """Return {name: [Product, ...]} for the given shelves, plus any extra {name: ids} rows, in a single query."""
+    shelves = load()
+    wanted = {name: shelves.get(name, [])[:limit] for name in names}
+    wanted.update((name, product_ids[:limit]) for name, product_ids in (extra or {}).items())
+    ids = {product_id for product_ids in wanted.values() for product_id in product_ids}
+    by_id = Product.objects.select_related('rating').in_bulk(ids) if ids else {}
+    # Rows deleted since the last rebuild are simply skipped.
+    return {
+        name: [by_id[product_id] for product_id in product_ids if product_id in by_id]
+        for name, product_ids in wanted.items()
+    }
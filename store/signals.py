@@ -0,0 +1,185 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import fragments, header, jobs, live, ownership, pricing, principal, ratings, search, shelves, thumbnails
+from .models import Discount, Product, Cart, CartItem, UserProfile, Transaction, WalletEntry, Review, StoreBanner, UserLibrary, Wishlist
+
+CENT = Decimal('0.01')
+
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.unindex_product(instance.id)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=StoreBanner)
+@receiver(post_delete, sender=StoreBanner)
+def expire_catalog_pages(sender, instance, **kwargs):
+    # Fragments are keyed on `updated` and expire by themselves; whole pages list many products.
+    fragments.bump(fragments.CATALOG)
+
+
+@receiver(post_save, sender=Product)
+def reshelve_product(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    shelves.product_changed(instance, created=created)
+
+
+@receiver(post_delete, sender=Product)
+def unshelve_product(sender, instance, **kwargs):
+    shelves.product_changed(instance, deleted=True)
+
+
+@receiver(post_save, sender=Product)
+def reprice_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    pricing.reprice(instance)
+
+
+@receiver(post_save, sender=Discount)
+@receiver(post_delete, sender=Discount)
+def rematerialize_prices(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # A storewide discount can touch every product, so the rewrite runs off the request.
+    jobs.enqueue('materialize_prices')
+
+
+def cart_user_id(item):
+    if CartItem.cart.is_cached(item):
+        return item.cart.user_id
+    return header.cart_owner_id(item.cart_id)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def refresh_header_for_cart(sender, instance, **kwargs):
+    user_id = cart_user_id(instance)
+    if user_id is not None:
+        header.invalidate(user_id)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=WalletEntry)
+def refresh_header_for_user(sender, instance, **kwargs):
+    header.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_principal_of_user(sender, instance, **kwargs):
+    # Covers password changes, which must reach the session hash check.
+    principal.invalidate(instance.id)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+@receiver(post_save, sender=UserLibrary)
+@receiver(post_delete, sender=UserLibrary)
+@receiver(post_save, sender=Wishlist)
+@receiver(post_delete, sender=Wishlist)
+@receiver(post_save, sender=WalletEntry)
+def forget_principal(sender, instance, **kwargs):
+    # Wallet balances change through UPDATE ... SET balance = balance + x, which sends no signal;
+    # every change writes a WalletEntry.
+    principal.invalidate(instance.user_id)
+
+
+@receiver(user_logged_out)
+def forget_principal_on_logout(sender, request, user, **kwargs):
+    if user is not None:
+        principal.invalidate(user.id)
+
+
+@receiver(post_save, sender=Review)
+def rate_product(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        ratings.record(instance)
+    else:
+        # Edits are rare (admin only), so rebuilding this product's aggregate is fine.
+        ratings.recompute(instance.product_id)
+
+
+@receiver(post_delete, sender=Review)
+def unrate_product(sender, instance, **kwargs):
+    ratings.retract(instance)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=StoreBanner)
+@receiver(post_save, sender=UserProfile)
+def build_image_variants(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    for (label, field_name), specs in thumbnails.FIELD_SPECS.items():
+        if label != sender._meta.label or (update_fields is not None and field_name not in update_fields):
+            continue
+        thumbnails.schedule(getattr(instance, field_name).name, specs)
+
+
+@receiver(m2m_changed, sender=UserLibrary.products.through)
+@receiver(m2m_changed, sender=Wishlist.products.through)
+def refresh_ownership(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            ownership.invalidate(instance.user_id)
+        return
+
+    # Changed from the Product side: instance is the product and pk_set holds library/wishlist ids.
+    owners = UserLibrary if sender is UserLibrary.products.through else Wishlist
+    if action in ('post_add', 'post_remove') and pk_set:
+        user_ids = owners.objects.filter(id__in=pk_set).values_list('user_id', flat=True)
+    elif action == 'pre_clear':
+        user_ids = owners.objects.filter(products=instance).values_list('user_id', flat=True)
+    else:
+        return
+    ownership.invalidate(*user_ids)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def push_cart_change(sender, instance, created=False, raw=False, **kwargs):
+    if raw or (kwargs['signal'] is post_save and not created):
+        return
+    user_id = cart_user_id(instance)
+    if user_id is not None:
+        live.publish(user_id, 'cart', product_id=instance.product_id, change=instance.quantity if created else -instance.quantity)
+
+
+@receiver(post_save, sender=WalletEntry)
+def push_balance(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        live.publish(instance.user_id, 'balance', balance=instance.balance_after, change=Decimal(instance.amount).quantize(CENT))
+
+
+@receiver(m2m_changed, sender=UserLibrary.products.through)
+@receiver(m2m_changed, sender=Wishlist.products.through)
+def push_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    # Edits from the Product side (admin only) reach open tabs when they reconnect.
+    if reverse or action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    event = 'library' if sender is UserLibrary.products.through else 'wishlist'
+    change = 'added' if action == 'post_add' else 'removed'
+    live.publish(instance.user_id, event, **{change: sorted(pk_set)})
@@ -0,0 +1,79 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.mail import send_mail
+from django.utils.dateparse import parse_datetime
+
+from . import analytics, pricing, thumbnails
+from .jobs import task
+from .models import Product
+
+
+def _recipient(user_id):
+    return User.objects.filter(id=user_id).exclude(email='').only('username', 'email').first()
+
+
+@task()
+def send_welcome_email(user_id):
+    user = _recipient(user_id)
+    if user:
+        send_mail(
+            "Welcome to PYCRIB",
+            f"Hi {user.username},\n\nYour account is ready. Top up your wallet and start building your library!",
+            None, [user.email],
+        )
+
+
+@task()
+def record_sales(sales):
+    """Add [product id, price, purchased at] sales to the rollups."""
+    products = Product.objects.only('id', 'category').in_bulk({product_id for product_id, price, when in sales})
+    # Sales of products deleted in the meantime went with their rollups.
+    analytics.record_sales(
+        (products[product_id], Decimal(price), parse_datetime(when))
+        for product_id, price, when in sales if product_id in products
+    )
+
+
+@task()
+def record_refund(product_id, price, purchased_at, refunded_at):
+    product = Product.objects.only('id', 'category').filter(id=product_id).first()
+    if product:
+        analytics.record_refund(product, Decimal(price), parse_datetime(purchased_at), parse_datetime(refunded_at))
+
+
+@task()
+def build_thumbnails(sources, specs):
+    # Variants already written are skipped, so a retry only redoes the images that failed.
+    for source in sources:
+        thumbnails.generate(source, specs)
+
+
+@task()
+def materialize_prices():
+    pricing.materialize()
+
+
+@task()
+def send_receipt(user_id, receipt):
+    user = _recipient(user_id)
+    if not user:
+        return
+    lines = "\n".join(f"  {line['quantity']} x {line['name']}  ₱{line['total']}" for line in receipt['lines'])
+    send_mail(
+        "Your PYCRIB receipt",
+        f"Thanks for your purchase, {user.username}!\n\n{lines}\n\n"
+        f"Total: ₱{receipt['total']}\nWallet balance: ₱{receipt['balance_after']}",
+        None, [user.email],
+    )
+
+
+@task()
+def send_refund_notice(user_id, name, amount):
+    user = _recipient(user_id)
+    if user:
+        send_mail(
+            "Your PYCRIB refund",
+            f"Hi {user.username},\n\n{name} has been refunded. ₱{amount} is back in your wallet.",
+            None, [user.email],
+        )
@@ -0,0 +1,11 @@
+import uuid
+
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag
+def idempotency_key():
+    """A fresh key per render: resubmitting the same form or link replays the first response."""
+    return uuid.uuid4().hex
@@ -0,0 +1,38 @@
+from django import template
+from django.utils.html import format_html
+
+from store import thumbnails
+
+register = template.Library()
+
+
+def _srcset(candidates):
+    return ', '.join(f"{url} {width}w" for width, url in candidates)
+
+
+@register.simple_tag
+def responsive_image(field, spec, alt='', css_class='', sizes=''):
+    if not field:
+        return ''
+
+    variants = thumbnails.variants_for(field.name).get(spec, {})
+    jpeg = variants.get('jpeg', [])
+    if not jpeg:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="lazy">', field.url, alt, css_class)
+
+    sizes = sizes or f"{thumbnails.SPECS[spec][0]}px"
+    webp = variants.get('webp', [])
+    return format_html(
+        '<picture style="display: contents;">{}<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="lazy" decoding="async"></picture>',
+        format_html('<source type="image/webp" srcset="{}" sizes="{}">', _srcset(webp), sizes) if webp else '',
+        jpeg[0][1],
+        _srcset(jpeg),
+        sizes,
+        alt,
+        css_class,
+    )
+
+
+@register.simple_tag
+def image_variant_url(field, spec, width):
+    return thumbnails.variant_url(field, spec, int(width))
@@ -0,0 +1,16 @@
+from django import template
+from django.utils.html import format_html
+
+register = template.Library()
+
+
+@register.simple_tag
+def price(product):
+    """The price to pay; with a sale running (see pricing.apply), the list price struck through beside it."""
+    sale = getattr(product, 'sale', None)
+    if not sale:
+        return format_html('₱{}', product.price)
+    return format_html(
+        '<s style="opacity: 0.5; font-weight: 400;">₱{}</s> ₱{} <span class="sale-badge" style="font-size: 0.6em; color: #7CFFB2;">-{}%</span>',
+        product.price, sale.price, sale.percent_off,
+    )
@@ -1,3 +1,1891 @@
-from django.test import TestCase
+import asyncio
+import csv
+from datetime import timedelta
+from decimal import Decimal
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from importlib.util import find_spec
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from PIL import Image
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.utils import load_backend
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import admin, analytics, checkout, fragments, jobs, header, live, middleware, ownership, pagination, pricing, principal, ratings, recommendations, routers, search, shelves, throttle, wallet
+from .management.commands import loadtest, sync_replicas
+from .management.commands._seed import seed_store
+from .models import Product, SearchToken, Cart, CartItem, UserProfile, UserLibrary, Transaction, Wishlist, WalletEntry, Review, ProductRating, ImageVariant, StoreBanner, Shelf, ProductNeighbors, UserPicks, SalesRollup, Job, Discount, EffectivePrice, LiveEvent
+
+
+def make_product(name, category='RPG', price='9.99', description='', **kwargs):
+    return Product.objects.create(
+        name=name, category=category, price=Decimal(price), description=description, **kwargs
+    )
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.souls = make_product('Dark Souls', 'RPG', description='Prepare to die in a dark world.')
+        self.doom = make_product('Doom Eternal', 'FPS', description='Rip and tear demons.')
+        self.farm = make_product('Stardew Valley', 'SIM', description='Farm life with dark caves.')
+
+    def result_ids(self, query):
+        return [product_id for product_id, score in search.search(query)]
+
+    def test_index_is_updated_on_save_and_delete(self):
+        self.assertTrue(SearchToken.objects.filter(product=self.doom, term='doom').exists())
+
+        self.doom.name = 'Quake Champions'
+        self.doom.save()
+        self.assertEqual(self.result_ids('doom'), [])
+        self.assertEqual(self.result_ids('quake'), [self.doom.id])
+
+        self.doom.delete()
+        self.assertEqual(self.result_ids('quake'), [])
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.result_ids('dark'), [self.souls.id, self.farm.id])
+
+    def test_prefix_category_and_multi_word_queries(self):
+        self.assertEqual(self.result_ids('star'), [self.farm.id])
+        self.assertEqual(self.result_ids('shooter'), [self.doom.id])
+        self.assertEqual(self.result_ids('role playing'), [self.souls.id])
+        self.assertEqual(self.result_ids('dark souls'), [self.souls.id])
+
+    def test_trigram_fallback_tolerates_typos(self):
+        self.assertEqual(self.result_ids('eternel'), [self.doom.id])
+        self.assertEqual(self.result_ids('zzzzzz'), [])
+
+    def test_rebuild_command_recreates_index(self):
+        SearchToken.objects.all().delete()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.result_ids('valley'), [self.farm.id])
+
+    def test_migration_indexes_an_existing_catalog(self):
+        expected = sorted(SearchToken.objects.values_list('kind', 'term', 'product_id', 'weight'))
+        SearchToken.objects.all().delete()
+        migration = import_module('store.migrations.0013_searchtoken')
+        migration.build_search_index(django_apps, SimpleNamespace(connection=connection))
+        self.assertEqual(sorted(SearchToken.objects.values_list('kind', 'term', 'product_id', 'weight')), expected)
+
+    def test_product_list_uses_index_ranking(self):
+        response = self.client.get('/home/', {'q': 'dark'})
+        self.assertEqual(list(response.context['products']), [self.souls, self.farm])
+
+
+class CatalogPaginationTests(TestCase):
+    def seed(self, count, start=0):
+        Product.objects.bulk_create(
+            Product(name=f'Game {i}', category='Indie', price=Decimal('1.00'), description='x' * 200)
+            for i in range(start, start + count)
+        )
+
+    def test_keyset_pages_cover_catalog_without_overlap(self):
+        self.seed(pagination.PAGE_SIZE * 2 + 5)
+        seen = []
+        cursor = None
+        while True:
+            response = self.client.get('/home/page/', {'cursor': cursor} if cursor else {})
+            data = response.json()
+            seen.append(data['count'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, [pagination.PAGE_SIZE, pagination.PAGE_SIZE, 5])
+
+    def test_search_results_are_paginated_by_rank(self):
+        self.seed(pagination.PAGE_SIZE + 3)
+        search.rebuild_index()
+        first = self.client.get('/home/', {'q': 'game'})
+        self.assertEqual(len(first.context['products']), pagination.PAGE_SIZE)
+
+        rest = self.client.get('/home/page/', {'q': 'game', 'cursor': first.context['next_cursor']}).json()
+        self.assertEqual(rest['count'], 3)
+        self.assertIsNone(rest['next_cursor'])
+
+    def test_invalid_cursor_starts_from_the_beginning(self):
+        self.seed(3)
+        response = self.client.get('/home/page/', {'cursor': '!!not-a-cursor'})
+        self.assertEqual(response.json()['count'], 3)
+
+    def test_tampered_cursor_values_start_from_the_beginning(self):
+        self.seed(3)
+        user = User.objects.create_user('critic')
+        product = Product.objects.first()
+        Review.objects.create(user=user, product=product, rating=4, comment='Fine')
+        for values in ([{}, 1], [[1]], ['not-a-date', 1], [2 ** 70]):
+            cursor = pagination.encode_cursor(values)
+            self.assertEqual(self.client.get('/home/page/', {'cursor': cursor}).json()['count'], 3)
+            response = self.client.get(f'/product/{product.id}/reviews/', {'cursor': cursor})
+            self.assertEqual(response.json()['count'], 1)
+
+    def render_page(self):
+        # Measure a cold render, not the anonymous page cache.
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/home/')
+        return response, len(queries)
+
+    def test_page_cost_stays_flat_as_catalog_grows(self):
+        self.seed(100)
+        self.render_page()
+        small_response, small_queries = self.render_page()
+
+        self.seed(5000, start=100)
+        large_response, large_queries = self.render_page()
+
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(len(small_response.context['products']), len(large_response.context['products']))
+        self.assertLess(abs(len(large_response.content) - len(small_response.content)), 2000)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class StoreTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttle.buckets.clear()
+        self.user = User.objects.create_user('gamer', password='secret-pass-123')
+        self.profile = UserProfile.objects.create(user=self.user, balance=Decimal('1000.00'))
+        self.game = make_product('Hollow Knight', 'Indie', '15.00')
+        self.client.force_login(self.user)
+
+
+class HeaderSnapshotTests(StoreTestCase):
+    def test_snapshot_is_cached_and_invalidated_by_writes(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.game, quantity=2)
+        self.assertEqual(header.get_snapshot(self.user)['cart_count'], 2)
+
+        with self.assertNumQueries(0):
+            header.get_snapshot(self.user)
+
+        self.profile.balance = Decimal('5.00')
+        self.profile.save()
+        self.assertEqual(header.get_snapshot(self.user)['balance'], Decimal('5.00'))
+
+        Transaction.objects.create(user=self.user, product=self.game, price=self.game.price)
+        self.assertIsNone(cache.get(header.header_cache_key(self.user.id)))
+
+        cart.cartitem_set.all().delete()
+        self.assertEqual(header.get_snapshot(self.user)['cart_count'], 0)
+
+    def test_nav_bar_renders_snapshot(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.game, quantity=3)
+        response = self.client.get('/home/')
+        self.assertContains(response, 'Cart (<span data-live="cart-count">3</span>)')
+        self.assertContains(response, '₱<span data-live="balance">1000.00</span>')
+
+
+class ViewQueryCountTests(StoreTestCase):
+    # Sessions and the user come from the cache, so a warm authenticated request starts at zero queries.
+    def setUp(self):
+        super().setUp()
+        self.cart = Cart.objects.create(user=self.user)
+        self.item = CartItem.objects.create(cart=self.cart, product=self.game)
+        self.library = UserLibrary.objects.create(user=self.user)
+        self.wishlist = Wishlist.objects.create(user=self.user)
+        self.owned = make_product('Celeste', 'Indie', '10.00')
+        self.library.products.add(self.owned)
+        self.wishlist.products.add(self.game)
+        self.purchase = Transaction.objects.create(user=self.user, product=self.owned, price=self.owned.price)
+        header.get_snapshot(self.user)
+        principal.load(self.user.id)
+        ownership.for_user(self.user)
+        recommendations.pick_ids(self.user)
+        recommendations.neighbor_ids(self.game.id)
+        pricing.sales([self.game.id, self.owned.id])
+        fragments.version(fragments.CATALOG)
+        fragments.version(fragments.IMAGES)
+
+    def assertQueries(self, count, path, method='get', data=None):
+        with self.assertNumQueries(count):
+            response = getattr(self.client, method)(path, data or {})
+        self.assertLess(response.status_code, 400)
+        return response
+
+    def test_anonymous_pages(self):
+        self.client.logout()
+        with self.assertNumQueries(0):
+            self.client.get('/')
+        with self.assertNumQueries(0):
+            self.client.get('/register/')
+        with self.assertNumQueries(3):
+            self.client.get('/home/')
+
+    def test_catalog_views(self):
+        self.assertQueries(3, '/home/')
+        self.assertQueries(3, '/home/', data={'q': 'hollow'})
+        self.assertQueries(1, '/home/page/')
+        self.assertQueries(2, f'/product/{self.game.id}/')
+
+    def test_account_views(self):
+        self.assertQueries(0, '/')
+        self.assertQueries(0, '/wallet/topup/')
+        self.assertQueries(1, '/profile/')
+        self.assertQueries(1, '/repository/')
+        self.assertQueries(1, '/wishlist/')
+        self.assertQueries(1, '/cart/')
+
+    def test_write_views(self):
+        self.assertQueries(5, '/wallet/topup/', method='post', data={'amount': '200'})
+        # The top-up moved the balance, so this request reloads the principal.
+        self.assertQueries(5, f'/wishlist/add/{self.owned.id}/')
+        self.assertQueries(3, f'/wishlist/remove/{self.game.id}/')
+        self.assertQueries(3, f'/add-to-cart/{self.owned.id}/')
+        self.assertQueries(2, f'/add-to-cart/{self.game.id}/')
+        self.assertQueries(3, f'/cart/remove/{self.item.id}/')
+
+    def test_checkout_refund_and_logout(self):
+        # Checkout reads sale prices from the table, never the cache.
+        self.assertQueries(19, '/checkout/')
+        self.assertQueries(15, f'/refund/{self.purchase.id}')
+        self.assertQueries(3, '/logout/')
+
+
+class CheckoutTests(StoreTestCase):
+    def fill_cart(self, count):
+        cart, created = Cart.objects.get_or_create(user=self.user)
+        products = [make_product(f'Bundle Game {i}', price='2.00') for i in range(count)]
+        CartItem.objects.bulk_create(CartItem(cart=cart, product=product) for product in products)
+        return products
+
+    def test_checkout_writes_transactions_library_and_receipt(self):
+        products = self.fill_cart(3)
+        receipt = checkout.checkout(self.user)
+
+        self.assertEqual(receipt.total, Decimal('6.00'))
+        self.assertEqual(receipt.balance_after, Decimal('994.00'))
+        self.assertEqual([line.product_id for line in receipt.lines], [p.id for p in products])
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(set(UserLibrary.objects.get(user=self.user).products.all()), set(products))
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.balance, Decimal('994.00'))
+
+    def test_games_already_owned_are_not_charged_again(self):
+        products = self.fill_cart(2)
+        UserLibrary.objects.create(user=self.user).products.add(products[1])
+
+        with self.assertRaisesMessage(checkout.AlreadyOwned, 'Bundle Game 1'):
+            checkout.checkout(self.user)
+        self.assertFalse(Transaction.objects.exists())
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.balance, Decimal('1000.00'))
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 2)
+
+    def test_insufficient_funds_leaves_everything_untouched(self):
+        self.fill_cart(2)
+        self.profile.balance = Decimal('3.00')
+        self.profile.save()
+
+        with self.assertRaises(checkout.InsufficientFunds) as raised:
+            checkout.checkout(self.user)
+        self.assertEqual(raised.exception.needed, Decimal('1.00'))
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 2)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_empty_cart(self):
+        with self.assertRaises(checkout.EmptyCart):
+            checkout.checkout(self.user)
+        response = self.client.get('/checkout/')
+        self.assertRedirects(response, '/home/')
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        self.fill_cart(1)
+        checkout.checkout(self.user)
+
+        self.fill_cart(1)
+        with CaptureQueriesContext(connection) as small:
+            checkout.checkout(self.user)
+
+        self.fill_cart(50)
+        with CaptureQueriesContext(connection) as large:
+            checkout.checkout(self.user)
+        self.assertEqual(len(small), len(large))
+
+    def test_json_receipt(self):
+        self.fill_cart(2)
+        response = self.client.get('/checkout/', HTTP_ACCEPT='application/json')
+        data = response.json()
+        self.assertEqual(data['total'], '4.00')
+        self.assertEqual(len(data['lines']), 2)
+
+
+class WalletLedgerTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        UserProfile.objects.filter(id=self.profile.id).update(balance=0)
+
+    def test_every_balance_change_is_recorded(self):
+        wallet.credit(self.user, 200, WalletEntry.TOP_UP)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.game)
+        checkout.checkout(self.user)
+        purchase = Transaction.objects.get(user=self.user)
+
+        self.client.get(f'/refund/{purchase.id}')
+
+        entries = list(WalletEntry.objects.filter(user=self.user).order_by('id').values_list('kind', 'amount', 'balance_after'))
+        self.assertEqual(entries, [
+            (WalletEntry.TOP_UP, Decimal('200.00'), Decimal('200.00')),
+            (WalletEntry.PURCHASE, Decimal('-15.00'), Decimal('185.00')),
+            (WalletEntry.REFUND, Decimal('15.00'), Decimal('200.00')),
+        ])
+        call_command('reconcile_wallets', stdout=StringIO())
+
+    def test_debit_never_overdraws(self):
+        wallet.credit(self.user, 10, WalletEntry.TOP_UP)
+        with self.assertRaises(wallet.InsufficientFunds):
+            wallet.debit(self.user, 11, WalletEntry.PURCHASE)
+        self.assertEqual(WalletEntry.objects.filter(user=self.user).count(), 1)
+
+    def test_refund_twice_only_pays_once(self):
+        purchase = Transaction.objects.create(user=self.user, product=self.game, price=self.game.price)
+        self.client.get(f'/refund/{purchase.id}')
+        response = self.client.get(f'/refund/{purchase.id}')
+        self.assertEqual(response.status_code, 404)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.balance, Decimal('15.00'))
+
+    def test_invalid_top_up_is_rejected(self):
+        self.client.post('/wallet/topup/', {'amount': '-500'})
+        self.client.post('/wallet/topup/', {'amount': 'lots'})
+        self.assertFalse(WalletEntry.objects.exists())
+
+    def test_reconcile_reports_drift(self):
+        wallet.credit(self.user, 50, WalletEntry.TOP_UP)
+        UserProfile.objects.filter(user=self.user).update(balance=Decimal('75.00'))
+        with self.assertRaises(CommandError):
+            call_command('reconcile_wallets', stdout=StringIO(), stderr=StringIO())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+# One user firing hundreds of writes at once is exactly what the rate limits stop.
+@override_settings(STORE_RATE_LIMIT_ENABLED=False)
+class WalletConcurrencyTests(TransactionTestCase):
+    TOP_UPS = 200
+    PURCHASES = 100
+
+    def test_concurrent_top_ups_and_purchases_lose_no_money(self):
+        user = User.objects.create_user('stress', password='secret-pass-123')
+        UserProfile.objects.create(user=user)
+        products = [make_product(f'Stress Game {i}', price='7.00') for i in range(self.PURCHASES)]
+        cart = Cart.objects.create(user=user)
+
+        def top_up(_):
+            client = Client()
+            client.force_login(user)
+            try:
+                client.post('/wallet/topup/', {'amount': '10'})
+            finally:
+                connections.close_all()
+
+        def buy(product):
+            client = Client()
+            client.force_login(user)
+            try:
+                CartItem.objects.get_or_create(cart=cart, product=product)
+                client.get('/checkout/')
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = [pool.submit(top_up, i) for i in range(self.TOP_UPS)]
+            futures += [pool.submit(buy, product) for product in products]
+            for future in futures:
+                future.result()
+
+        spent = sum(Transaction.objects.filter(user=user).values_list('price', flat=True))
+        balance = UserProfile.objects.get(user=user).balance
+        self.assertEqual(balance, Decimal('10.00') * self.TOP_UPS - spent)
+        self.assertEqual(WalletEntry.objects.filter(user=user, kind=WalletEntry.TOP_UP).count(), self.TOP_UPS)
+        call_command('reconcile_wallets', stdout=StringIO())
+
+
+class ReviewAggregateTests(StoreTestCase):
+    def review(self, stars, username=None):
+        user = User.objects.create_user(username or f'reviewer{Review.objects.count()}')
+        return Review.objects.create(product=self.game, user=user, rating=stars, comment='Great')
+
+    def test_aggregates_follow_creates_edits_and_deletes(self):
+        self.review(5)
+        self.review(4)
+        middling = self.review(3)
+
+        rating = ProductRating.objects.get(product=self.game)
+        self.assertEqual((rating.count, rating.total, rating.average), (3, 12, 4.0))
+        self.assertEqual(rating.histogram, [(5, 1), (4, 1), (3, 1), (2, 0), (1, 0)])
+
+        middling.rating = 1
+        middling.save()
+        middling.delete()
+        rating.refresh_from_db()
+        self.assertEqual((rating.count, rating.total, rating.stars_1, rating.stars_3), (2, 9, 0, 0))
+
+    def test_tally_matches_the_incremental_aggregates(self):
+        for stars in (5, 5, 2):
+            self.review(stars)
+        other = make_product('Celeste')
+        Review.objects.create(product=other, user=self.user, rating=4, comment='')
+        live = {rating.product_id: rating for rating in ProductRating.objects.all()}
+
+        with self.assertNumQueries(1):
+            tallied = ratings.tally(Review.objects.all())
+        fields = ['count', 'total', 'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5']
+        self.assertEqual(
+            {product_id: [getattr(rating, field) for field in fields] for product_id, rating in tallied.items()},
+            {product_id: [getattr(rating, field) for field in fields] for product_id, rating in live.items()},
+        )
+        self.assertEqual(ratings.recompute(self.game.id).total, 12)
+
+    def test_deleting_a_reviewed_product_cascades_cleanly(self):
+        self.review(5)
+        self.game.delete()
+        self.assertFalse(ProductRating.objects.exists())
+
+    def test_posted_rating_is_clamped(self):
+        self.assertEqual(ratings.clamp_stars('9'), 5)
+        self.assertEqual(ratings.clamp_stars('-2'), 1)
+        self.assertEqual(ratings.clamp_stars('abc'), 5)
+
+    def test_review_feed_is_paginated_with_constant_queries(self):
+        for i in range(25):
+            self.review(5)
+        with CaptureQueriesContext(connection) as first_page:
+            response = self.client.get(f'/product/{self.game.id}/')
+        self.assertEqual(len(response.context['reviews']), 10)
+
+        fetched = len(response.context['reviews'])
+        cursor = response.context['next_reviews_cursor']
+        while cursor:
+            data = self.client.get(f'/product/{self.game.id}/reviews/', {'reviews': cursor}).json()
+            cursor = data['next_cursor']
+            fetched += data['count']
+        self.assertEqual(fetched, 25)
+
+        for i in range(25):
+            self.review(4)
+        with CaptureQueriesContext(connection) as busier_page:
+            self.client.get(f'/product/{self.game.id}/')
+        self.assertEqual(len(first_page), len(busier_page))
+
+    def test_review_pages_do_not_overlap(self):
+        for i in range(23):
+            self.review(5)
+        ids = []
+        cursor = None
+        while True:
+            page, cursor = pagination.keyset_page(Review.objects.all(), cursor, size=10, order_by=('-created_at', '-id'))
+            ids.extend(review.id for review in page)
+            if not cursor:
+                break
+        self.assertEqual(sorted(ids), sorted(Review.objects.values_list('id', flat=True)))
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_catalog_grid_shows_averages_without_reading_reviews(self):
+        self.review(4)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/home/')
+        self.assertContains(response, '★ 4.0 (1)')
+        self.assertFalse(any('store_review' in query['sql'] for query in queries))
+
+
+def png_upload(name='cover.png', size=(1200, 800)):
+    buffer = BytesIO()
+    Image.new('RGB', size, (120, 40, 200)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        overrides = self.settings(MEDIA_ROOT=self.media_root, STORE_THUMBNAILS_EAGER=True)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_upload_generates_hashed_variants_without_upscaling(self):
+        product = make_product('Cover Test', image=png_upload())
+
+        variants = ImageVariant.objects.filter(source=product.image.name)
+        self.assertEqual(
+            sorted(set(variants.filter(spec='card').values_list('format', 'width'))),
+            [('jpeg', 272), ('jpeg', 544), ('webp', 272), ('webp', 544)],
+        )
+        self.assertEqual(set(variants.filter(spec='hero').values_list('width', flat=True)), {1100, 1200})
+        for variant in variants:
+            self.assertRegex(variant.name, r'^game_covers/variants/cover(_\w+)?-\d+w\.[0-9a-f]{12}\.(webp|jpeg)$')
+            with Image.open(f'{self.media_root}/{variant.name}') as image:
+                self.assertEqual(image.width, variant.width)
+
+    def test_template_tag_renders_srcset_and_falls_back_to_original(self):
+        product = make_product('Cover Test', image=png_upload())
+        template = Template("{% load store_images %}{% responsive_image product.image 'card' alt=product.name %}")
+
+        html = template.render(Context({'product': product}))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('272w', html)
+        self.assertNotIn(product.image.url + '"', html)
+
+        ImageVariant.objects.all().delete()
+        cache.clear()
+        html = template.render(Context({'product': product}))
+        self.assertIn(f'src="{product.image.url}"', html)
+
+    def test_uploads_are_deferred_to_the_worker_pool(self):
+        with self.settings(STORE_THUMBNAILS_EAGER=False):
+            with self.captureOnCommitCallbacks() as callbacks:
+                make_product('Deferred', image=png_upload())
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(ImageVariant.objects.exists())
+
+    def test_backfill_command(self):
+        product = make_product('Backfill', image=png_upload(size=(300, 200)))
+        ImageVariant.objects.all().delete()
+
+        call_command('build_thumbnails', workers=1, stdout=StringIO())
+        self.assertEqual(
+            set(ImageVariant.objects.filter(source=product.image.name, spec='card').values_list('width', flat=True)),
+            {272, 300},
+        )
+
+
+class OwnershipIndexTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.library = UserLibrary.objects.create(user=self.user)
+        self.wishlist = Wishlist.objects.create(user=self.user)
+        self.other = make_product('Celeste', 'Indie', '10.00')
+
+    def test_bitset_round_trip(self):
+        ids = [1, 63, 64, 1_000_003]
+        bits = ownership.to_bitset(ids)
+        self.assertEqual(ownership.unpack(ownership.pack(bits)), bits)
+        membership = ownership.Membership(bits)
+        self.assertEqual([pid for pid in range(1_000_010) if membership.owns(pid)], ids)
+
+    def test_membership_is_cached_and_synced_by_m2m_signals(self):
+        self.library.products.add(self.game)
+        membership = ownership.for_user(self.user)
+        self.assertTrue(membership.owns(self.game.id))
+        self.assertFalse(membership.owns(self.other.id))
+
+        with self.assertNumQueries(0):
+            ownership.for_user(self.user)
+
+        self.wishlist.products.add(self.other)
+        self.assertTrue(ownership.for_user(self.user).wishes(self.other.id))
+
+        self.game.userlibrary_set.remove(self.library)
+        self.assertFalse(ownership.for_user(self.user).owns(self.game.id))
+
+        self.library.products.add(self.other)
+        self.other.userlibrary_set.clear()
+        self.assertFalse(ownership.for_user(self.user).owns(self.other.id))
+
+    def test_checkout_updates_membership(self):
+        ownership.for_user(self.user)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.game)
+        checkout.checkout(self.user)
+        self.assertTrue(ownership.for_user(self.user).owns(self.game.id))
+
+    def test_grid_marks_owned_and_wishlisted_cards(self):
+        self.library.products.add(self.game)
+        self.wishlist.products.add(self.other)
+        response = self.client.get('/home/')
+        cards = {product.id: product for product in response.context['products']}
+        self.assertTrue(cards[self.game.id].is_owned)
+        self.assertTrue(cards[self.other.id].is_wishlisted)
+        self.assertContains(response, 'In Your Repository')
+
+    def test_add_to_cart_refuses_owned_games(self):
+        self.library.products.add(self.game)
+        self.client.get(f'/add-to-cart/{self.game.id}/')
+        self.assertFalse(CartItem.objects.exists())
+
+
+class CatalogImportExportTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        overrides = self.settings(MEDIA_ROOT=self.directory, STORE_THUMBNAILS_EAGER=True)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def write(self, name, content):
+        path = f'{self.directory}/{name}'
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(content)
+        return path
+
+    def test_csv_import_validates_rows_and_indexes_search(self):
+        path = self.write('catalog.csv', (
+            'name,description,price,category,is_featured\n'
+            'Stardew Valley,farming,14.99,Simulation,yes\n'
+            'Doom Eternal,,19.99,FPS,0\n'
+            'Bad Category,,5.00,Racing,0\n'
+            'Bad Price,,free,RPG,0\n'
+        ))
+        errors = StringIO()
+        call_command('import_catalog', path, batch_size=1, stdout=StringIO(), stderr=errors)
+
+        self.assertEqual(sorted(Product.objects.values_list('name', 'category')), [
+            ('Doom Eternal', 'FPS'), ('Stardew Valley', 'SIM'),
+        ])
+        self.assertTrue(Product.objects.get(name='Stardew Valley').is_featured)
+        self.assertIn('Row 3', errors.getvalue())
+        self.assertIn('Row 4', errors.getvalue())
+        self.assertEqual(search.search('stardew')[0][0], Product.objects.get(name='Stardew Valley').id)
+
+    def test_unreadable_rows_are_skipped_and_reported(self):
+        images = tempfile.mkdtemp(dir=self.directory)
+        path = self.write('catalog.jsonl', '\n'.join([
+            '{"name": "Broken", "price": 1',
+            '["not", "an", "object"]',
+            '{"name": "Escape", "price": 1, "category": "RPG", "image": "../../etc/passwd"}',
+            '{"name": "Sneaky", "price": 1, "category": "RPG", "image": "sub/../../outside.png"}',
+            '{"name": "Odd Id", "price": 1, "category": "RPG", "id": [1]}',
+            '{"name": "Fine", "price": 1, "category": "RPG"}',
+        ]))
+        errors, out = StringIO(), StringIO()
+        call_command('import_catalog', path, images_dir=images, stdout=out, stderr=errors)
+
+        self.assertEqual(list(Product.objects.values_list('name', flat=True)), ['Fine'])
+        self.assertIn('1 created, 0 updated, 5 skipped', out.getvalue())
+        for line_number in range(1, 6):
+            self.assertIn(f'Row {line_number} skipped', errors.getvalue())
+
+    def test_strict_import_aborts_on_invalid_row(self):
+        path = self.write('catalog.csv', 'name,price,category\n,1.00,RPG\n')
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', path, strict=True, stdout=StringIO())
+
+    def test_jsonl_import_updates_by_id_and_copies_images(self):
+        product = make_product('Old Name', price='5.00')
+        images = tempfile.mkdtemp(dir=self.directory)
+        Image.new('RGB', (400, 300)).save(f'{images}/cover.png')
+        path = self.write('catalog.jsonl', '\n'.join([
+            f'{{"id": {product.id}, "name": "New Name", "price": "7.50", "category": "RPG", "image": "cover.png"}}',
+            '{"name": "Fresh", "price": 3, "category": "Indie"}',
+        ]))
+
+        call_command('import_catalog', path, images_dir=images, stdout=StringIO())
+
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.price), ('New Name', Decimal('7.50')))
+        self.assertEqual(product.image.name, 'game_covers/cover.png')
+        self.assertTrue(ImageVariant.objects.filter(source='game_covers/cover.png', spec='card').exists())
+        self.assertEqual(Product.objects.get(name='Fresh').category, 'Indie')
+        self.assertEqual(search.search('new name')[0][0], product.id)
+        self.assertEqual(search.search('old'), [])
+
+    def test_products_created_after_an_import_with_ids_get_fresh_ids(self):
+        path = self.write('catalog.jsonl', '{"id": 500, "name": "Imported", "price": 1, "category": "RPG"}')
+        call_command('import_catalog', path, stdout=StringIO())
+        self.assertGreater(make_product('Created Later').id, 500)
+
+    def test_update_leaves_columns_missing_from_the_input_alone(self):
+        cover = BytesIO()
+        Image.new('RGB', (400, 300)).save(cover, 'PNG')
+        cover_name = default_storage.save('game_covers/old.png', ContentFile(cover.getvalue()))
+        product = make_product('Old Name', price='5.00', description='Keep me', is_featured=True, image=cover_name)
+        path = self.write('catalog.jsonl', f'{{"id": {product.id}, "name": "New Name", "price": "7.50", "category": "RPG"}}')
+        call_command('import_catalog', path, stdout=StringIO())
+
+        product.refresh_from_db()
+        self.assertEqual((product.name, product.description, product.is_featured, product.image.name),
+                         ('New Name', 'Keep me', True, cover_name))
+        self.assertEqual(search.search('keep')[0][0], product.id)
+
+    @override_settings(STORE_THUMBNAILS_EAGER=False)
+    def test_thumbnails_are_queued_once_per_batch(self):
+        images = tempfile.mkdtemp(dir=self.directory)
+        for name in ('a.png', 'b.png', 'c.png'):
+            Image.new('RGB', (400, 300)).save(f'{images}/{name}')
+        path = self.write('catalog.jsonl', '\n'.join(
+            f'{{"name": "Game {name}", "price": 1, "category": "RPG", "image": "{name}"}}' for name in ('a.png', 'b.png', 'c.png')
+        ))
+        call_command('import_catalog', path, images_dir=images, batch_size=2, stdout=StringIO())
+
+        self.assertEqual([len(job.payload['sources']) for job in Job.objects.filter(task='build_thumbnails').order_by('id')], [2, 1])
+        self.assertFalse(ImageVariant.objects.exists())
+        jobs.work()
+        self.assertEqual(ImageVariant.objects.filter(spec='card').values('source').distinct().count(), 3)
+
+    def test_export_round_trip(self):
+        make_product('Celeste', category='Indie', price='19.99', description='Climb, "mountain"')
+        make_product('Hades', price='24.99')
+        for extension in ('csv', 'jsonl'):
+            path = f'{self.directory}/export.{extension}'
+            call_command('export_catalog', path, stdout=StringIO())
+            Product.objects.all().delete()
+            call_command('import_catalog', path, stdout=StringIO())
+            self.assertEqual(sorted(Product.objects.values_list('name', 'category', 'price', 'description')), [
+                ('Celeste', 'Indie', Decimal('19.99'), 'Climb, "mountain"'),
+                ('Hades', 'RPG', Decimal('24.99'), ''),
+            ])
+
+
+@override_settings(STORE_PROFILING_SAMPLE_RATE=1)
+class ProfilingMiddlewareTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        middleware.recorder.reset()
+        self.addCleanup(middleware.recorder.reset)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        overrides = self.settings(STORE_PROFILING_DIR=directory)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_records_queries_templates_and_size_per_view(self):
+        self.client.get('/home/')
+        self.client.get(f'/product/{self.game.id}/')
+        self.client.get(f'/product/{self.game.id}/')
+
+        report = middleware.recorder.summary()
+        self.assertEqual(report['store:product_detail']['samples'], 2)
+        stats = report['store:product-list']
+        self.assertGreater(stats['queries']['max'], 0)
+        self.assertGreater(stats['template_ms']['p50'], 0)
+        self.assertGreater(stats['response_bytes']['p50'], 1000)
+
+    async def test_records_async_requests(self):
+        await self.async_client.aforce_login(self.user)
+        await self.async_client.get('/home/')
+
+        stats = middleware.recorder.summary()['store:product-list']
+        self.assertGreater(stats['queries']['max'], 0)
+        self.assertGreater(stats['template_ms']['p50'], 0)
+
+    def test_counts_repeated_statements(self):
+        def view(request):
+            for product_id in (1, 2, 3):
+                Product.objects.filter(id=product_id).first()
+            return HttpResponse('ok')
+
+        profiler = middleware.ProfilingMiddleware(view)
+        profiler(RequestFactory().get('/anything/'))
+
+        stats = middleware.recorder.summary()['<unresolved>']
+        self.assertEqual(stats['queries']['max'], 3)
+        self.assertEqual(stats['duplicate_queries']['max'], 2)
+        self.assertEqual(stats['top_duplicates'][0]['count'], 3)
+        self.assertEqual(stats['response_bytes']['max'], 2)
+
+    def test_unsampled_requests_are_not_recorded(self):
+        with self.settings(STORE_PROFILING_SAMPLE_RATE=0):
+            self.client.get('/home/')
+        self.assertEqual(middleware.recorder.summary(), {})
+
+    def test_staff_endpoint(self):
+        self.client.get('/home/')
+        self.assertEqual(self.client.get('/perf/').status_code, 302)
+
+        self.user.is_staff = True
+        self.user.save()
+        report = self.client.get('/perf/').json()
+        self.assertIn('store:product-list', report)
+
+    def test_perf_report_command(self):
+        out = StringIO()
+        call_command('perf_report', '/home/', repeat=2, user='gamer', host='testserver', stdout=out)
+        self.assertIn('store:product-list', out.getvalue())
+
+        middleware.recorder.flush(force=True)
+        out = StringIO()
+        call_command('perf_report', json=True, stdout=out)
+        self.assertIn('store:product-list', out.getvalue())
+
+    def test_summaries_published_by_other_processes_are_collected(self):
+        directory = middleware.summary_dir()
+        (directory / 'web-1-101.json').write_text(json.dumps({'store:cart_detail': {'samples': 3}}))
+        stale = directory / 'web-1-99.json'
+        stale.write_text(json.dumps({'store:cart_detail': {'samples': 1}}))
+        long_ago = time.time() - middleware.SUMMARY_TIMEOUT - 60
+        os.utime(stale, (long_ago, long_ago))
+
+        self.assertEqual(middleware.collected_summaries(), {'web-1-101': {'store:cart_detail': {'samples': 3}}})
+
+
+class LoadTestHarnessTests(TestCase):
+    def test_every_route_has_a_scenario(self):
+        self.assertEqual(loadtest.uncovered_routes(), set())
+
+    def test_seeded_store_is_consistent(self):
+        seed_store(users=5, products=40, library_size=4, wishlist_size=2, cart_size=2, review_rate=0.5)
+
+        self.assertEqual(Transaction.objects.count(), 20)
+        self.assertEqual(UserLibrary.products.through.objects.count(), 20)
+        self.assertEqual(CartItem.objects.count(), 10)
+        self.assertEqual(
+            sum(ProductRating.objects.values_list('count', flat=True)), Review.objects.count()
+        )
+        self.assertTrue(SearchToken.objects.exists())
+        call_command('reconcile_wallets', stdout=StringIO())
+
+    def test_baseline_comparison(self):
+        baseline = {'cart': {'p50': 20.0, 'queries_p50': 4}, 'home': {'p50': 1.0, 'queries_p50': 3}}
+        results = {
+            'cart': {'p50': 35.0, 'queries_p50': 5},
+            'home': {'p50': 4.0, 'queries_p50': 3},
+            'new': {'p50': 99.0, 'queries_p50': 50},
+        }
+        self.assertEqual(loadtest.compare(results, baseline, tolerance=0.5), [
+            'cart: median queries 4 -> 5', 'cart: p50 20.0ms -> 35.0ms',
+        ])
+
+
+class PlanRecorder:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.startswith('SELECT'):
+            self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class QueryPlanTests(StoreTestCase):
+    # Plans SQLite reports as a SCAN that are known to stop early, by name.
+    ALLOWED_SCANS = {
+        # The first catalog page walks the primary key in order and stops after one page.
+        'catalog first page': re.compile(r'^SELECT (?!.* WHERE ).* FROM "store_product" .*ORDER BY "store_product"\."id" ASC LIMIT \d+$'),
+    }
+
+    def setUp(self):
+        super().setUp()
+        for i in range(30):
+            make_product(f'Filler {i}', is_featured=(i == 7))
+        StoreBanner.objects.create(title='Summer Sale', image='banners/sale.png')
+        other = User.objects.create_user('other')
+        library = UserLibrary.objects.create(user=self.user)
+        library.products.add(self.game)
+        Transaction.objects.create(user=self.user, product=self.game, price=self.game.price)
+        Review.objects.create(product=self.game, user=self.user, rating=4, comment='Great')
+        Review.objects.create(product=self.game, user=other, rating=2, comment='Meh')
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=Product.objects.get(name='Filler 3'))
+
+    def plan_problems(self, path):
+        recorder = PlanRecorder()
+        with connection.execute_wrapper(recorder):
+            self.assertLess(self.client.get(path).status_code, 400)
+
+        problems = []
+        with connection.cursor() as cursor:
+            for sql, params in recorder.statements:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                for detail in (row[-1] for row in cursor.fetchall()):
+                    # A bare SCAN reads the whole table; a LIMIT query should never need a separate sort.
+                    full_scan = detail.startswith('SCAN ') and ' USING ' not in detail and not any(
+                        pattern.match(sql) for pattern in self.ALLOWED_SCANS.values()
+                    )
+                    if full_scan or (detail.startswith('USE TEMP B-TREE') and ' LIMIT ' in sql):
+                        problems.append(f'{detail}: {sql}')
+        return problems
+
+    def test_views_use_indexes(self):
+        paths = [
+            '/home/', '/home/page/', f'/product/{self.game.id}/', f'/product/{self.game.id}/reviews/',
+            '/profile/', '/cart/', '/repository/', '/wishlist/', '/wallet/topup/',
+            f'/add-to-cart/{Product.objects.get(name="Filler 3").id}/',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                self.assertEqual(self.plan_problems(path), [])
+
+    def test_partial_indexes_serve_featured_and_banner_lookups(self):
+        with connection.cursor() as cursor:
+            for queryset, index in (
+                (Product.objects.filter(is_featured=True)[:1], 'store_product_featured'),
+                (StoreBanner.objects.filter(is_active=True)[:1], 'store_storebanner_active'),
+                (Transaction.objects.filter(user=self.user).order_by('-date')[:10], 'store_transaction_user_date'),
+            ):
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                self.assertIn(index, ' '.join(row[-1] for row in cursor.fetchall()))
+
+    def test_cart_item_is_unique_per_product(self):
+        cart = Cart.objects.get(user=self.user)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartItem.objects.create(cart=cart, product=Product.objects.get(name='Filler 3'))
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('reader')
+        UserProfile.objects.create(user=self.user, balance=Decimal('50.00'))
+        self.game = make_product('Primary Name')
+        self.client.force_login(self.user)
+
+        # A second SQLite file stands in for a read replica, copied from the primary.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings_dict = {**connections['default'].settings_dict, 'NAME': f'{directory}/replica.sqlite3'}
+        connections['replica_test'] = load_backend(settings_dict['ENGINE']).DatabaseWrapper(settings_dict, 'replica_test')
+        self.addCleanup(self.drop_replica)
+        sync_replicas.copy_sqlite('default', 'replica_test')
+
+        overrides = self.settings(STORE_READ_REPLICAS=['replica_test'])
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def drop_replica(self):
+        connections['replica_test'].close()
+        del connections['replica_test']
+
+    def test_read_only_views_read_from_the_replica(self):
+        Product.objects.using('replica_test').filter(id=self.game.id).update(name='Replica Name')
+
+        self.assertContains(self.client.get('/home/'), 'Replica Name')
+        self.assertContains(self.client.get(f'/product/{self.game.id}/'), 'Replica Name')
+        # Views without the decorator keep reading the primary.
+        self.client.get(f'/add-to-cart/{self.game.id}/')
+        self.assertContains(self.client.get('/cart/'), 'Primary Name')
+        self.assertEqual(routers.PrimaryReplicaRouter().db_for_read(Product), 'default')
+
+    def test_writes_go_to_the_primary(self):
+        self.client.post('/wallet/topup/', {'amount': '200'})
+        self.assertEqual(UserProfile.objects.get(user=self.user).balance, Decimal('250.00'))
+        self.assertEqual(UserProfile.objects.using('replica_test').get(user=self.user).balance, Decimal('50.00'))
+
+    def test_reads_after_a_write_stay_on_the_primary(self):
+        response = self.client.get('/repository/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(UserLibrary.objects.filter(user=self.user).exists())
+        self.assertFalse(UserLibrary.objects.using('replica_test').filter(user=self.user).exists())
+
+    def test_caches_are_filled_from_the_primary(self):
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=self.game)
+        self.client.get('/checkout/')
+        # The replica has not seen the purchase, and the next page views run on it.
+        self.client.get('/home/')
+        self.client.get(f'/product/{self.game.id}/')
+
+        self.assertTrue(ownership.for_user(self.user).owns(self.game.id))
+        self.assertEqual(header.get_snapshot(self.user)['balance'], Decimal('40.01'))
+        self.client.get(f'/add-to-cart/{self.game.id}/')
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_unsafe_methods_skip_the_replica(self):
+        Product.objects.using('replica_test').filter(id=self.game.id).update(name='Replica Name')
+        UserLibrary.objects.create(user=self.user).products.add(self.game)
+        self.client.post(f'/product/{self.game.id}/', {'rating': 4, 'comment': 'Solid'})
+        self.assertEqual(Review.objects.get().product.name, 'Primary Name')
+
+
+class AsyncStorefrontTests(StoreTestCase):
+    async def test_read_views_render_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        banner_game = await Product.objects.acreate(
+            name='Featured Game', description='', price=Decimal('5.00'), category='RPG', is_featured=True
+        )
+
+        response = await self.async_client.get('/home/')
+        self.assertContains(response, 'Hollow Knight')
+        self.assertContains(response, banner_game.name)
+
+        response = await self.async_client.get(f'/product/{self.game.id}/')
+        self.assertContains(response, 'Hollow Knight')
+        self.assertEqual((await self.async_client.get('/product/999999/')).status_code, 404)
+
+        self.assertEqual((await self.async_client.get('/repository/')).status_code, 200)
+        self.assertEqual((await self.async_client.get('/wishlist/')).status_code, 200)
+        self.assertTrue(await UserLibrary.objects.filter(user=self.user).aexists())
+
+    async def test_login_required_redirects_anonymous_users(self):
+        response = await self.async_client.get('/repository/')
+        self.assertEqual(response.status_code, 302)
+
+    async def test_anonymous_review_post_is_sent_to_login(self):
+        response = await self.async_client.post(f'/product/{self.game.id}/', {'rating': 5, 'comment': 'Drive-by'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], f'/?next=/product/{self.game.id}/')
+        self.assertFalse(await Review.objects.aexists())
+
+    async def test_review_post_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        library = await UserLibrary.objects.acreate(user=self.user)
+        await library.products.aadd(self.game)
+
+        response = await self.async_client.post(f'/product/{self.game.id}/', {'rating': 3, 'comment': 'Async'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(await Review.objects.filter(product=self.game, comment='Async').acount(), 1)
+
+
+class FragmentCacheTests(StoreTestCase):
+    def test_anonymous_catalog_is_served_from_the_page_cache(self):
+        self.client.logout()
+        first = self.client.get('/home/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/home/')
+        self.assertEqual(first.content, second.content)
+
+        self.game.name = 'Silksong'
+        self.game.save()
+        self.assertContains(self.client.get('/home/'), 'Silksong')
+
+    def test_flash_messages_are_not_cached(self):
+        response = self.client.get('/logout/', follow=True)
+        self.assertContains(response, 'You have successfully logged out.')
+        self.assertNotContains(self.client.get('/home/'), 'You have successfully logged out.')
+
+    def test_cards_are_keyed_on_updated_and_membership(self):
+        self.client.get('/home/')
+        # A queryset update skips auto_now, so the cached card is still served.
+        Product.objects.filter(id=self.game.id).update(name='Renamed Quietly')
+        response = self.client.get('/home/')
+        self.assertContains(response, 'Hollow Knight')
+
+        self.game.refresh_from_db()
+        self.game.save()
+        self.assertContains(self.client.get('/home/'), 'Renamed Quietly')
+
+        UserLibrary.objects.create(user=self.user).products.add(self.game)
+        self.assertContains(self.client.get('/home/'), 'In Your Repository')
+
+    def test_banner_and_hero_follow_their_rows(self):
+        banner = StoreBanner.objects.create(title='Summer Sale', image='banners/sale.jpg')
+        self.assertContains(self.client.get('/home/'), 'Summer Sale')
+        self.assertContains(self.client.get(f'/product/{self.game.id}/'), 'Hollow Knight')
+
+        banner.title = 'Winter Sale'
+        banner.save()
+        self.game.name = 'Hollow Knight: Silksong'
+        self.game.save()
+        self.assertContains(self.client.get('/home/'), 'Winter Sale')
+        self.assertContains(self.client.get(f'/product/{self.game.id}/'), 'Hollow Knight: Silksong')
+
+    def test_personal_header_is_rendered_around_cached_fragments(self):
+        self.client.get('/home/')
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=self.game)
+        self.assertContains(self.client.get('/home/'), 'Cart (<span data-live="cart-count">1</span>)')
+
+
+class ShelfTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.others = [User.objects.create_user(f'buyer-{i}') for i in range(3)]
+
+    def test_bestsellers_count_sales_in_the_window(self):
+        hit = make_product('Hades', 'Indie')
+        old = Transaction.objects.create(user=self.user, product=self.game, price=self.game.price)
+        Transaction.objects.filter(id=old.id).update(date=old.date - timedelta(days=90))
+        for buyer in self.others:
+            Transaction.objects.create(user=buyer, product=hit, price=hit.price)
+        Transaction.objects.create(user=self.user, product=self.game, price=self.game.price)
+
+        self.assertEqual(shelves.rebuild([shelves.BESTSELLERS])[shelves.BESTSELLERS], [hit.id, self.game.id])
+
+    def test_top_rated_uses_a_bayesian_average(self):
+        lucky = make_product('One Hit Wonder')
+        for i, buyer in enumerate(self.others):
+            Review.objects.create(product=self.game, user=buyer, rating=5 if i else 4, comment='')
+        Review.objects.create(product=lucky, user=self.user, rating=5, comment='')
+        Review.objects.create(product=make_product('Buggy'), user=self.user, rating=1, comment='')
+
+        ranked = shelves.rebuild([shelves.TOP_RATED])[shelves.TOP_RATED]
+        self.assertEqual(ranked[:2], [self.game.id, lucky.id])
+
+    def test_featured_and_new_shelves_follow_product_saves(self):
+        indie = make_product('Celeste', 'Indie')
+        self.assertEqual(shelves.load()[shelves.NEW][:2], [indie.id, self.game.id])
+
+        indie.is_featured = True
+        indie.save()
+        self.assertEqual(Shelf.objects.get(name=shelves.FEATURED).product_ids, [indie.id])
+
+        indie.delete()
+        self.assertEqual(shelves.load()[shelves.FEATURED], [])
+        self.assertEqual(shelves.load()[shelves.NEW], [self.game.id])
+
+    def test_rebuild_in_another_process_reaches_this_one(self):
+        self.assertEqual(shelves.load().get(shelves.BESTSELLERS, []), [])
+        key = fragments._version_key(shelves.VERSION)
+        seen = cache.get(key)
+        Transaction.objects.create(user=self.others[0], product=self.game, price=self.game.price)
+        call_command('rebuild_shelves', '--only', shelves.BESTSELLERS, stdout=StringIO())
+        cache.set(key, seen)
+        self.assertEqual(shelves.load().get(shelves.BESTSELLERS, []), [])
+
+        cache.delete(key)
+        self.assertEqual(shelves.load()[shelves.BESTSELLERS], [self.game.id])
+
+    def test_storefront_serves_shelves_with_one_product_query(self):
+        Transaction.objects.create(user=self.others[0], product=self.game, price=self.game.price)
+        call_command('rebuild_shelves', stdout=StringIO())
+        cache.delete(shelves.cache_key())
+        shelves.load()
+
+        with self.assertNumQueries(1):
+            rows = shelves.products([shelves.BESTSELLERS, shelves.NEW, shelves.TOP_RATED])
+        self.assertEqual(rows[shelves.BESTSELLERS], [self.game])
+        self.assertEqual(rows[shelves.TOP_RATED], [])
+
+        response = self.client.get('/home/')
+        self.assertContains(response, 'Top Sellers')
+        self.assertNotContains(response, 'Top Rated')
+        self.assertNotContains(self.client.get('/home/', {'q': 'hollow'}), 'Top Sellers')
+
+
+@skipUnless(find_spec('numpy') and find_spec('scipy'), "numpy and scipy are needed to build recommendations")
+class RecommendationTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.celeste = make_product('Celeste', 'Indie')
+        self.hades = make_product('Hades', 'Indie')
+        self.doom = make_product('Doom', 'FPS')
+        self.own(self.user, self.game, self.celeste)
+        self.own(User.objects.create_user('fan'), self.game, self.celeste, self.hades)
+        self.own(User.objects.create_user('shooter'), self.doom)
+        Wishlist.objects.create(user=User.objects.get(username='shooter')).products.add(self.hades)
+
+    def own(self, user, *products):
+        UserLibrary.objects.create(user=user).products.add(*products)
+
+    def test_top_k_keeps_the_best_entries_per_row(self):
+        import numpy as np
+        rows, cols, data = recommendations.top_k(
+            np.array([0, 0, 0, 1, 1]), np.array([1, 2, 3, 0, 2]), np.array([0.2, 0.9, 0.5, 0.1, 0.3]), 2
+        )
+        self.assertEqual(rows.tolist(), [0, 0, 1, 1])
+        self.assertEqual(cols.tolist(), [2, 3, 2, 0])
+
+    def test_build_stores_neighbours_and_picks(self):
+        stats = recommendations.build()
+        self.assertEqual(stats['users'], 3)
+
+        self.assertEqual(ProductNeighbors.objects.get(product=self.game).product_ids[0], self.celeste.id)
+        # Hades is shared through the fan's library; Doom only through a user with nothing in common.
+        self.assertEqual(UserPicks.objects.get(user=self.user).product_ids, [self.hades.id])
+
+    def test_build_in_another_process_reaches_this_one(self):
+        self.assertEqual(recommendations.neighbor_ids(self.game.id), [])
+        key = fragments._version_key(recommendations.VERSION)
+        seen = cache.get(key)
+        call_command('build_recommendations', stdout=StringIO())
+        cache.set(key, seen)
+        self.assertEqual(recommendations.neighbor_ids(self.game.id), [])
+
+        cache.delete(key)
+        self.assertEqual(recommendations.neighbor_ids(self.game.id)[0], self.celeste.id)
+
+    def test_pages_show_precomputed_recommendations(self):
+        call_command('build_recommendations', stdout=StringIO())
+
+        response = self.client.get(f'/product/{self.game.id}/')
+        self.assertContains(response, 'Players Also Bought')
+        self.assertEqual(response.context['also_bought'][0], self.celeste)
+
+        response = self.client.get('/home/')
+        self.assertContains(response, 'Recommended for You')
+
+        # Picks the user has bought since the last build are hidden at serve time.
+        UserLibrary.objects.get(user=self.user).products.add(self.hades)
+        self.assertNotContains(self.client.get('/home/'), 'Recommended for You')
+
+
+class SalesRollupTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doom = make_product('Doom', 'FPS', '20.00')
+        self.staff = User.objects.create_user('manager', is_staff=True)
+
+    def buy(self, *products):
+        cart, created = Cart.objects.get_or_create(user=self.user)
+        for product in products:
+            CartItem.objects.create(cart=cart, product=product)
+        receipt = checkout.checkout(self.user)
+        jobs.work()
+        return receipt
+
+    def rollups(self):
+        return sorted(SalesRollup.objects.values_list('period', 'bucket', 'product_id', 'revenue', 'units', 'refunds', 'refunded'))
+
+    def test_purchases_and_refunds_update_rollups(self):
+        self.buy(self.game, self.doom)
+        day = SalesRollup.objects.get(period=SalesRollup.DAY, product=self.doom)
+        self.assertEqual((day.revenue, day.units, day.category), (Decimal('20.00'), 1, 'FPS'))
+        self.assertEqual(SalesRollup.objects.filter(period=SalesRollup.HOUR).count(), 2)
+
+        purchase = Transaction.objects.get(product=self.doom)
+        self.client.get(f'/refund/{purchase.id}')
+        jobs.work()
+        day.refresh_from_db()
+        self.assertEqual((day.revenue, day.units, day.refunds, day.refunded), (Decimal('0.00'), 0, 1, Decimal('20.00')))
+
+    def test_backfill_matches_incremental_rollups(self):
+        self.buy(self.game, self.doom)
+        self.client.get(f'/refund/{Transaction.objects.get(product=self.game).id}')
+        jobs.work()
+        live = self.rollups()
+
+        SalesRollup.objects.all().delete()
+        call_command('backfill_sales_rollups', '--chunk-size', '1', stdout=StringIO())
+        self.assertEqual(self.rollups(), live)
+
+    def test_backfill_writes_one_day_at_a_time(self):
+        self.buy(self.game)
+        self.buy(self.doom)
+        now = timezone.now()
+        first, second = Transaction.objects.order_by('id')
+        Transaction.objects.filter(id=first.id).update(date=now - timedelta(days=3))
+        gap = analytics.buckets(now - timedelta(days=2))[0][1]
+        SalesRollup.objects.all().delete()
+        SalesRollup.objects.create(period=SalesRollup.HOUR, bucket=gap, product=self.doom, category='FPS', units=7)
+
+        with CaptureQueriesContext(connection) as queries:
+            call_command('backfill_sales_rollups', stdout=StringIO())
+        self.assertEqual(sum('INSERT INTO "store_salesrollup"' in query['sql'] for query in queries), 2)
+        self.assertEqual(
+            sorted(SalesRollup.objects.values_list('period', 'product_id', 'units')),
+            sorted([(SalesRollup.HOUR, self.game.id, 1), (SalesRollup.DAY, self.game.id, 1),
+                    (SalesRollup.HOUR, self.doom.id, 1), (SalesRollup.DAY, self.doom.id, 1)]),
+        )
+
+        # --since leaves older days alone.
+        Transaction.objects.filter(id=second.id).delete()
+        today = analytics.buckets(now)[1][1]
+        call_command('backfill_sales_rollups', '--since', str(today.date()), stdout=StringIO())
+        self.assertEqual(list(SalesRollup.objects.values_list('product_id', flat=True).distinct()), [self.game.id])
+
+    def test_dashboard_reads_only_rollups(self):
+        self.buy(self.game, self.doom)
+        self.assertEqual(self.client.get('/dashboard/sales/').status_code, 302)
+
+        self.client.force_login(self.staff)
+        with self.assertNumQueries(5):
+            response = self.client.get('/dashboard/sales/', {'format': 'json', 'days': 7})
+        report = response.json()
+        self.assertEqual(len(report['daily']), 7)
+        self.assertEqual(Decimal(report['revenue']), Decimal('35.00'))
+        self.assertEqual([row['product__name'] for row in report['products']], ['Doom', 'Hollow Knight'])
+        self.assertEqual(report['categories'][0]['name'], 'First-Person Shooter')
+
+        self.assertContains(self.client.get('/dashboard/sales/'), 'Revenue by category')
+
+
+class AdminTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin_user = User.objects.create_superuser('boss', password='secret-pass-123')
+        self.client.force_login(self.admin_user)
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_cost_does_not_grow_with_rows(self):
+        urls = ('/admin/store/transaction/', '/admin/store/review/', '/admin/store/cartitem/', '/admin/store/walletentry/')
+        Transaction.objects.create(user=self.user, product=self.game, price=self.game.price)
+        Review.objects.create(user=self.user, product=self.game, rating=4, comment='Good')
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=self.game)
+        WalletEntry.objects.create(user=self.user, kind=WalletEntry.PURCHASE, amount=Decimal('-15.00'),
+                                   balance_after=Decimal('985.00'), product=self.game)
+        self.client.get('/admin/')
+        few = [self.changelist_queries(url) for url in urls]
+
+        for index in range(10):
+            user = User.objects.create_user(f'player{index}')
+            product = make_product(f'Game {index}')
+            Transaction.objects.create(user=user, product=product, price=product.price)
+            Review.objects.create(user=user, product=product, rating=3, comment='Fine')
+            CartItem.objects.create(cart=Cart.objects.create(user=user), product=product)
+            WalletEntry.objects.create(user=user, kind=WalletEntry.PURCHASE, amount=Decimal('-9.99'),
+                                       balance_after=Decimal('0.00'), product=product)
+        self.assertEqual([self.changelist_queries(url) for url in urls], few)
+
+    def test_product_search_uses_the_search_index(self):
+        make_product('Hades', 'Action')
+        search.rebuild_index()
+        response = self.client.get('/admin/store/product/', {'q': 'hollow'})
+        self.assertEqual([product.name for product in response.context['cl'].result_list], ['Hollow Knight'])
+
+        response = self.client.get('/admin/autocomplete/', {
+            'term': 'hades', 'app_label': 'store', 'model_name': 'transaction', 'field_name': 'product',
+        })
+        self.assertEqual([row['text'] for row in response.json()['results']], ['Hades'])
+
+    def test_feature_action_refreshes_the_featured_shelf(self):
+        shelves.rebuild()
+        self.client.post('/admin/store/product/', {
+            'action': 'feature_products', '_selected_action': [self.game.id],
+        })
+        self.assertEqual(shelves.load()[shelves.FEATURED], [self.game.id])
+        self.assertEqual(Shelf.objects.get(name=shelves.FEATURED).product_ids, [self.game.id])
+
+    def action_names(self, user, url):
+        self.client.force_login(user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        form = response.context['action_form']
+        # Without any action available to the user, the changelist has no action form.
+        return {name for name, label in form.fields['action'].choices} if form else set()
+
+    def staff_with(self, *codenames):
+        user = User.objects.create_user('-'.join(codenames), is_staff=True)
+        user.user_permissions.add(*Permission.objects.filter(codename__in=codenames))
+        return user
+
+    def test_rebuilding_shelves_needs_the_change_permission(self):
+        url = '/admin/store/shelf/'
+        self.assertNotIn('rebuild_shelves', self.action_names(self.staff_with('view_shelf'), url))
+        self.assertIn('rebuild_shelves', self.action_names(self.staff_with('view_shelf', 'change_shelf'), url))
+
+    def test_only_failed_jobs_are_retried(self):
+        for status in (Job.DONE, Job.FAILED, Job.RUNNING):
+            Job.objects.create(task='send_receipt', key=status, status=status, attempts=5)
+        url = '/admin/store/job/'
+        self.assertNotIn('retry_jobs', self.action_names(self.staff_with('view_job'), url))
+        self.client.force_login(self.admin_user)
+        self.client.post(url, {'action': 'retry_jobs', '_selected_action': list(Job.objects.values_list('id', flat=True))})
+        self.assertEqual(dict(Job.objects.values_list('key', 'status')), {
+            Job.DONE: Job.DONE, Job.FAILED: Job.PENDING, Job.RUNNING: Job.RUNNING,
+        })
+
+    def test_recomputing_prices_needs_the_change_permission(self):
+        url = '/admin/store/effectiveprice/'
+        self.assertNotIn('materialize_prices', self.action_names(self.staff_with('view_effectiveprice'), url))
+        self.assertIn('materialize_prices', self.action_names(self.staff_with('view_effectiveprice', 'change_effectiveprice'), url))
+
+    def test_unfiltered_count_uses_table_statistics(self):
+        for index in range(5):
+            make_product(f'Game {index}')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        paginator = admin.EstimatedCountPaginator(Product.objects.order_by('id'), 50)
+        with override_settings(STORE_ADMIN_EXACT_COUNT_BELOW=0):
+            self.assertEqual(paginator.count, 6)
+            # Rows added since the last ANALYZE are not in the estimate; filtered lists stay exact.
+            make_product('Late Arrival', 'FPS')
+            self.assertEqual(admin.EstimatedCountPaginator(Product.objects.order_by('id'), 50).count, 6)
+            self.assertEqual(admin.EstimatedCountPaginator(Product.objects.filter(category='FPS').order_by('id'), 50).count, 1)
+        self.assertEqual(admin.EstimatedCountPaginator(Product.objects.order_by('id'), 50).count, 7)
+
+
+class JobQueueTests(StoreTestCase):
+    def flaky_task(self, fail_times, max_attempts=3):
+        calls = []
+
+        @jobs.task(name='test_flaky', max_attempts=max_attempts)
+        def flaky(label):
+            calls.append(label)
+            Review.objects.create(user=self.user, product=self.game, rating=1, comment=label)
+            if len(calls) <= fail_times:
+                raise RuntimeError("Temporary failure")
+
+        self.addCleanup(jobs.TASKS.pop, 'test_flaky')
+        return calls
+
+    def test_registration_creates_the_profile_and_defers_the_welcome_email(self):
+        self.client.logout()
+        response = self.client.post('/register/', {
+            'username': 'newcomer', 'email': 'newcomer@example.com',
+            'password1': 'a-Long-passw0rd', 'password2': 'a-Long-passw0rd',
+        })
+        self.assertEqual(response.status_code, 302)
+        user = User.objects.get(username='newcomer')
+        self.assertTrue(UserProfile.objects.filter(user=user).exists())
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(jobs.work(), 1)
+        self.assertEqual(mail.outbox[0].to, ['newcomer@example.com'])
+
+    def test_checkout_receipt_is_sent_by_a_worker(self):
+        self.user.email = 'gamer@example.com'
+        self.user.save()
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=self.game)
+        self.client.get('/checkout/')
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(set(Job.objects.values_list('task', flat=True)), {'record_sales', 'send_receipt'})
+
+        jobs.work()
+        self.assertIn('Hollow Knight', mail.outbox[0].body)
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+
+    def test_idempotency_key_enqueues_once(self):
+        for attempt in range(2):
+            jobs.enqueue('send_welcome_email', key='welcome:again', user_id=self.user.id)
+        self.assertEqual(Job.objects.filter(key='welcome:again').count(), 1)
+
+    def test_failed_attempts_roll_back_and_retry_with_backoff(self):
+        calls = self.flaky_task(fail_times=1)
+        jobs.enqueue('test_flaky', label='first')
+        self.assertEqual(jobs.work(), 1)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertIn('Temporary failure', job.last_error)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertFalse(Review.objects.exists())
+
+        # Not due yet, so the next pass leaves it alone.
+        self.assertEqual(jobs.work(), 0)
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(jobs.work(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, calls), (Job.DONE, 2, ['first', 'first']))
+        self.assertEqual(Review.objects.count(), 1)
+
+    def test_job_fails_for_good_after_max_attempts(self):
+        self.flaky_task(fail_times=5, max_attempts=2)
+        jobs.enqueue('test_flaky', label='doomed')
+        jobs.work()
+        Job.objects.update(run_at=timezone.now())
+        jobs.work()
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+
+    def test_jobs_of_a_dead_worker_are_requeued(self):
+        jobs.enqueue('send_welcome_email', user_id=self.user.id)
+        [job] = jobs.claim('worker-that-dies')
+        self.assertEqual(jobs.claim('another-worker'), [])
+
+        Job.objects.update(locked_at=timezone.now() - jobs.STALE_AFTER * 2)
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.work('another-worker'), 1)
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_run_workers_once_drains_the_queue(self):
+        jobs.enqueue('send_welcome_email', user_id=self.user.id)
+        out = StringIO()
+        call_command('run_workers', '--once', stdout=out)
+        self.assertIn('Ran 1 job', out.getvalue())
+        self.assertFalse(Job.objects.exclude(status=Job.DONE).exists())
+
+
+class PrincipalTests(StoreTestCase):
+    def test_principal_bundles_the_account_in_one_query(self):
+        cart = Cart.objects.create(user=self.user)
+        library = UserLibrary.objects.create(user=self.user)
+        with self.assertNumQueries(1):
+            account = principal.load(self.user.id)
+        self.assertEqual((account.cart_id, account.library_id, account.wishlist_id), (cart.id, library.id, None))
+        with self.assertNumQueries(0):
+            self.assertEqual(principal.load(self.user.id).user.userprofile.balance, Decimal('1000.00'))
+
+    def test_profile_and_wallet_writes_refresh_the_principal(self):
+        self.client.get('/wallet/topup/')
+        self.client.post('/wallet/topup/', {'amount': '200'})
+        self.assertContains(self.client.get('/cart/'), '₱<span data-live="balance">1200.00</span>')
+
+        self.profile.avatar = 'avatars/new.png'
+        self.profile.save()
+        self.assertEqual(principal.load(self.user.id).profile.avatar.name, 'avatars/new.png')
+
+    def test_logout_drops_the_principal(self):
+        self.client.get('/wallet/topup/')
+        self.assertIsNotNone(cache.get(principal.cache_key(self.user.id)))
+        self.client.get('/logout/')
+        self.assertIsNone(cache.get(principal.cache_key(self.user.id)))
+
+    def test_password_change_ends_other_sessions(self):
+        other = Client()
+        other.force_login(self.user)
+        self.assertEqual(other.get('/wallet/topup/').status_code, 200)
+
+        self.user.set_password('a-brand-new-passw0rd')
+        self.user.save()
+        self.assertEqual(other.get('/wallet/topup/').status_code, 302)
+
+
+class RateLimitTests(StoreTestCase):
+    def test_token_bucket_refills_continuously(self):
+        buckets = throttle.TokenBuckets()
+        self.assertEqual([buckets.take('key', 2, 1.0, now=0.0) for _ in range(2)], [0, 0])
+        self.assertEqual(buckets.take('key', 2, 1.0, now=0.0), 1.0)
+        self.assertEqual(buckets.take('key', 2, 1.0, now=0.5), 0.5)
+        self.assertEqual(buckets.take('key', 2, 1.0, now=1.0), 0)
+        # Idle time never banks more than a full bucket.
+        self.assertEqual([buckets.take('key', 2, 1.0, now=100.0) for _ in range(3)], [0, 0, 1.0])
+
+    def test_least_recently_used_buckets_are_dropped(self):
+        buckets = throttle.TokenBuckets(max_buckets=2)
+        for key in ('a', 'b', 'a', 'c'):
+            buckets.take(key, 1, 1.0, now=0.0)
+        self.assertEqual(list(buckets.buckets), ['a', 'c'])
+
+    def test_limit_is_per_user_and_per_endpoint(self):
+        for _ in range(10):
+            self.assertEqual(self.client.post('/wallet/topup/', {'amount': '200'}).status_code, 302)
+        response = self.client.post('/wallet/topup/', {'amount': '200'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(WalletEntry.objects.filter(kind=WalletEntry.TOP_UP).count(), 10)
+
+        self.assertEqual(self.client.get(f'/wishlist/add/{self.game.id}/').status_code, 302)
+        other = User.objects.create_user('other-gamer')
+        self.client.force_login(other)
+        self.assertEqual(self.client.post('/wallet/topup/', {'amount': '200'}).status_code, 302)
+
+    def test_form_renders_are_not_counted(self):
+        for _ in range(15):
+            self.assertEqual(self.client.get('/wallet/topup/').status_code, 200)
+        self.assertEqual(self.client.post('/wallet/topup/', {'amount': '200'}).status_code, 302)
+
+    def test_write_links_are_counted_on_get(self):
+        statuses = [self.client.get('/checkout/').status_code for _ in range(6)]
+        self.assertEqual(statuses, [302] * 5 + [429])
+
+    def test_replays_do_not_spend_tokens(self):
+        for _ in range(12):
+            response = self.client.post('/wallet/topup/', {'amount': '200'}, HTTP_IDEMPOTENCY_KEY='top-up-once')
+            self.assertEqual(response.status_code, 302)
+        for i in range(9):
+            self.client.post('/wallet/topup/', {'amount': '200'}, HTTP_IDEMPOTENCY_KEY=f'top-up-{i}')
+        self.assertEqual(WalletEntry.objects.filter(kind=WalletEntry.TOP_UP).count(), 10)
+        self.assertEqual(self.client.post('/wallet/topup/', {'amount': '200'}).status_code, 429)
+
+
+class IdempotencyTests(StoreTestCase):
+    def test_duplicate_checkout_replays_the_first_response(self):
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=self.game)
+        first = self.client.get('/checkout/', {'idempotency_key': 'order-1'})
+        # The cart is empty now; without the key this would redirect with "Your cart is empty."
+        second = self.client.get('/checkout/', {'idempotency_key': 'order-1'})
+
+        self.assertEqual(second['Location'], first['Location'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 1)
+
+    def test_retried_top_up_credits_once(self):
+        for _ in range(3):
+            self.client.post('/wallet/topup/', {'amount': '200'}, HTTP_IDEMPOTENCY_KEY='top-up-1')
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.balance, Decimal('1200.00'))
+
+        self.client.post('/wallet/topup/', {'amount': '200'}, HTTP_IDEMPOTENCY_KEY='top-up-2')
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.balance, Decimal('1400.00'))
+
+    def test_key_reused_for_a_different_request_is_rejected(self):
+        self.client.post('/wallet/topup/', {'amount': '200'}, HTTP_IDEMPOTENCY_KEY='reused')
+        response = self.client.post('/wallet/topup/', {'amount': '400'}, HTTP_IDEMPOTENCY_KEY='reused')
+        self.assertEqual(response.status_code, 422)
+
+    def test_failed_requests_release_their_key(self):
+        self.assertEqual(self.client.get('/add-to-cart/9999/', {'idempotency_key': 'retry-me'}).status_code, 404)
+        make_product('Late Game', id=9999)
+        self.assertEqual(self.client.get('/add-to-cart/9999/', {'idempotency_key': 'retry-me'}).status_code, 302)
+        self.assertTrue(CartItem.objects.filter(product_id=9999).exists())
+
+    def test_forms_carry_a_fresh_key(self):
+        first, second = (
+            re.findall(rb'name="idempotency_key" value="(\w+)"', self.client.get('/wallet/topup/').content)
+            for _ in range(2)
+        )
+        self.assertEqual(len(first), 5)
+        self.assertFalse(set(first) & set(second))
+
+
+class ExportTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.games = [make_product(f'Export Game {i}', price=f'{i}.50') for i in range(5)]
+        for game in self.games:
+            Transaction.objects.create(user=self.user, product=game, price=game.price)
+        UserLibrary.objects.create(user=self.user).products.add(*self.games[:3])
+        self.other = User.objects.create_user('someone-else')
+        Transaction.objects.create(user=self.other, product=self.game, price=self.game.price)
+
+    def download(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_history_has_only_the_users_rows(self):
+        response, body = self.download('/profile/export/transactions/')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="pycrib-transactions-gamer.csv"', response['Content-Disposition'])
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual([row['product'] for row in rows], [game.name for game in self.games])
+        self.assertEqual(rows[1]['price'], '1.50')
+
+    def test_json_library_export(self):
+        response, body = self.download('/profile/export/library/', format='json')
+        self.assertEqual([row['product'] for row in json.loads(body)], [game.name for game in self.games[:3]])
+        self.assertEqual(self.download('/profile/export/library/', format='json')[1], body)
+
+    @override_settings(STORE_EXPORT_PAGE_SIZE=2)
+    def test_export_reads_keyset_pages(self):
+        response = self.client.get('/profile/export/transactions/')
+        with CaptureQueriesContext(connection) as queries:
+            body = b''.join(response.streaming_content).decode()
+        # Three pages of at most two rows; the short last page ends the export.
+        self.assertEqual(len(queries), 3)
+        self.assertTrue(all('"store_transaction"."id" >' in query['sql'] for query in queries))
+        self.assertEqual(len(body.strip().splitlines()), 6)
+
+    @override_settings(STORE_EXPORT_PAGE_SIZE=2)
+    async def test_asgi_export_streams_an_async_iterator(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get('/profile/export/transactions/', {'format': 'json'})
+        # A sync iterator would be read into a list by the ASGI handler before sending anything.
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 5)
+        rows = json.loads(b''.join(chunks))
+        self.assertEqual([row['product'] for row in rows], [game.name for game in self.games])
+
+    def test_staff_export_covers_every_user(self):
+        self.assertEqual(self.client.get('/dashboard/exports/transactions/').status_code, 302)
+        self.client.force_login(User.objects.create_user('accountant', is_staff=True))
+        response, body = self.download('/dashboard/exports/transactions/')
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[-1]['username'], 'someone-else')
+        self.assertEqual(self.client.get('/dashboard/exports/passwords/').status_code, 404)
+
+
+class PricingTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.rpg = make_product('Elden Ring', 'RPG', '60.00')
+
+    def discount(self, percent_off, **kwargs):
+        kwargs.setdefault('scope', Discount.PRODUCT if 'product' in kwargs else Discount.STORE)
+        return Discount.objects.create(name=f'{percent_off}% off', percent_off=percent_off, **kwargs)
+
+    def test_biggest_discount_across_scopes_wins(self):
+        self.discount(10)
+        self.discount(25, scope=Discount.CATEGORY, category='RPG')
+        self.discount(20, product=self.game)
+        self.discount(90, product=self.game, is_active=False)
+        self.assertEqual(pricing.materialize(), 2)
+
+        prices = {row.product_id: (row.price, row.percent_off) for row in EffectivePrice.objects.all()}
+        self.assertEqual(prices, {self.rpg.id: (Decimal('45.00'), 25), self.game.id: (Decimal('12.00'), 20)})
+        self.assertEqual(pricing.discounted(Decimal('9.99'), 15), Decimal('8.49'))
+
+    def test_discount_changes_are_materialized_by_a_worker(self):
+        self.discount(50, product=self.game)
+        self.assertFalse(EffectivePrice.objects.exists())
+        jobs.work()
+        self.assertEqual(pricing.sales([self.game.id])[self.game.id].price, Decimal('7.50'))
+        self.assertContains(self.client.get('/home/'), '<s style="opacity: 0.5; font-weight: 400;">₱15.00</s> ₱7.50')
+
+    def test_rewrite_by_the_worker_process_reaches_web_processes(self):
+        discount = self.discount(50, product=self.game)
+        pricing.materialize()
+        self.assertIn(self.game.id, pricing.sales([self.game.id]))
+        # The worker's bump lands in the table; this process still holds its own copy of the old version.
+        key = fragments._version_key(pricing.VERSION)
+        seen = cache.get(key)
+        Discount.objects.filter(id=discount.id).update(is_active=False)
+        pricing.materialize()
+        cache.set(key, seen)
+        self.assertIn(self.game.id, pricing.sales([self.game.id]))
+
+        # Once the copy is older than the check interval, the table's version is used.
+        cache.delete(key)
+        self.assertEqual(pricing.sales([self.game.id]), {})
+
+    def test_rewrite_is_scheduled_for_the_next_start_or_end(self):
+        now = timezone.now()
+        self.discount(30, product=self.game, starts_at=now, ends_at=now + timedelta(hours=1))
+        self.discount(40, product=self.rpg, starts_at=now + timedelta(minutes=10))
+        pricing.materialize(now)
+        job = Job.objects.get(key__startswith='prices:')
+        self.assertAlmostEqual(job.run_at, now + timedelta(minutes=10), delta=timedelta(seconds=1))
+
+        # An ended sale stops applying even if the rewrite is late.
+        self.assertIn(self.game.id, pricing.sales([self.game.id], now=now))
+        self.assertEqual(pricing.sales([self.game.id], now=now + timedelta(hours=2)), {})
+        pricing.materialize(now + timedelta(hours=2))
+        self.assertEqual(list(EffectivePrice.objects.values_list('product_id', flat=True)), [self.rpg.id])
+
+    def test_catalog_prices_take_one_lookup(self):
+        self.discount(10)
+        pricing.materialize()
+        products = list(Product.objects.all())
+        with self.assertNumQueries(1):
+            pricing.apply(products[:1], products)
+        with self.assertNumQueries(0):
+            pricing.apply(products)
+        self.assertEqual([pricing.unit_price(product) for product in products], [Decimal('13.50'), Decimal('54.00')])
+
+    def test_list_price_change_reprices_the_product(self):
+        self.discount(50, product=self.rpg)
+        pricing.materialize()
+        pricing.sales([self.rpg.id])
+        self.rpg.price = Decimal('40.00')
+        self.rpg.save()
+        self.assertEqual(pricing.sales([self.rpg.id])[self.rpg.id].price, Decimal('20.00'))
+
+    def test_checkout_charges_and_records_the_sale_price(self):
+        sale = self.discount(20, product=self.game)
+        pricing.materialize()
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=self.game)
+        self.assertContains(self.client.get('/cart/'), 'Total: ₱<span data-live="cart-total">12.00</span>')
+
+        receipt = checkout.checkout(self.user)
+        self.assertEqual((receipt.total, receipt.lines[0].list_price), (Decimal('12.00'), Decimal('15.00')))
+        purchase = Transaction.objects.get(user=self.user)
+        self.assertEqual((purchase.price, purchase.discount_id), (Decimal('12.00'), sale.id))
+        self.assertEqual(UserProfile.objects.get(user=self.user).balance, Decimal('988.00'))
+
+        # Ending the sale later does not change what was paid, or what a refund returns.
+        sale.delete()
+        purchase.refresh_from_db()
+        self.assertEqual((purchase.price, purchase.discount_id), (Decimal('12.00'), None))
+
+    def test_discount_needs_a_target(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Discount.objects.create(name='Nothing', scope=Discount.CATEGORY, percent_off=10)
+
+
+class LiveUpdateTests(StoreTestCase):
+    def post_json(self, path):
+        return self.client.post(path, headers={'Accept': 'application/json'})
+
+    def test_mutations_answer_fetch_with_json(self):
+        response = self.post_json(f'/add-to-cart/{self.game.id}/')
+        self.assertEqual(response.json(), {'product_id': self.game.id, 'in_cart': True, 'message': 'Added Hollow Knight to your cart!'})
+        # No flash message is left behind for the next full page.
+        self.assertNotContains(self.client.get('/cart/'), 'Added Hollow Knight')
+
+        item = CartItem.objects.get()
+        self.assertEqual(self.post_json(f'/cart/remove/{item.id}/').json()['in_cart'], False)
+        self.assertEqual(self.post_json(f'/wishlist/add/{self.game.id}/').json()['wishlisted'], True)
+
+        UserLibrary.objects.create(user=self.user).products.add(self.game)
+        response = self.post_json(f'/add-to-cart/{self.game.id}/')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('already own', response.json()['message'])
+
+    def test_changes_are_published_after_commit(self):
+        events = []
+        self.patch_layer(events)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post_json(f'/add-to-cart/{self.game.id}/')
+            self.client.post('/wallet/topup/', {'amount': '200'})
+            self.assertEqual(events, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get('/checkout/')
+        group = live.user_group(self.user.id)
+        self.assertEqual(events, [
+            (group, 'cart', {'product_id': self.game.id, 'change': 1}),
+            (group, 'balance', {'balance': Decimal('1200.00'), 'change': Decimal('200.00')}),
+            (group, 'balance', {'balance': Decimal('1185.00'), 'change': Decimal('-15.00')}),
+            (group, 'cart', {'product_id': self.game.id, 'change': -1}),
+            (group, 'library', {'added': [self.game.id]}),
+        ])
+
+    def patch_layer(self, events):
+        layer = live.layer()
+        original = layer.publish
+        layer.publish = lambda group, message: events.append((group, message['event'], message['data']))
+        self.addCleanup(setattr, layer, 'publish', original)
+
+    async def test_slow_tab_gets_a_resync(self):
+        layer = live.InMemoryChannelLayer()
+        subscription = layer.subscribe('user.1')
+        subscription.queue = asyncio.Queue(2)
+        for change in range(3):
+            self.assertEqual(layer.publish('user.1', {'event': 'cart', 'data': {'change': change}}), 1)
+        await asyncio.sleep(0)
+        self.assertEqual((await subscription.get(1))['event'], live.RESYNC)
+        self.assertIsNone(await subscription.get(0.01))
+        subscription.close()
+        self.assertEqual(layer.publish('user.1', {'event': 'cart', 'data': {}}), 0)
+
+    @override_settings(STORE_LIVE_STREAM_SECONDS=1)
+    async def test_stream_pushes_changes_from_other_tabs(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get('/live/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+
+        async def next_chunk():
+            return (await asyncio.wait_for(anext(chunks), 2)).decode()
+
+        self.assertTrue((await next_chunk()).startswith('retry:'))
+        self.assertEqual(await next_chunk(), 'event: hello\ndata: {"cart_count": 0, "balance": "1000.00"}\n\n')
+
+        def top_up_in_another_tab():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/wallet/topup/', {'amount': '500'})
+
+        await sync_to_async(top_up_in_another_tab)()
+        self.assertEqual(await next_chunk(), 'event: balance\ndata: {"balance": "1500.00", "change": "500.00"}\n\n')
+        # The stream ends after STORE_LIVE_STREAM_SECONDS and leaves the group.
+        self.assertEqual([chunk async for chunk in chunks], [])
+        self.assertNotIn(live.user_group(self.user.id), live.layer().groups)
+
+    async def test_stream_unsubscribes_when_the_client_goes_away(self):
+        async def snapshot():
+            return []
+
+        events = live.stream('user.test', snapshot, seconds=60)
+        await anext(events)
+        self.assertIn('user.test', live.layer().groups)
+        # Django cancels the response task when an ASGI client disconnects.
+        waiting = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertNotIn('user.test', live.layer().groups)
+
+    @override_settings(STORE_LIVE_POLL_SECONDS=0.01)
+    async def test_stream_hears_other_processes(self):
+        async def snapshot():
+            return []
+
+        layer = live.layer()
+        events = live.stream('user.test', snapshot, seconds=60)
+        await anext(events)
+        # Another web process or a job worker has its own layer, and only the table is shared.
+        other = live.DatabaseChannelLayer()
+        await sync_to_async(other.publish)('user.test', {'event': 'cart', 'data': {'change': 1}})
+        await sync_to_async(other.publish)('user.other', {'event': 'cart', 'data': {'change': 2}})
+        self.assertEqual(await asyncio.wait_for(anext(events), 2), 'event: cart\ndata: {"change": 1}\n\n')
+        # The process's own events reach its streams directly, once.
+        await sync_to_async(layer.publish)('user.test', {'event': 'balance', 'data': {'balance': Decimal('5.00')}})
+        self.assertEqual(await asyncio.wait_for(anext(events), 2), 'event: balance\ndata: {"balance": "5.00"}\n\n')
+        waiting = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.05)
+        self.assertFalse(waiting.done())
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(layer.pollers, {})
+
+    def test_old_events_are_pruned(self):
+        live.layer().publish('user.test', {'event': 'cart', 'data': {}})
+        LiveEvent.objects.create(group='user.test', origin='gone', message={}, created_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(live.prune(), 1)
+        self.assertEqual(LiveEvent.objects.count(), 1)
+
+    def test_stream_needs_a_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/live/').status_code, 302)
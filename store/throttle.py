@@ -0,0 +1,93 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+MAX_BUCKETS = 100_000
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def parse_rate(rate):
+    """'10/m' -> (10, 60). The period may be spelled out: '10/minute'."""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+class TokenBuckets:
+    """Token buckets kept in process memory, least recently used first out.
+
+    Tokens refill continuously rather than all at once, so the limit holds over any sliding
+    window of one period and a burst at a window edge cannot double it."""
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+    def take(self, key, capacity, per_second, now=None):
+        """Take a token; returns 0 when allowed, otherwise the seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * per_second)
+            if tokens >= 1:
+                tokens, wait = tokens - 1, 0
+            else:
+                wait = (1 - tokens) / per_second
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+buckets = TokenBuckets()
+
+
+def client_id(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.pk
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def too_many_requests(request, wait):
+    message = "Too many requests. Please slow down and try again shortly."
+    if request.headers.get('Accept') == 'application/json':
+        response = JsonResponse({'error': message}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+def rate_limit(rate, burst=None, methods=UNSAFE_METHODS):
+    """Limit a view per user (per address when anonymous) to `rate`, allowing bursts of `burst` requests.
+
+    Only requests made with one of `methods` are counted, so rendering a form costs nothing;
+    pass methods=None for views that write (or do heavy work) on every method."""
+    count, period = parse_rate(rate)
+    capacity = burst or count
+    per_second = count / period
+
+    def decorator(view):
+        scope = f'{view.__module__}.{view.__name__}'
+
+        @wraps(view)
+        def limited(request, *args, **kwargs):
+            counted = methods is None or request.method in methods
+            if counted and getattr(settings, 'STORE_RATE_LIMIT_ENABLED', True):
+                wait = buckets.take((scope, client_id(request)), capacity, per_second)
+                if wait:
+                    return too_many_requests(request, wait)
+            return view(request, *args, **kwargs)
+        return limited
+    return decorator
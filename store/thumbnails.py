@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from . import fragments, jobs
+from .models import ImageVariant
+from .routers import primary
+
+logger = logging.getLogger(__name__)
+
+# Widths are CSS pixels at 1x and 2x for the places each image is shown.
+SPECS = {
+    'card': (272, 544),
+    'hero': (1100, 2200),
+    'banner': (1100, 2200),
+    'avatar': (32, 64, 128),
+}
+
+FIELD_SPECS = {
+    ('store.Product', 'image'): ('card', 'hero'),
+    ('store.StoreBanner', 'image'): ('banner',),
+    ('store.UserProfile', 'avatar'): ('avatar',),
+}
+
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+_executor = None
+
+
+def _cache_key(source):
+    digest = hashlib.md5(source.encode()).hexdigest()
+    return f"store:variants:{digest}"
+
+
+def _workers():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'STORE_THUMBNAIL_WORKERS', 2),
+            thread_name_prefix='thumbnails',
+        )
+    return _executor
+
+
+def variant_name(source, width, content_hash, extension):
+    directory, filename = posixpath.split(source)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, 'variants', f"{stem}-{width}w.{content_hash}.{extension}")
+
+
+def _render(image, width, pil_format, options):
+    resized = image
+    if image.width > width:
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.LANCZOS)
+    if pil_format == 'JPEG' and resized.mode != 'RGB':
+        resized = resized.convert('RGB')
+    buffer = BytesIO()
+    resized.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def generate(source, specs, force=False):
+    """Write every missing variant of one stored image and return how many were created."""
+    existing = set(
+        ImageVariant.objects.filter(source=source).values_list('spec', 'format', 'width')
+    )
+    wanted = {(spec, extension) for spec in specs for extension, pil_format, options in FORMATS}
+    if not force and wanted <= {(spec, extension) for spec, extension, width in existing}:
+        return 0
+
+    with default_storage.open(source, 'rb') as handle:
+        data = handle.read()
+    content_hash = hashlib.sha256(data).hexdigest()[:12]
+
+    with Image.open(BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+
+    created = []
+    for spec in specs:
+        # Never upscale: widths beyond the original collapse onto the original width.
+        widths = sorted({min(width, image.width) for width in SPECS[spec]})
+        for extension, pil_format, options in FORMATS:
+            for width in widths:
+                if not force and (spec, extension, width) in existing:
+                    continue
+                name = variant_name(source, width, content_hash, extension)
+                if not default_storage.exists(name):
+                    name = default_storage.save(name, ContentFile(_render(image, width, pil_format, options)))
+                created.append(ImageVariant(source=source, spec=spec, format=extension, width=width, name=name))
+
+    if created:
+        with transaction.atomic():
+            if force:
+                ImageVariant.objects.filter(source=source, spec__in=specs).delete()
+            ImageVariant.objects.bulk_create(created, ignore_conflicts=True)
+        cache.delete(_cache_key(source))
+        # Markup cached before the variants existed points at the original upload.
+        fragments.bump(fragments.IMAGES)
+    return len(created)
+
+
+def _generate_in_worker(source, specs):
+    close_old_connections()
+    try:
+        generate(source, specs)
+    except Exception:
+        logger.exception("Could not build image variants for %s", source)
+    finally:
+        close_old_connections()
+
+
+def schedule(source, specs):
+    if not source:
+        return
+    if getattr(settings, 'STORE_THUMBNAILS_EAGER', False):
+        generate(source, specs)
+        return
+    # Wait for the upload's transaction to commit so the worker can see the row it belongs to.
+    transaction.on_commit(lambda: _workers().submit(_generate_in_worker, source, specs))
+
+
+def schedule_batch(sources, specs):
+    """Queue one job for many images, so a bulk import keeps no per-image work in memory."""
+    sources = sorted(set(filter(None, sources)))
+    if not sources:
+        return
+    if getattr(settings, 'STORE_THUMBNAILS_EAGER', False):
+        for source in sources:
+            generate(source, specs)
+        return
+    jobs.enqueue('build_thumbnails', sources=sources, specs=list(specs))
+
+
+def variants_for(source):
+    """Return {spec: {format: [(width, url), ...]}} for a stored image, cached."""
+    if not source:
+        return {}
+    key = _cache_key(source)
+    variants = cache.get(key)
+    if variants is None:
+        variants = {}
+        with primary():
+            rows = list(ImageVariant.objects.filter(source=source).order_by('width').values_list('spec', 'format', 'width', 'name'))
+        for spec, extension, width, name in rows:
+            variants.setdefault(spec, {}).setdefault(extension, []).append((width, default_storage.url(name)))
+        cache.set(key, variants, CACHE_TIMEOUT)
+    return variants
+
+
+def variant_url(field, spec, width, extension='jpeg'):
+    """Closest variant at least `width` wide, falling back to the original upload."""
+    if not field:
+        return ''
+    candidates = variants_for(field.name).get(spec, {}).get(extension, [])
+    for candidate_width, url in candidates:
+        if candidate_width >= width:
+            return url
+    if candidates:
+        return candidates[-1][1]
+    return field.url
@@ -7,17 +7,24 @@ urlpatterns = [
     path('', views.login_user, name='login'),
     path('register/', views.register_user, name='register'),
     path('home/', views.product_list, name='product-list'),
+    path('home/page/', views.product_list_page, name='product-list-page'),
     path('logout/', views.logout_user, name='logout'),
     path('add-to-cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('cart/', views.cart_detail, name='cart_detail'),
     path('cart/remove/<int:cart_item_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('checkout/', views.checkout, name='checkout'),
     path('profile/', views.view_profile, name='view_profile'),
+    path('profile/export/<str:kind>/', views.export_history, name='export_history'),
     path('wallet/topup/', views.top_up_wallet, name='top_up_wallet'),
     path('repository/', views.repository, name='repository'),
     path('refund/<int:transaction_id>', views.refund_game, name='refund_game'),
     path('wishlist/', views.wishlist_view, name='wishlist_view'),
     path('wishlist/add/<int:product_id>/', views.add_to_wishlist, name='add_to_wishlist'),
     path('wishlist/remove/<int:product_id>/', views.remove_from_wishlist, name='remove_from_wishlist'),
+    path('live/', views.live_events, name='live_events'),
     path('product/<int:product_id>/', views.product_detail, name='product_detail'),
+    path('product/<int:product_id>/reviews/', views.product_reviews_page, name='product_reviews_page'),
+    path('perf/', views.performance_report, name='performance_report'),
+    path('dashboard/sales/', views.sales_dashboard, name='sales_dashboard'),
+    path('dashboard/exports/<str:kind>/', views.staff_export, name='staff_export'),
 ]
\ No newline at end of file
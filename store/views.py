@@ -1,58 +1,127 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import AuthenticationForm
+from django.contrib.auth.views import redirect_to_login
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from .forms import CustomUserCreationForm
 from .models import Product
 from django.contrib.auth.decorators import login_required
-from django.shortcuts import get_object_or_404
-from .models import Product, Cart, CartItem, UserProfile, UserLibrary, Transaction, Wishlist, Review, StoreBanner, CATEGORY_CHOICES
-from django.db.models import Q
-
-
-def product_list(request):
+from django.contrib.admin.views.decorators import staff_member_required
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from .models import Product, Cart, CartItem, UserProfile, UserLibrary, Transaction, Wishlist, Review, StoreBanner, WalletEntry, CATEGORY_CHOICES
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from . import analytics, exports, header, jobs, live, ownership, pagination, pricing, principal, ratings, recommendations, search, shelves, wallet
+from .fragments import cache_anonymous_page
+from .idempotency import idempotent
+from .middleware import recorder
+from .routers import choose_replica, read_replica
+from .throttle import rate_limit
+from .checkout import checkout as checkout_cart, CheckoutError, EmptyCart, InsufficientFunds
+
+SEARCH_RESULT_LIMIT = 500
+REVIEW_PAGE_SIZE = 10
+SHELF_LIMIT = 3
+ALSO_BOUGHT_LIMIT = 6
+HOME_SHELVES = (shelves.BESTSELLERS, shelves.TOP_RATED, shelves.NEW)
+
+
+def wants_json(request):
+    return request.headers.get('Accept') == 'application/json'
+
+
+def reply(request, level, message, to, status=200, **data):
+    """Redirect with a flash message, or answer a fetch() from an open page with JSON instead."""
+    if wants_json(request):
+        return JsonResponse(dict(data, message=message), status=status)
+    getattr(messages, level)(request, message)
+    return redirect(to)
+
+
+async def resolve_user(request):
+    # auser() and the lazy request.user cache separately; share one lookup with the templates.
+    request.user = await request.auser()
+    return request.user
+
+
+def catalog_page(request, user):
     query = request.GET.get('q')
-    products = Product.objects.all()
+    cursor = request.GET.get('cursor')
 
     if query:
-
-        search_category_code = None
-        for code, name in CATEGORY_CHOICES:
-            if query.lower() in name.lower():
-                search_category_code = code
-                break
-
-        products = products.filter(
-            Q(name__icontains=query) |
-            Q(category__icontains=query) |
-            Q(category=search_category_code)
-        )
-
-    banner = StoreBanner.objects.filter(is_active=True).first()
-    featured_game = Product.objects.filter(is_featured=True).first()
-
-    cart_count = 0
-    if request.user.is_authenticated:
-        cart = Cart.objects.filter(user=request.user).first()
-        if cart:
-            for item in cart.cartitem_set.all():
-                cart_count += item.quantity
-
-    return render(request, 'store/product_list.html', {
+        ranked = search.search(query, limit=SEARCH_RESULT_LIMIT)
+        page, next_cursor = pagination.ranked_page(ranked, cursor)
+        products = search.ranked_products(page)
+    else:
+        products, next_cursor = pagination.keyset_page(Product.objects.select_related('rating'), cursor)
+
+    ownership.for_user(user).annotate(products)
+    return products, next_cursor
+
+
+def storefront_shelves(request, user):
+    # The ranked rows only make sense on the landing page, not in search results or later pages.
+    landing = not request.GET.get('q') and not request.GET.get('cursor')
+    membership = ownership.for_user(user)
+    extra = {}
+    if landing and user.is_authenticated:
+        extra[recommendations.PERSONAL_SHELF] = [
+            product_id for product_id in recommendations.pick_ids(user)
+            if not membership.owns(product_id) and not membership.wishes(product_id)
+        ]
+    rows = shelves.products((shelves.FEATURED,) + (HOME_SHELVES if landing else ()), limit=SHELF_LIMIT, extra=extra)
+    for products in rows.values():
+        membership.annotate(products)
+    return rows
+
+
+@cache_anonymous_page
+@read_replica
+async def product_list(request):
+    query = request.GET.get('q')
+    user = await resolve_user(request)
+    # Independent lookups are awaited together; render() stays sync because templates may query lazily.
+    (products, next_cursor), banner, rows = await asyncio.gather(
+        sync_to_async(catalog_page)(request, user),
+        StoreBanner.objects.filter(is_active=True).afirst(),
+        sync_to_async(storefront_shelves)(request, user),
+    )
+    # Every price on the page, grid and shelves alike, comes from one lookup.
+    await sync_to_async(pricing.apply)(products, *rows.values())
+    featured = rows.pop(shelves.FEATURED)
+    titles = dict(shelves.TITLES, **{recommendations.PERSONAL_SHELF: recommendations.PERSONAL_TITLE})
+
+    return await sync_to_async(render)(request, 'store/product_list.html', {
         'products': products,
         'query': query,
-        'cart_count': cart_count,
+        'next_cursor': next_cursor,
         'banner': banner,
-        'featured_game': featured_game,
+        'featured_game': featured[0] if featured else None,
+        'shelves': [(titles[name], rows[name]) for name in (recommendations.PERSONAL_SHELF,) + HOME_SHELVES if rows.get(name)],
         'categories': CATEGORY_CHOICES
     })
 
+def product_list_page(request):
+    products, next_cursor = catalog_page(request, request.user)
+    pricing.apply(products)
+    html = render_to_string('store/includes/product_cards.html', {'products': products}, request=request)
+    return JsonResponse({'html': html, 'next_cursor': next_cursor, 'count': len(products)})
+
 def register_user(request):
     if request.method == 'POST':
         form = CustomUserCreationForm(request.POST)
         if form.is_valid():
-            user = form.save()
-            UserProfile.objects.create(user=user)
+            # The profile holds the wallet that every page reads, so it is created with the account;
+            # only the welcome email waits for a worker.
+            with transaction.atomic():
+                user = form.save()
+                UserProfile.objects.create(user=user)
+                jobs.enqueue('send_welcome_email', key=f'welcome:{user.id}', user_id=user.id)
             username = form.cleaned_data.get('username')
             messages.success(request, f'Account created for {username}! You can now log in.')
             return redirect('store:product-list')
@@ -81,7 +150,7 @@ def login_user(request):
     else:
         form = AuthenticationForm()
 
-    return render(request,'store/Login.html', {'form': form})
+    return render(request,'store/login.html', {'form': form})
 
 def logout_user(request):
     logout(request)
@@ -89,31 +158,33 @@ def logout_user(request):
     return redirect('store:product-list')
 
 @login_required
+@idempotent
+@rate_limit('30/m', methods=None)
 def add_to_cart(request, product_id):
     product = get_object_or_404(Product, id=product_id)
 
-    library, created = UserLibrary.objects.get_or_create(user=request.user)
-    if library.products.filter(id=product_id).exists():
-        messages.warning(request, f"You already own {product.name}. It is in your Repository.")
-        return redirect('store:product-list')
+    if ownership.for_user(request.user).owns(product.id):
+        return reply(request, 'warning', f"You already own {product.name}. It is in your Repository.", 'store:product-list',
+                     status=409, product_id=product.id, in_cart=False)
 
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_item, item_created = CartItem.objects.get_or_create(cart=cart, product=product)
+    cart_id = principal.of(request.user).cart_id
+    if cart_id is None:
+        cart_id = Cart.objects.get_or_create(user=request.user)[0].id
+    cart_item, item_created = CartItem.objects.get_or_create(cart_id=cart_id, product=product)
 
     if not item_created:
-        messages.info(request, "This game is already in your cart!")
-        return redirect('store:cart_detail')
+        return reply(request, 'info', "This game is already in your cart!", 'store:cart_detail', product_id=product.id, in_cart=True)
 
-    messages.success(request, f"Added {product.name} to your cart!")
-    return redirect('store:product-list')
+    return reply(request, 'success', f"Added {product.name} to your cart!", 'store:product-list', product_id=product.id, in_cart=True)
 
 @login_required
 def cart_detail(request):
-    cart, created = Cart.objects.get_or_create(user=request.user)
-    cart_items = cart.cartitem_set.all()
-    total_price = sum(item.product.price for item in cart_items)
+    account = principal.of(request.user)
+    cart_items = list(CartItem.objects.filter(cart_id=account.cart_id).select_related('product')) if account.cart_id else []
+    pricing.apply([item.product for item in cart_items])
+    total_price = sum(pricing.unit_price(item.product) * item.quantity for item in cart_items)
 
-    profile, created = UserProfile.objects.get_or_create(user=request.user)
+    profile = account.profile or UserProfile.objects.get_or_create(user=request.user)[0]
 
     return render(request, 'store/cart.html', {
         'cart_items': cart_items,
@@ -125,55 +196,38 @@ def cart_detail(request):
 def remove_from_cart(request, cart_item_id):
     cart_item = get_object_or_404(CartItem, id=cart_item_id, cart__user=request.user)
     cart_item.delete()
-
-    messages.success(request, "Item removed from the cart.")
-    return redirect('store:cart_detail')
+    return reply(request, 'success', "Item removed from the cart.", 'store:cart_detail', product_id=cart_item.product_id, in_cart=False)
 
 @login_required
+@idempotent
+@rate_limit('5/m', methods=None)
 def checkout(request):
-    cart = get_object_or_404(Cart, user=request.user)
-    cart_items = cart.cartitem_set.all()
-
-    if not cart_items:
+    try:
+        receipt = checkout_cart(request.user)
+    except EmptyCart:
         messages.error(request, "Your cart is empty.")
         return redirect('store:product-list')
+    except InsufficientFunds as error:
+        messages.error(request, f"Insufficient funds! You need ₱{error.needed} more.")
+        return redirect('store:cart_detail')
+    except CheckoutError as error:
+        messages.error(request, str(error))
+        return redirect('store:cart_detail')
 
-    total_price = sum(item.get_total_price() for item in cart_items)
-
-    profile, created = UserProfile.objects.get_or_create(user=request.user)
-
-    if profile.balance >= total_price:
-        profile.balance -= total_price
-        profile.save()
-
-        library, created = UserLibrary.objects.get_or_create(user=request.user)
-
-        for item in cart_items:
-            library.products.add(item.product)
-
-            Transaction.objects.create(
-                user=request.user,
-                product=item.product,
-                price=item.product.price
-            )
-
-        cart_items.delete()
+    if wants_json(request):
+        return JsonResponse(receipt.as_dict())
 
-        messages.success(request, f"Thank you for purchasing! ₱{total_price} Added to your Repository.")
-        return redirect('store:repository')
-    else:
-        needed = total_price - profile.balance
-        messages.error(request, f"Insufficient funds! You need ₱{needed} more.")
-        return redirect('store:cart_detail')
+    messages.success(request, f"Thank you for purchasing! ₱{receipt.total} Added to your Repository.")
+    return redirect('store:repository')
 
 @login_required
 def view_profile(request):
-    profile, created = UserProfile.objects.get_or_create(user=request.user)
-    transactions = Transaction.objects.filter(user=request.user).order_by('-date')[:10]
+    profile = principal.of(request.user).profile or UserProfile.objects.get_or_create(user=request.user)[0]
+    transactions = Transaction.objects.filter(user=request.user).select_related('product').order_by('-date')[:10]
 
     if request.method == 'POST' and request.FILES.get('avatar'):
         profile.avatar = request.FILES['avatar']
-        profile.save()
+        profile.save(update_fields=['avatar'])
         messages.success(request, "Avatar updated successfully!")
         return redirect('store:view_profile')
 
@@ -184,13 +238,16 @@ def view_profile(request):
     })
 
 @login_required
+@idempotent
+@rate_limit('10/m')
 def top_up_wallet(request):
     if request.method == 'POST':
-        amount = int(request.POST.get('amount'))
-        profile, created = UserProfile.objects.get_or_create(user=request.user)
-
-        profile.balance += amount
-        profile.save()
+        try:
+            amount = int(request.POST.get('amount'))
+            wallet.credit(request.user, amount, WalletEntry.TOP_UP)
+        except (TypeError, ValueError, wallet.WalletError):
+            messages.error(request, "Please choose a valid top-up amount.")
+            return redirect('store:top_up_wallet')
 
         messages.success(request, f"Successfully added ₱{amount} to your Crib Wallet!")
         return redirect('store:view_profile')
@@ -199,42 +256,60 @@ def top_up_wallet(request):
     return render(request, 'store/topup.html', {'amounts': amounts})
 
 @login_required
-def repository(request):
-    library, created = UserLibrary.objects.get_or_create(user=request.user)
-    games = library.products.all()
-    return render(request, 'store/repository.html', {'games': games})
+@read_replica
+async def repository(request):
+    user = await resolve_user(request)
+    library_id = (await principal.aof(user)).library_id
+    if library_id is None:
+        library, created = await UserLibrary.objects.aget_or_create(user=user)
+        library_id = library.id
+    games = [game async for game in Product.objects.filter(userlibrary=library_id)]
+    return await sync_to_async(render)(request, 'store/repository.html', {'games': games})
 
 @login_required
+@idempotent
+@rate_limit('10/m', methods=None)
 def refund_game(request, transaction_id):
-    transaction = get_object_or_404(Transaction, id=transaction_id, user=request.user)
+    purchase = get_object_or_404(Transaction.objects.select_related('product'), id=transaction_id, user=request.user)
+
+    with transaction.atomic():
+        # Deleting first means a double-submitted refund finds nothing left to refund.
+        deleted, _ = Transaction.objects.filter(id=purchase.id).delete()
+        if not deleted:
+            raise Http404("This purchase has already been refunded.")
+        entry = wallet.credit(request.user, purchase.price, WalletEntry.REFUND, product=purchase.product)
+        jobs.enqueue('record_refund', key=f'refund:{purchase.id}', product_id=purchase.product_id,
+                     price=str(purchase.price), purchased_at=purchase.date.isoformat(), refunded_at=entry.created_at.isoformat())
+        jobs.enqueue('send_refund_notice', key=f'refund-notice:{purchase.id}', user_id=request.user.id,
+                     name=purchase.product.name, amount=str(purchase.price))
 
-    profile = UserProfile.objects.get(user=request.user)
-    profile.balance += transaction.price
-    profile.save()
-
-    library = UserLibrary.objects.get(user=request.user)
-    library.products.remove(transaction.product)
-
-    game_name = transaction.product.name
-    transaction.delete()
+        library, created = UserLibrary.objects.get_or_create(user=request.user)
+        library.products.remove(purchase.product)
 
-    messages.success(request, f"Successfully refunded {game_name}. ₱{transaction.price} has been returned to your wallet.")
+    messages.success(request, f"Successfully refunded {purchase.product.name}. ₱{purchase.price} has been returned to your wallet.")
     return redirect('store:view_profile')
 
 @login_required
-def wishlist_view(request):
-    wishlist, created = Wishlist.objects.get_or_create(user=request.user)
-    products = wishlist.products.all()
-    return render(request, 'store/wishlist.html', {'products': products})
+@read_replica
+async def wishlist_view(request):
+    user = await resolve_user(request)
+    wishlist_id = (await principal.aof(user)).wishlist_id
+    if wishlist_id is None:
+        wishlist, created = await Wishlist.objects.aget_or_create(user=user)
+        wishlist_id = wishlist.id
+    products = [product async for product in Product.objects.filter(wishlist=wishlist_id)]
+    await sync_to_async(pricing.apply)(products)
+    return await sync_to_async(render)(request, 'store/wishlist.html', {'products': products})
 
 @login_required
+@idempotent
+@rate_limit('30/m', methods=None)
 def add_to_wishlist(request, product_id):
     product = get_object_or_404(Product, id=product_id)
     wishlist, created = Wishlist.objects.get_or_create(user=request.user)
 
     wishlist.products.add(product)
-    messages.success(request, f"Added {product.name} to your Wishlist!")
-    return redirect('store:product-list')
+    return reply(request, 'success', f"Added {product.name} to your Wishlist!", 'store:product-list', product_id=product.id, wishlisted=True)
 
 @login_required
 def remove_from_wishlist(request, product_id):
@@ -242,38 +317,119 @@ def remove_from_wishlist(request, product_id):
     wishlist = Wishlist.objects.get(user=request.user)
 
     wishlist.products.remove(product)
-    messages.success(request, "Removed from Wishlist.")
-    return redirect('store:wishlist_view')
-
-
-def product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    reviews = Review.objects.filter(product=product).order_by('-created_at')
-    user_owns = False
-    if request.user.is_authenticated:
-        library, created = UserLibrary.objects.get_or_create(user=request.user)
-        if library.products.filter(id=product.id).exists():
-            user_owns = True
+    return reply(request, 'success', "Removed from Wishlist.", 'store:wishlist_view', product_id=product.id, wishlisted=False)
+
+
+@read_replica
+async def product_detail(request, product_id):
+    user = await resolve_user(request)
+    if request.method == "POST" and not user.is_authenticated:
+        # Only signed-in owners may review; the page itself is rendered for GETs alone.
+        return redirect_to_login(request.get_full_path())
+    if request.method == "POST":
+        product, membership = await asyncio.gather(
+            aget_object_or_404(Product, id=product_id),
+            sync_to_async(ownership.for_user)(user),
+        )
+        reviews, next_reviews_cursor, also_bought = None, None, None
+    else:
+        product, membership, (reviews, next_reviews_cursor), also_bought = await asyncio.gather(
+            aget_object_or_404(Product.objects.select_related('rating'), id=product_id),
+            sync_to_async(ownership.for_user)(user),
+            sync_to_async(review_page)(request, product_id),
+            sync_to_async(recommendations.also_bought)(product_id, ALSO_BOUGHT_LIMIT),
+        )
+    user_owns = membership.owns(product.id)
 
-    if request.method == "POST" and request.user.is_authenticated:
+    if request.method == "POST" and user.is_authenticated:
         if not user_owns:
             messages.error(request, "You must own the game to review it!")
             return redirect('store:product_detail', product_id=product.id)
 
-        rating = request.POST.get('rating')
+        rating = ratings.clamp_stars(request.POST.get('rating'))
         comment = request.POST.get('comment')
 
-        Review.objects.create(
+        await Review.objects.acreate(
             product=product,
-            user=request.user,
+            user=user,
             rating=rating,
             comment=comment
         )
         messages.success(request, "Review posted!")
         return redirect('store:product_detail', product_id=product.id)
 
-    return render(request, 'store/product_detail.html', {
+    await sync_to_async(pricing.apply)([product], also_bought or [])
+    return await sync_to_async(render)(request, 'store/product_detail.html', {
         'product': product,
+        'rating': getattr(product, 'rating', None),
         'reviews': reviews,
-        'user_owns': user_owns
-    })
\ No newline at end of file
+        'next_reviews_cursor': next_reviews_cursor,
+        'also_bought': also_bought,
+        'user_owns': user_owns,
+        'user_wishes': membership.wishes(product.id)
+    })
+
+def review_page(request, product_id):
+    reviews = Review.objects.filter(product_id=product_id).select_related('user', 'user__userprofile')
+    return pagination.keyset_page(
+        reviews, request.GET.get('reviews'), size=REVIEW_PAGE_SIZE, order_by=('-created_at', '-id')
+    )
+
+def product_reviews_page(request, product_id):
+    product = get_object_or_404(Product, id=product_id)
+    reviews, next_cursor = review_page(request, product.id)
+    html = render_to_string('store/includes/review_cards.html', {'reviews': reviews}, request=request)
+    return JsonResponse({'html': html, 'next_cursor': next_cursor, 'count': len(reviews)})
+
+@staff_member_required
+def performance_report(request):
+    if request.method == 'POST' and request.POST.get('reset'):
+        recorder.reset()
+    return JsonResponse(recorder.summary())
+
+@staff_member_required
+def sales_dashboard(request):
+    try:
+        days = min(max(int(request.GET.get('days', 30)), 1), 365)
+    except ValueError:
+        days = 30
+    report = analytics.dashboard(days)
+    if request.GET.get('format') == 'json':
+        return JsonResponse(report)
+    return render(request, 'store/sales_dashboard.html', {'report': report})
+
+def export_response(request, kind, fmt, user, filename):
+    if kind not in exports.COLUMNS or fmt not in exports.FORMATS:
+        raise Http404("No such export.")
+    # The rows are read while the response streams, after the view has returned, so the
+    # replica is chosen here rather than by read_replica.
+    # Under ASGI only an async iterator is streamed; a sync one would be read into memory first.
+    stream = exports.astream if isinstance(request, ASGIRequest) else exports.stream
+    rows = stream(kind, fmt, user, using=choose_replica() or 'default')
+    response = StreamingHttpResponse(rows, content_type=exports.FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+@login_required
+@rate_limit('10/m', methods=None)
+def export_history(request, kind):
+    return export_response(request, kind, request.GET.get('format', 'csv'), request.user, f'pycrib-{kind}-{request.user.username}')
+
+@staff_member_required
+def staff_export(request, kind):
+    return export_response(request, kind, request.GET.get('format', 'csv'), None, f'pycrib-{kind}-all-users')
+
+@login_required
+async def live_events(request):
+    """Server-sent events with the user's cart count, balance and library/wishlist changes, for open tabs."""
+    user = await resolve_user(request)
+
+    async def snapshot():
+        counters = await sync_to_async(header.get_snapshot)(user)
+        return [('hello', {'cart_count': counters['cart_count'], 'balance': counters['balance']})]
+
+    response = StreamingHttpResponse(live.stream(live.user_group(user.id), snapshot), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Tells nginx not to buffer the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,56 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import UserProfile, WalletEntry
+
+
+class WalletError(Exception):
+    pass
+
+
+class InsufficientFunds(WalletError):
+    def __init__(self, total, balance):
+        self.total = total
+        self.balance = balance
+        self.needed = total - balance
+        super().__init__(f"Insufficient funds: need ₱{self.needed} more.")
+
+
+def _balance(user):
+    return UserProfile.objects.filter(user=user).values_list('balance', flat=True).get()
+
+
+def credit(user, amount, kind, product=None):
+    amount = Decimal(amount)
+    if amount <= 0:
+        raise WalletError("Credit amount must be positive.")
+
+    with transaction.atomic():
+        # A single UPDATE ... SET balance = balance + x, so concurrent credits never overwrite each other.
+        updated = UserProfile.objects.filter(user=user).update(balance=F('balance') + amount)
+        if not updated:
+            UserProfile.objects.get_or_create(user=user)
+            UserProfile.objects.filter(user=user).update(balance=F('balance') + amount)
+
+        return WalletEntry.objects.create(
+            user=user, kind=kind, amount=amount, balance_after=_balance(user), product=product
+        )
+
+
+def debit(user, amount, kind, product=None):
+    amount = Decimal(amount)
+    if amount < 0:
+        raise WalletError("Debit amount cannot be negative.")
+
+    with transaction.atomic():
+        # The balance check and the subtraction happen in the same UPDATE, so the wallet can never go negative.
+        updated = UserProfile.objects.filter(user=user, balance__gte=amount).update(balance=F('balance') - amount)
+        if not updated:
+            profile, created = UserProfile.objects.get_or_create(user=user)
+            raise InsufficientFunds(amount, profile.balance)
+
+        return WalletEntry.objects.create(
+            user=user, kind=kind, amount=-amount, balance_after=_balance(user), product=product
+        )